@@ -0,0 +1,18 @@
+"""
+ASGI config for acmeproxy project.
+
+It exposes the ASGI callable as a module-level variable named ``application``.
+See acmeproxy/proxy/asgi.py for how requests are served.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "acmeproxy.settings")
+
+django.setup(set_prefix=False)
+
+from acmeproxy.proxy.asgi import ASGIHandler  # noqa: E402 isort:skip
+
+application = ASGIHandler()
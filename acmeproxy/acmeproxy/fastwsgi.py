@@ -0,0 +1,18 @@
+"""
+WSGI config serving only the API, through the lean views in
+acmeproxy.proxy.fastpath and the middleware in ACMEPROXY_FAST_MIDDLEWARE.
+
+The admin needs the full middleware chain, so keep serving it with wsgi.py.
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "acmeproxy.settings")
+
+django.setup(set_prefix=False)
+
+from acmeproxy.proxy.fastpath import FastAPIHandler  # noqa: E402 isort:skip
+
+application = FastAPIHandler()
@@ -23,6 +23,7 @@ INSTALLED_APPS = (
 )
 
 MIDDLEWARE = (
+    "acmeproxy.proxy.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -60,6 +61,9 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": os.path.join(BASE_DIR, "db.sqlite3"),
+        # reuse connections rather than reconnecting (and setting the SQLite
+        # pragmas in acmeproxy.proxy.database) for every request
+        "CONN_MAX_AGE": 600,
     }
 }
 
@@ -0,0 +1,25 @@
+"""
+Clients for the acmeproxy API, for ACME client hooks and provisioning scripts.
+They only need the standard library, so they can be used without installing
+Django.
+
+    with AcmeproxyClient("https://acme-proxy-ns1.example.com") as client:
+        client.publish_responses([(name, response, secret), ...])
+
+AsyncAcmeproxyClient has the same methods as coroutines.
+"""
+
+from .aio import AsyncAcmeproxyClient
+from .base import BULK_LIMIT, AcmeproxyError
+from .configuration import ConfigurationError, domain_configuration, load_configuration
+from .sync import AcmeproxyClient
+
+__all__ = [
+    "AcmeproxyClient",
+    "AcmeproxyError",
+    "AsyncAcmeproxyClient",
+    "BULK_LIMIT",
+    "ConfigurationError",
+    "domain_configuration",
+    "load_configuration",
+]
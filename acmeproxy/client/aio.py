@@ -0,0 +1,152 @@
+import asyncio
+import http.client
+
+from .base import AcmeproxyError, BaseClient
+
+STALE_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+# asyncio's timeouts and incomplete reads aren't OSErrors before Python 3.11
+TRANSPORT_ERRORS = (OSError, EOFError, asyncio.TimeoutError, http.client.HTTPException)
+
+
+async def read_response(reader):
+    """
+    Returns the status, headers (with lowercased names) and body of an HTTP/1.1
+    response, and whether the server will close the connection after it.
+    """
+
+    line = await reader.readline()
+    if not line:
+        raise http.client.RemoteDisconnected(
+            "Remote end closed connection without response"
+        )
+    try:
+        version, status = line.decode("latin-1").split(None, 2)[:2]
+        status = int(status)
+    except ValueError:
+        raise http.client.BadStatusLine(line)
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+
+    will_close = (
+        version == "HTTP/1.0" or headers.get("connection", "").lower() == "close"
+    )
+    if headers.get("transfer-encoding", "").lower() == "chunked":
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b";")[0], 16)
+            if size == 0:
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b"".join(chunks)
+    elif "content-length" in headers:
+        body = await reader.readexactly(int(headers["content-length"]))
+    else:
+        body = await reader.read()
+        will_close = True
+    return status, headers, body, will_close
+
+
+class AsyncAcmeproxyClient(BaseClient):
+    """
+    A client whose methods are coroutines, for use within one event loop.
+    Requests made concurrently each use their own connection. The timeout
+    applies to connecting and to reading the whole response.
+
+    Use it as an async context manager, or await close(), to close the
+    connections kept open.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.idle = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+        return False
+
+    async def close(self):
+        idle, self.idle = self.idle, []
+        for reader, writer in idle:
+            writer.close()
+
+    async def connect(self):
+        return await asyncio.wait_for(
+            asyncio.open_connection(
+                self.host,
+                self.port,
+                ssl=self.ssl_context,
+                server_hostname=self.host if self.https else None,
+            ),
+            self.timeout,
+        )
+
+    async def exchange(self, connection, path, body):
+        reader, writer = connection
+        request = ["POST %s HTTP/1.1" % path]
+        request.extend("%s: %s" % header for header in self.headers(body).items())
+        try:
+            writer.write(("\r\n".join(request) + "\r\n\r\n").encode("latin-1") + body)
+            await writer.drain()
+            status, headers, content, will_close = await asyncio.wait_for(
+                read_response(reader), self.timeout
+            )
+        except BaseException:
+            writer.close()
+            raise
+
+        if will_close or len(self.idle) >= self.pool_size:
+            writer.close()
+        else:
+            self.idle.append(connection)
+        return status, content
+
+    async def send(self, path, body):
+        """
+        Returns the status and body of the response to a request, reusing an
+        idle connection if there is one.
+        """
+
+        if self.idle:
+            try:
+                return await self.exchange(self.idle.pop(), path, body)
+            except STALE_ERRORS:
+                pass
+        return await self.exchange(await self.connect(), path, body)
+
+    async def call(self, operation, data, idempotent=True):
+        path, body = self.encode(operation, data)
+        attempt = 0
+        while True:
+            try:
+                status, content = await self.send(path, body)
+            except TRANSPORT_ERRORS as e:
+                if not self.should_retry(attempt, idempotent, error=e):
+                    raise AcmeproxyError(
+                        "Could not reach %s: %s" % (self.endpoint, e)
+                    ) from e
+            else:
+                if not self.should_retry(attempt, idempotent, status=status):
+                    return self.decode(status, content)
+            await asyncio.sleep(self.delay(attempt))
+            attempt += 1
+
+    async def call_batches(self, operation, key, entries, extra=None, idempotent=True):
+        results = []
+        for batch in self.batches(entries):
+            data = dict(extra or {})
+            data[key] = batch
+            results.extend(await self.call(operation, data, idempotent))
+        return results
@@ -0,0 +1,194 @@
+"""
+The parts of the clients which don't depend on how requests are sent: the
+API's operations, decoding of their results, and when to retry.
+"""
+
+import json
+import random
+import ssl
+from urllib.parse import urlsplit
+
+# the most entries the bulk endpoints accept in a single request, larger
+# batches are split into several
+BULK_LIMIT = 1000
+
+# statuses for which a request is retried, as the API answers 500 when the
+# database was locked or failed, and its proxy 502 to 504 when the API is
+# being restarted or is overloaded
+RETRY_STATUSES = (500, 502, 503, 504)
+
+
+class AcmeproxyError(Exception):
+    """
+    The API refused or failed a request. status is the HTTP status code (None
+    if no response was received) and result the decoded response, if any.
+    """
+
+    def __init__(self, message, status=None, result=None):
+        super().__init__(message)
+        self.status = status
+        self.result = result
+
+
+class BaseClient:
+    """
+    A client for the acmeproxy API at endpoint (such as
+    "https://acme-proxy-ns1.example.com"). Each request may take up to timeout
+    seconds, and is retried up to retries times after a growing pause
+    starting from about backoff seconds. Up to pool_size idle connections are
+    kept open for reuse.
+
+    Subclasses send the requests by implementing call, which the methods
+    return the result of, and call_batches.
+    """
+
+    def __init__(
+        self,
+        endpoint,
+        timeout=10,
+        retries=3,
+        backoff=0.5,
+        pool_size=4,
+        ssl_context=None,
+    ):
+        url = urlsplit(endpoint)
+        if url.scheme not in ("http", "https") or not url.hostname:
+            raise ValueError("Invalid endpoint %r" % endpoint)
+        self.endpoint = endpoint
+        self.https = url.scheme == "https"
+        self.host = url.hostname
+        self.netloc = url.netloc.rpartition("@")[2]
+        self.port = url.port or (443 if self.https else 80)
+        self.prefix = url.path.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.pool_size = pool_size
+        self.ssl_context = None
+        if self.https:
+            self.ssl_context = ssl_context or ssl.create_default_context()
+
+    def headers(self, body):
+        return {
+            "Host": self.netloc,
+            "Content-Type": "application/json",
+            "Content-Length": str(len(body)),
+            "Accept": "application/json",
+            "Connection": "keep-alive",
+        }
+
+    def encode(self, operation, data):
+        return self.prefix + "/" + operation, json.dumps(data).encode("utf-8")
+
+    @staticmethod
+    def decode(status, body):
+        """
+        Returns the result of a response, or raises AcmeproxyError.
+        """
+
+        try:
+            result = json.loads(body.decode("utf-8"))
+        except ValueError:
+            raise AcmeproxyError("Invalid response (HTTP %d)" % status, status)
+
+        if status == 200 and isinstance(result, dict) and "result" in result:
+            return result["result"]
+        error = result.get("error") if isinstance(result, dict) else None
+        # invalid requests are answered with the errors of each field
+        raise AcmeproxyError(
+            "%s (HTTP %d)" % (error or json.dumps(result), status), status, result
+        )
+
+    def should_retry(self, attempt, idempotent, status=None, error=None):
+        """
+        Returns True if a request which failed with status or error is to be
+        sent again.
+
+        Requests which create something (such as a new secret) are only
+        resent when they can't have reached the API, as otherwise the result
+        of the first attempt might be lost.
+        """
+
+        if attempt >= self.retries:
+            return False
+        if status is not None:
+            return idempotent and status in RETRY_STATUSES
+        return idempotent or isinstance(error, ConnectionRefusedError)
+
+    def delay(self, attempt):
+        # jittered, so that clients which failed together don't retry together
+        return self.backoff * (2**attempt) * random.uniform(0.5, 1.5)
+
+    @staticmethod
+    def batches(entries):
+        entries = list(entries)
+        for start in range(0, len(entries), BULK_LIMIT):
+            yield entries[start : start + BULK_LIMIT]
+
+    def create_authorisation(self, name, account_secret=None):
+        """
+        Returns the name and secret of a new authorisation for name, giving
+        the account token account_secret if the API requires one.
+        """
+
+        data = {"name": name}
+        if account_secret is not None:
+            data["secret"] = account_secret
+        return self.call("create_authorisation", data, idempotent=False)
+
+    def create_authorisations(self, names, account_secret=None):
+        """
+        Like create_authorisation for each of names, returning the name and
+        secret of each new authorisation or the name and error of each name
+        which the account doesn't permit.
+        """
+
+        extra = {} if account_secret is None else {"secret": account_secret}
+        return self.call_batches(
+            "create_authorisations", "names", names, extra, idempotent=False
+        )
+
+    def expire_authorisation(self, name, secret):
+        """
+        Replaces the secret of the authorisation for name, returning the new
+        one.
+        """
+
+        return self.call(
+            "expire_authorisation", {"name": name, "secret": secret}, idempotent=False
+        )
+
+    def publish_response(self, name, response, secret):
+        return self.call(
+            "publish_response", {"name": name, "response": response, "secret": secret}
+        )
+
+    def publish_responses(self, responses):
+        """
+        Publishes each of responses, a list of (name, response, secret), and
+        returns the result for each in turn.
+        """
+
+        return self.call_batches(
+            "publish_responses",
+            "responses",
+            [
+                {"name": name, "response": response, "secret": secret}
+                for name, response, secret in responses
+            ],
+        )
+
+    def expire_response(self, name, secret):
+        return self.call("expire_response", {"name": name, "secret": secret})
+
+    def expire_responses(self, names):
+        """
+        Expires the responses for each of names, a list of (name, secret), and
+        returns the result for each in turn.
+        """
+
+        return self.call_batches(
+            "expire_responses",
+            "responses",
+            [{"name": name, "secret": secret} for name, secret in names],
+        )
@@ -0,0 +1,75 @@
+import configparser
+import os
+import stat
+
+SECTION_PREFIX = "domain:"
+
+
+class ConfigurationError(Exception):
+    pass
+
+
+def load_configuration(path):
+    """
+    Returns the endpoint and secret of each domain configured in the
+    acmeproxy.ini at path, keyed on the lowercased domain, like:
+
+      [defaults]
+      endpoint=https://acme-proxy-ns1.example.com
+
+      [domain:example.org]
+      secret=786575b19e29abcad093c8af793a4e2b
+
+    Each domain's section may set its own endpoint, and the defaults section
+    its secret. As the file holds secrets, it is refused if it is world
+    readable.
+    """
+
+    try:
+        if os.stat(path).st_mode & stat.S_IROTH:
+            raise ConfigurationError(
+                "configuration is world readable, fix the file permissions and "
+                "re-create exposed keys"
+            )
+    except FileNotFoundError:
+        raise ConfigurationError("configuration file '%s' does not exist" % path)
+
+    config = configparser.ConfigParser()
+    try:
+        with open(path, encoding="utf-8") as f:
+            config.read_file(f)
+    except (OSError, configparser.Error):
+        raise ConfigurationError(
+            "unable to read the configuration file from '%s'" % path
+        )
+
+    domains = {}
+    for section in config.sections():
+        if not section.lower().startswith(SECTION_PREFIX):
+            continue
+        domains[section[len(SECTION_PREFIX) :].lower()] = {
+            "endpoint": config[section].get(
+                "endpoint", config.get("defaults", "endpoint", fallback=None)
+            ),
+            "secret": config[section].get(
+                "secret", config.get("defaults", "secret", fallback=None)
+            ),
+        }
+    return domains
+
+
+def domain_configuration(domains, domain):
+    """
+    Returns the endpoint and secret configured for domain, or raises
+    ConfigurationError if either is missing.
+    """
+
+    if domain not in domains:
+        raise ConfigurationError("domain '%s' not found in configuration file" % domain)
+    configuration = domains[domain]
+    if configuration["secret"] is None or configuration["endpoint"] is None:
+        raise ConfigurationError(
+            "domain '%s' is missing required configuration, 'endpoint' and "
+            "'secret' must be configured" % domain
+        )
+    return configuration["endpoint"], configuration["secret"]
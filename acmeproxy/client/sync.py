@@ -0,0 +1,102 @@
+import http.client
+import threading
+import time
+
+from .base import AcmeproxyError, BaseClient
+
+# what a reused connection fails with when the server closed it while idle,
+# in which case the request is sent again on a new connection
+STALE_ERRORS = (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError)
+
+
+class AcmeproxyClient(BaseClient):
+    """
+    A client which makes each request in turn, and may be shared by threads.
+    The timeout applies to connecting and to each read of the response.
+
+    Use it as a context manager, or call close(), to close the connections
+    kept open.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.lock = threading.Lock()
+        self.idle = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+    def close(self):
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+    def connect(self):
+        if self.https:
+            return http.client.HTTPSConnection(
+                self.host, self.port, timeout=self.timeout, context=self.ssl_context
+            )
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def exchange(self, connection, path, body):
+        try:
+            connection.request("POST", path, body, self.headers(body))
+            response = connection.getresponse()
+            content = response.read()
+        except BaseException:
+            connection.close()
+            raise
+
+        if not response.will_close:
+            with self.lock:
+                if len(self.idle) < self.pool_size:
+                    self.idle.append(connection)
+                    connection = None
+        if connection is not None:
+            connection.close()
+        return response.status, content
+
+    def send(self, path, body):
+        """
+        Returns the status and body of the response to a request, reusing an
+        idle connection if there is one.
+        """
+
+        with self.lock:
+            connection = self.idle.pop() if self.idle else None
+        if connection is not None:
+            try:
+                return self.exchange(connection, path, body)
+            except STALE_ERRORS:
+                pass
+        return self.exchange(self.connect(), path, body)
+
+    def call(self, operation, data, idempotent=True):
+        path, body = self.encode(operation, data)
+        attempt = 0
+        while True:
+            try:
+                status, content = self.send(path, body)
+            except (OSError, http.client.HTTPException) as e:
+                if not self.should_retry(attempt, idempotent, error=e):
+                    raise AcmeproxyError(
+                        "Could not reach %s: %s" % (self.endpoint, e)
+                    ) from e
+            else:
+                if not self.should_retry(attempt, idempotent, status=status):
+                    return self.decode(status, content)
+            time.sleep(self.delay(attempt))
+            attempt += 1
+
+    def call_batches(self, operation, key, entries, extra=None, idempotent=True):
+        results = []
+        for batch in self.batches(entries):
+            data = dict(extra or {})
+            data[key] = batch
+            results.extend(self.call(operation, data, idempotent))
+        return results
@@ -0,0 +1,11 @@
+import pytest
+
+from acmeproxy.client.tests.standin import StandInServer
+
+
+@pytest.fixture
+def stand_in():
+    server = StandInServer()
+    server.start()
+    yield server
+    server.stop()
@@ -0,0 +1,75 @@
+"""
+A stand-in for the API which records the requests it receives, and answers
+them as told.
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+# instead of a status and result, drops the connection without answering
+DROP = "drop"
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        data = json.loads(body.decode("utf-8"))
+        self.server.requests.append((self.path, data, self.client_address[1]))
+
+        with self.server.lock:
+            reply = self.server.replies.pop(0) if self.server.replies else None
+        if reply == DROP:
+            self.close_connection = True
+            return
+        if reply is None:
+            # the bulk endpoints answer each entry in turn
+            result = data.get("responses", data.get("names", data))
+            status, reply = 200, {"result": result}
+        else:
+            delay, status, reply = reply
+            time.sleep(delay)
+
+        content = json.dumps(reply).encode("utf-8")
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        except ConnectionError:
+            # the client gave up waiting
+            self.close_connection = True
+
+
+class StandInServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StandInHandler)
+        self.lock = threading.Lock()
+        # (path, decoded body, client port) for each request
+        self.requests = []
+        # DROP or (delay, status, result) to answer the next requests with,
+        # before answering with the entries or data sent
+        self.replies = []
+        self.url = "http://127.0.0.1:%d" % self.server_address[1]
+
+    def reply(self, status, result, delay=0):
+        self.replies.append((delay, status, result))
+
+    def start(self):
+        threading.Thread(
+            target=self.serve_forever, kwargs={"poll_interval": 0.01}, daemon=True
+        ).start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
@@ -0,0 +1,124 @@
+import importlib.util
+import os
+
+import pytest
+
+PLUGIN = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..", "plugins", "acmeproxy-certbot.py"
+)
+
+
+@pytest.fixture(scope="module")
+def certbot():
+    spec = importlib.util.spec_from_file_location("acmeproxy_certbot", PLUGIN)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class TestCertbotHook:
+    @pytest.fixture(autouse=True)
+    def configuration(self, tmp_path, stand_in):
+        self.path = tmp_path / "acmeproxy.ini"
+        self.path.write_text(
+            "[defaults]\n"
+            "endpoint=%s\n"
+            "[domain:example.com]\n"
+            "secret=one\n"
+            "[domain:example.org]\n"
+            "secret=two\n" % stand_in.url
+        )
+        self.path.chmod(0o600)
+        self.spool = tmp_path / "spool"
+
+    def hook(self, certbot, hook, domain, challenge="challenge", **environ):
+        environ.update(CERTBOT_DOMAIN=domain, CERTBOT_VALIDATION=challenge)
+        return certbot.main(
+            [
+                "--configuration-path=%s" % self.path,
+                "--spool-directory=%s" % self.spool,
+                "--retries=0",
+                hook,
+            ],
+            environ,
+        )
+
+    def test_single(self, certbot, stand_in, capsys):
+        assert self.hook(certbot, "auth", "Example.com") == 0
+        assert stand_in.requests[0][:2] == (
+            "/publish_responses",
+            {
+                "responses": [
+                    {"name": "example.com", "response": "challenge", "secret": "one"}
+                ]
+            },
+        )
+        assert '"name": "example.com"' in capsys.readouterr().out
+
+    def test_batched(self, certbot, stand_in):
+        run = {"CERTBOT_ALL_DOMAINS": "example.com,*.example.com,example.org"}
+        for hook in ("auth", "cleanup"):
+            for domain, challenge, remaining in (
+                ("example.com", "a", "2"),
+                ("example.com", "b", "1"),
+                ("example.org", "c", "0"),
+            ):
+                assert (
+                    self.hook(
+                        certbot,
+                        hook,
+                        domain,
+                        challenge,
+                        CERTBOT_REMAINING_CHALLENGES=remaining,
+                        **run
+                    )
+                    == 0
+                )
+
+        assert stand_in.requests[0][:2] == (
+            "/publish_responses",
+            {
+                "responses": [
+                    {"name": "example.com", "response": "a", "secret": "one"},
+                    {"name": "example.com", "response": "b", "secret": "one"},
+                    {"name": "example.org", "response": "c", "secret": "two"},
+                ]
+            },
+        )
+        assert stand_in.requests[1][:2] == (
+            "/expire_responses",
+            {
+                "responses": [
+                    {"name": "example.com", "secret": "one"},
+                    {"name": "example.org", "secret": "two"},
+                ]
+            },
+        )
+        assert len(stand_in.requests) == 2
+        assert os.listdir(str(self.spool)) == []
+        assert self.spool.stat().st_mode & 0o777 == 0o700
+
+    def test_stale_spool(self, certbot, stand_in):
+        self.hook(certbot, "auth", "example.com", CERTBOT_REMAINING_CHALLENGES="1")
+        (spooled,) = self.spool.iterdir()
+        os.utime(str(spooled), (0, 0))
+        self.hook(certbot, "auth", "example.org", CERTBOT_REMAINING_CHALLENGES="0")
+        assert [entry["name"] for entry in stand_in.requests[0][1]["responses"]] == [
+            "example.org"
+        ]
+
+    def test_failures(self, certbot, stand_in, capsys):
+        stand_in.reply(200, {"result": [{"name": "example.com", "error": "Invalid"}]})
+        assert self.hook(certbot, "auth", "example.com") == 1
+        stand_in.reply(403, {"result": False, "error": "Invalid"})
+        assert self.hook(certbot, "cleanup", "example.com") == 1
+        assert "error: Invalid (HTTP 403)" in capsys.readouterr().err
+
+        assert self.hook(certbot, "auth", "example.net") == 1
+        assert "not found in configuration" in capsys.readouterr().err
+        assert self.hook(certbot, "other", "example.com") == 2
+        assert len(stand_in.requests) == 2
+
+    def test_missing_environment(self, certbot, capsys):
+        assert certbot.main(["--configuration-path=%s" % self.path, "auth"], {}) == 1
+        assert "must be set in the environment" in capsys.readouterr().err
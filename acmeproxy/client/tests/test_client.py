@@ -0,0 +1,330 @@
+import asyncio
+import json
+import socket
+import threading
+from socketserver import ThreadingMixIn
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+import pytest
+from django.core.handlers.wsgi import WSGIHandler
+
+from acmeproxy.client import (
+    AcmeproxyClient,
+    AcmeproxyError,
+    AsyncAcmeproxyClient,
+    ConfigurationError,
+    domain_configuration,
+    load_configuration,
+)
+from acmeproxy.client.aio import read_response
+from acmeproxy.client.tests.standin import DROP
+from acmeproxy.proxy.models import Authorisation, Response
+from acmeproxy.proxy.tests.util import create_authorisation
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def unused_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class TestClient:
+    def client(self, stand_in, **kwargs):
+        kwargs.setdefault("backoff", 0)
+        return AcmeproxyClient(stand_in.url, **kwargs)
+
+    def test_publish_response(self, stand_in):
+        with AcmeproxyClient(stand_in.url + "/prefix/") as client:
+            result = client.publish_response("example.com", "r", "secret")
+        assert result == {"name": "example.com", "response": "r", "secret": "secret"}
+        assert stand_in.requests[0][:2] == ("/prefix/publish_response", result)
+
+    def test_keep_alive(self, stand_in):
+        with self.client(stand_in) as client:
+            client.expire_response("example.com", "secret")
+            client.create_authorisation("example.com", account_secret="token")
+            client.expire_authorisation("example.com", "secret")
+        assert [path for path, data, port in stand_in.requests] == [
+            "/expire_response",
+            "/create_authorisation",
+            "/expire_authorisation",
+        ]
+        assert stand_in.requests[1][1] == {"name": "example.com", "secret": "token"}
+        assert len({port for path, data, port in stand_in.requests}) == 1
+
+    def test_batches(self, stand_in, monkeypatch):
+        monkeypatch.setattr("acmeproxy.client.base.BULK_LIMIT", 2)
+        entries = [("host%d.example.com" % i, "r", "secret") for i in range(5)]
+        with self.client(stand_in) as client:
+            results = client.publish_responses(entries)
+            assert client.expire_responses([]) == []
+        assert [result["name"] for result in results] == [e[0] for e in entries]
+        assert [len(data["responses"]) for path, data, port in stand_in.requests] == [
+            2,
+            2,
+            1,
+        ]
+
+    def test_retry(self, stand_in):
+        stand_in.reply(503, {"result": False})
+        stand_in.reply(500, {"result": False, "error": "Could not save"})
+        with self.client(stand_in, retries=2) as client:
+            assert client.expire_response("example.com", "secret")
+        assert len(stand_in.requests) == 3
+
+    def test_retries_exhausted(self, stand_in):
+        for attempt in range(2):
+            stand_in.reply(500, {"result": False, "error": "Could not save"})
+        with self.client(stand_in, retries=1) as client:
+            with pytest.raises(AcmeproxyError, match="Could not save") as info:
+                client.expire_response("example.com", "secret")
+        assert info.value.status == 500
+        assert len(stand_in.requests) == 2
+
+    def test_not_idempotent(self, stand_in):
+        stand_in.reply(503, {"result": False})
+        with self.client(stand_in) as client:
+            with pytest.raises(AcmeproxyError):
+                client.create_authorisations(["example.com"])
+        assert len(stand_in.requests) == 1
+
+    def test_refused(self, stand_in):
+        error = {"result": False, "error": "Invalid authorisation token"}
+        stand_in.reply(403, error)
+        with self.client(stand_in) as client:
+            with pytest.raises(AcmeproxyError) as info:
+                client.publish_response("example.com", "r", "wrong")
+        assert str(info.value) == "Invalid authorisation token (HTTP 403)"
+        assert (info.value.status, info.value.result) == (403, error)
+        assert len(stand_in.requests) == 1
+
+    def test_stale_connection(self, stand_in):
+        with self.client(stand_in, retries=0) as client:
+            client.expire_response("example.com", "secret")
+            stand_in.replies.append(DROP)
+            # sent again on a new connection, without counting as a retry
+            client.create_authorisation("example.com")
+        ports = [port for path, data, port in stand_in.requests]
+        assert len(ports) == 3
+        assert ports[0] == ports[1] != ports[2]
+
+    def test_timeout(self, stand_in):
+        stand_in.reply(200, {"result": True}, delay=0.5)
+        with self.client(stand_in, timeout=0.1, retries=0) as client:
+            with pytest.raises(AcmeproxyError, match="Could not reach"):
+                client.expire_response("example.com", "secret")
+
+    def test_unreachable(self):
+        client = AcmeproxyClient(
+            "http://127.0.0.1:%d" % unused_port(), retries=1, backoff=0
+        )
+        with pytest.raises(AcmeproxyError, match="Could not reach"):
+            client.create_authorisation("example.com")
+
+    def test_invalid_endpoint(self):
+        with pytest.raises(ValueError):
+            AcmeproxyClient("acme-proxy-ns1.example.com")
+
+    def test_threads(self, stand_in):
+        with self.client(stand_in, pool_size=2) as client:
+            threads = [
+                threading.Thread(
+                    target=client.expire_response, args=("example.com", "secret")
+                )
+                for i in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert len(client.idle) <= 2
+        assert len(stand_in.requests) == 8
+
+
+class TestAsyncClient:
+    def client(self, stand_in, **kwargs):
+        kwargs.setdefault("backoff", 0)
+        return AsyncAcmeproxyClient(stand_in.url, **kwargs)
+
+    def test_keep_alive(self, stand_in):
+        async def calls():
+            async with self.client(stand_in) as client:
+                first = await client.publish_response("example.com", "r", "secret")
+                second = await client.expire_response("example.com", "secret")
+                return first, second
+
+        first, second = run(calls())
+        assert first == {"name": "example.com", "response": "r", "secret": "secret"}
+        assert second == {"name": "example.com", "secret": "secret"}
+        assert len({port for path, data, port in stand_in.requests}) == 1
+
+    def test_concurrent(self, stand_in, monkeypatch):
+        monkeypatch.setattr("acmeproxy.client.base.BULK_LIMIT", 2)
+
+        async def calls():
+            async with self.client(stand_in) as client:
+                return await asyncio.gather(
+                    client.publish_responses(
+                        [("a%d.example.com" % i, "r", "secret") for i in range(3)]
+                    ),
+                    client.expire_responses([("b.example.com", "secret")]),
+                )
+
+        published, expired = run(calls())
+        assert [result["name"] for result in published] == [
+            "a0.example.com",
+            "a1.example.com",
+            "a2.example.com",
+        ]
+        assert expired == [{"name": "b.example.com", "secret": "secret"}]
+        assert len(stand_in.requests) == 3
+
+    def test_retry(self, stand_in):
+        stand_in.reply(502, {"result": False})
+        stand_in.reply(200, {"result": {"expired": True}})
+        result = run(self.client(stand_in).expire_response("example.com", "secret"))
+        assert result == {"expired": True}
+        assert len(stand_in.requests) == 2
+
+    def test_stale_connection(self, stand_in):
+        async def calls():
+            async with self.client(stand_in, retries=0) as client:
+                await client.expire_response("example.com", "secret")
+                stand_in.replies.append(DROP)
+                return await client.create_authorisation("example.com")
+
+        assert run(calls()) == {"name": "example.com"}
+        assert len(stand_in.requests) == 3
+
+    def test_timeout(self, stand_in):
+        stand_in.reply(200, {"result": True}, delay=0.5)
+        client = self.client(stand_in, timeout=0.1, retries=0)
+        with pytest.raises(AcmeproxyError, match="Could not reach"):
+            run(client.expire_response("example.com", "secret"))
+
+    def test_chunked(self):
+        async def read():
+            reader = asyncio.StreamReader()
+            reader.feed_data(
+                b"HTTP/1.1 200 OK\r\n"
+                b"Transfer-Encoding: chunked\r\n"
+                b"Connection: close\r\n\r\n"
+                b'4\r\n{"re\r\n'
+                b'b;ext=1\r\nsult": true\r\n'
+                b"1\r\n}\r\n"
+                b"0\r\n\r\n"
+            )
+            return await read_response(reader)
+
+        status, headers, body, will_close = run(read())
+        assert (status, json.loads(body.decode("utf-8")), will_close) == (
+            200,
+            {"result": True},
+            True,
+        )
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.mark.django_db(transaction=True)
+def test_api(settings):
+    """
+    The client works against the API itself, not just the stand-in.
+    """
+
+    settings.ALLOWED_HOSTS = ["127.0.0.1"]
+    create_authorisation(name="example.com")
+    server = ThreadingWSGIServer(("127.0.0.1", 0), QuietRequestHandler)
+    server.set_app(WSGIHandler())
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        with AcmeproxyClient("http://127.0.0.1:%d" % server.server_port) as client:
+            created = client.create_authorisations(["example.org"])
+            assert created[0]["authorisation"] == "example.org"
+            results = client.publish_responses(
+                [
+                    ("example.com", "one", "test_secret"),
+                    ("example.org", "two", created[0]["secret"]),
+                    ("example.net", "three", "test_secret"),
+                ]
+            )
+            assert [result.get("published") for result in results] == [
+                True,
+                True,
+                False,
+            ]
+            assert client.expire_response("example.com", "test_secret") == {
+                "authorisation": "example.com",
+                "expired": True,
+            }
+            with pytest.raises(AcmeproxyError) as info:
+                client.expire_authorisation("example.com", "wrong")
+            assert info.value.status == 403
+    finally:
+        server.shutdown()
+        server.server_close()
+    assert Authorisation.objects.count() == 2
+    assert Response.objects.live().count() == 1
+
+
+class TestConfiguration:
+    def write(self, tmp_path, content, mode=0o600):
+        path = tmp_path / "acmeproxy.ini"
+        path.write_text(content)
+        path.chmod(mode)
+        return str(path)
+
+    def test_load(self, tmp_path):
+        path = self.write(
+            tmp_path,
+            "[defaults]\n"
+            "endpoint=https://acme-proxy-ns1.example.com\n"
+            "[domain:Example.org]\n"
+            "secret=one\n"
+            "[domain:example.net]\n"
+            "endpoint=https://acme-proxy-ns2.example.com\n"
+            "secret=two\n"
+            "[domain:example.com]\n",
+        )
+        domains = load_configuration(path)
+        assert domain_configuration(domains, "example.org") == (
+            "https://acme-proxy-ns1.example.com",
+            "one",
+        )
+        assert domain_configuration(domains, "example.net") == (
+            "https://acme-proxy-ns2.example.com",
+            "two",
+        )
+        with pytest.raises(ConfigurationError, match="missing required"):
+            domain_configuration(domains, "example.com")
+        with pytest.raises(ConfigurationError, match="not found"):
+            domain_configuration(domains, "example.info")
+
+    def test_world_readable(self, tmp_path):
+        path = self.write(tmp_path, "[defaults]\n", mode=0o644)
+        with pytest.raises(ConfigurationError, match="world readable"):
+            load_configuration(path)
+
+    def test_missing(self, tmp_path):
+        with pytest.raises(ConfigurationError, match="does not exist"):
+            load_configuration(str(tmp_path / "acmeproxy.ini"))
+
+    def test_invalid(self, tmp_path):
+        path = self.write(tmp_path, "endpoint=outside a section\n")
+        with pytest.raises(ConfigurationError, match="unable to read"):
+            load_configuration(path)
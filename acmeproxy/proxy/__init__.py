@@ -0,0 +1 @@
+default_app_config = "acmeproxy.proxy.apps.ProxyConfig"
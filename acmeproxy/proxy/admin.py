@@ -1,6 +1,7 @@
 from django.contrib import admin
+from django.db import transaction
 
-from .models import Authorisation, Response
+from .models import Authorisation, DataVersion, Response
 
 
 class AuthorisationAdmin(admin.ModelAdmin):
@@ -18,6 +19,23 @@ class ResponseAdmin(admin.ModelAdmin):
         "created_by_ip",
     )
 
+    # keep the DNS backends' view of the responses up to date with admin changes
+
+    def save_model(self, request, obj, form, change):
+        with transaction.atomic():
+            super().save_model(request, obj, form, change)
+            DataVersion.bump()
+
+    def delete_model(self, request, obj):
+        with transaction.atomic():
+            super().delete_model(request, obj)
+            DataVersion.bump()
+
+    def delete_queryset(self, request, queryset):
+        with transaction.atomic():
+            super().delete_queryset(request, queryset)
+            DataVersion.bump()
+
 
 admin.site.register(Authorisation, AuthorisationAdmin)
 admin.site.register(Response, ResponseAdmin)
@@ -0,0 +1,19 @@
+from django.apps import AppConfig
+from django.conf import settings
+
+
+class ProxyConfig(AppConfig):
+    name = "acmeproxy.proxy"
+
+    def ready(self):
+        from . import database, signals  # noqa: F401
+        from .authcache import authorisation_cache
+        from .permits import account_permits
+
+        # refuse a per-process authorisation cache at startup, not on the first request
+        if authorisation_cache.timeout() is not None:
+            authorisation_cache.check()
+
+        # compile the account permit lists up front rather than on the first request
+        if hasattr(settings, "ACMEPROXY_AUTHORISATION_CREATION_SECRETS"):
+            account_permits.reload()
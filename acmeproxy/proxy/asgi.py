@@ -0,0 +1,265 @@
+"""
+An ASGI application for the API (see acmeproxy/acmeproxy/asgi.py).
+
+Django 2.2 has neither an ASGI handler nor an async ORM, so this is a small
+handler of its own. Requests to the endpoints which act on a single name are
+parsed and validated on the event loop, and only their database work is run
+in a bounded pool of threads, so a process can hold many more requests in
+flight than it has threads. Each job makes one attempt at the work, waiting
+only ACMEPROXY_ASGI_BUSY_TIMEOUT milliseconds on a database lock, and the
+pauses between attempts are spent on the event loop rather than in a thread.
+Every other request, including the bulk endpoints and the admin, is served by
+Django's WSGI handler in the same pool.
+
+The single name endpoints skip Django's middleware (ACMEPROXY_FAST_MIDDLEWARE
+included), so they are counted for the metrics here.
+"""
+
+import asyncio
+import functools
+import io
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.handlers.exception import response_for_exception
+from django.core.handlers.wsgi import WSGIHandler, WSGIRequest
+from django.db import close_old_connections
+from django.http import JsonResponse
+
+from . import database, fastpath, metrics
+
+
+def database_job(function, *args, **kwargs):
+    """
+    Runs function in a worker thread, managing its database connection the
+    way Django does around each request.
+    """
+
+    close_old_connections()
+    try:
+        return function(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def attempt_once(attempt, function, *args, **kwargs):
+    """
+    Calls function having already tried it attempt times, raising
+    database.Locked if it should be tried again later.
+    """
+
+    with database.deferred_retry(attempt), database.busy_timeout(
+        getattr(settings, "ACMEPROXY_ASGI_BUSY_TIMEOUT", 100)
+    ):
+        return function(*args, **kwargs)
+
+
+def async_version(view):
+    """
+    Returns a coroutine function which serves the same requests as view, one
+    of the fast path views, running only its operation in executor.
+    """
+
+    async def async_view(request, executor):
+        values = fastpath.parse_request(request, view.required, view.optional)
+        if isinstance(values, JsonResponse):
+            return values
+
+        loop = asyncio.get_event_loop()
+        attempt = 0
+        while True:
+            try:
+                result, status = await loop.run_in_executor(
+                    executor,
+                    functools.partial(
+                        database_job,
+                        attempt_once,
+                        attempt,
+                        view.operation,
+                        request,
+                        **values
+                    ),
+                )
+                return fastpath.json_response(result, status=status)
+            except database.Locked as e:
+                await asyncio.sleep(e.delay)
+                attempt += 1
+
+    async_view.__name__ = view.__name__
+    return async_view
+
+
+publish_response = async_version(fastpath.publish_response)
+expire_response = async_version(fastpath.expire_response)
+create_authorisation = async_version(fastpath.create_authorisation)
+expire_authorisation = async_version(fastpath.expire_authorisation)
+
+
+def wsgi_environ(scope, body):
+    """
+    Returns the WSGI environment for an ASGI HTTP connection scope.
+    """
+
+    server = scope.get("server") or ("localhost", 80)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        "SCRIPT_NAME": scope.get("root_path", ""),
+        # WSGI carries the raw bytes of the path as latin-1
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": "HTTP/%s" % scope.get("http_version", "1.1"),
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": True,
+        "wsgi.run_once": False,
+    }
+    if scope.get("client"):
+        environ["REMOTE_ADDR"] = scope["client"][0]
+
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1").upper().replace("-", "_")
+        if name == "CONTENT_LENGTH":
+            continue
+        if name != "CONTENT_TYPE":
+            name = "HTTP_" + name
+        value = value.decode("latin-1")
+        if name in environ:
+            value = environ[name] + "," + value
+        environ[name] = value
+    return environ
+
+
+def encode_response(response):
+    """
+    Returns the status, ASGI headers and body of a Django response.
+    """
+
+    return (
+        response.status_code,
+        [
+            (name.encode("latin-1"), value.encode("latin-1"))
+            for name, value in response.items()
+        ],
+        response.content,
+    )
+
+
+class ASGIHandler:
+    """
+    An ASGI 3 application serving the API, running at most
+    ACMEPROXY_ASGI_THREADS (or max_workers) database jobs at once.
+    """
+
+    routes = {
+        "/publish_response": publish_response,
+        "/expire_response": expire_response,
+        "/create_authorisation": create_authorisation,
+        "/expire_authorisation": expire_authorisation,
+    }
+
+    def __init__(self, max_workers=None):
+        self.max_workers = max_workers
+        self.executor = None
+        self.wsgi = WSGIHandler()
+
+    def start(self):
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(
+                max_workers=self.max_workers
+                or getattr(settings, "ACMEPROXY_ASGI_THREADS", 8)
+            )
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self.lifespan(receive, send)
+        elif scope["type"] == "http":
+            await self.http(scope, receive, send)
+        else:
+            raise ValueError("Unsupported ASGI scope type %s" % scope["type"])
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                self.start()
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await asyncio.get_event_loop().run_in_executor(None, self.shutdown)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    async def http(self, scope, receive, send):
+        self.start()
+
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        environ = wsgi_environ(scope, b"".join(chunks))
+
+        view = self.routes.get(scope["path"])
+        if view is None:
+            try:
+                status, headers, body = await asyncio.get_event_loop().run_in_executor(
+                    self.executor, self.serve_wsgi, environ
+                )
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                status, headers, body = encode_response(
+                    response_for_exception(WSGIRequest(environ), e)
+                )
+        else:
+            # these bypass the middleware, so are counted here
+            start = time.perf_counter()
+            request = WSGIRequest(environ)
+            try:
+                response = await view(request, self.executor)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # as convert_exception_to_response does for the other handlers,
+                # e.g. a 400 for a body over DATA_UPLOAD_MAX_MEMORY_SIZE
+                response = response_for_exception(request, e)
+            metrics.observe_request(
+                view.__name__, response.status_code, time.perf_counter() - start
+            )
+            status, headers, body = encode_response(response)
+
+        await send(
+            {"type": "http.response.start", "status": status, "headers": headers}
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    def serve_wsgi(self, environ):
+        started = []
+        response = self.wsgi(environ, lambda status, headers: started.append(headers))
+        try:
+            body = b"".join(response)
+        finally:
+            response.close()
+        return (
+            response.status_code,
+            [
+                (name.encode("latin-1"), value.encode("latin-1"))
+                for name, value in started[0]
+            ],
+            body,
+        )
@@ -0,0 +1,164 @@
+"""
+Caching of the authorisation lookups made by the API.
+
+Entries live in the Django cache named by ACMEPROXY_AUTHORISATION_CACHE, which
+must be shared between processes (e.g. memcached), so that changes made by any
+of them (including the management commands) invalidate the entries everywhere.
+Per-process backends are refused, as they would keep serving changed or deleted
+authorisations from the other processes until the entries timed out.
+
+A request which misses the cache could read an authorisation just before it is
+changed, and fill the cache after the change invalidated it. So each name also
+has a token, which invalidating replaces, and entries are only used while they
+carry the token which was current before their row was read.
+"""
+
+import functools
+import hashlib
+import threading
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+
+
+def secret_digest(secret):
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()
+
+
+class AuthorisationCache:
+    """
+    Maps normalised names to the primary key, name, account and secret digest
+    of their authorisation, and counts how often lookups were answered.
+    """
+
+    key_prefix = "acmeproxy:authorisation:"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def timeout():
+        return getattr(settings, "ACMEPROXY_AUTHORISATION_CACHE_TIMEOUT", None)
+
+    @property
+    def cache(self):
+        self.check()
+        return caches[getattr(settings, "ACMEPROXY_AUTHORISATION_CACHE", "default")]
+
+    @staticmethod
+    def check():
+        """
+        Raises ImproperlyConfigured if the named cache is only seen by this process.
+        """
+
+        alias = getattr(settings, "ACMEPROXY_AUTHORISATION_CACHE", "default")
+        if isinstance(caches[alias], (DummyCache, LocMemCache)):
+            raise ImproperlyConfigured(
+                "ACMEPROXY_AUTHORISATION_CACHE must name a cache shared between "
+                "processes, '%s' is per process" % alias
+            )
+
+    def key(self, name, kind="entry"):
+        # hashed so that long names stay within memcached's key length limit
+        return "%s%s:%s" % (
+            self.key_prefix,
+            kind,
+            hashlib.sha1(name.encode("utf-8")).hexdigest(),
+        )
+
+    @staticmethod
+    def entry(authorisation):
+        return {
+            "pk": authorisation.pk,
+            "name": authorisation.name,
+            "account": authorisation.account,
+            "digest": secret_digest(authorisation.secret),
+        }
+
+    def get_many(self, names):
+        """
+        Returns the cached entries for any of names, keyed on name, and the
+        tokens to pass to set_many with the entries read for the others.
+        """
+
+        if self.timeout() is None:
+            return {}, {}
+
+        keys = {self.key(name): name for name in names}
+        token_keys = {self.key(name, "token"): name for name in names}
+        cached = self.cache.get_many(list(keys) + list(token_keys))
+        tokens = {name: cached.get(key) for key, name in token_keys.items()}
+
+        found = {}
+        for key, name in keys.items():
+            entry = cached.get(key)
+            if entry is not None and tokens[name] is not None:
+                if entry.get("token") == tokens[name]:
+                    found[name] = entry
+        with self.lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+
+        missing = {}
+        for name in names:
+            if name in found:
+                continue
+            if tokens[name] is None:
+                # whichever process adds the token first wins
+                key = self.key(name, "token")
+                self.cache.add(key, uuid.uuid4().hex, timeout=None)
+                tokens[name] = self.cache.get(key)
+            missing[name] = tokens[name]
+        return found, missing
+
+    def set_many(self, entries, tokens):
+        """
+        Caches entries, which must have been read after get_many returned
+        tokens.
+        """
+
+        if self.timeout() is None or not entries:
+            return
+        self.cache.set_many(
+            {
+                self.key(name): dict(entry, token=tokens[name])
+                for name, entry in entries.items()
+                if tokens.get(name) is not None
+            },
+            timeout=self.timeout(),
+        )
+
+    def invalidate(self, name):
+        """
+        Invalidates any entry for name, once the change being made (if in a
+        transaction) is committed, so that it can't be read again beforehand.
+        """
+
+        if self.timeout() is None:
+            return
+        transaction.on_commit(functools.partial(self.replace_token, name))
+
+    def replace_token(self, name):
+        self.cache.set(self.key(name, "token"), uuid.uuid4().hex, timeout=None)
+        self.cache.delete(self.key(name))
+        with self.lock:
+            self.invalidations += 1
+
+    def stats(self):
+        with self.lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+            }
+
+
+authorisation_cache = AuthorisationCache()
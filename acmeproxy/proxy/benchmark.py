@@ -0,0 +1,244 @@
+"""
+Helpers shared by the benchmark management commands.
+"""
+
+import os
+import socket
+import struct
+import tempfile
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection
+from django.test.utils import setup_databases, teardown_databases
+from django.utils import timezone
+
+from . import dns
+from .models import Authorisation, Response
+
+
+@contextmanager
+def temporary_database(prefix="acmeproxy-benchmark-"):
+    """
+    Runs the body against a newly created test database rather than the
+    configured one, so that seeded rows and held locks never touch production,
+    and destroys it afterwards. SQLite databases are created as a file rather
+    than in memory, so that they behave (and lock) as they would in production.
+    """
+
+    path = None
+    test_settings = connection.settings_dict.setdefault("TEST", {})
+    if connection.vendor == "sqlite" and not test_settings.get("NAME"):
+        handle, path = tempfile.mkstemp(prefix=prefix, suffix=".sqlite3")
+        os.close(handle)
+        test_settings["NAME"] = path
+    try:
+        state = setup_databases(verbosity=0, interactive=False)
+        try:
+            yield
+        finally:
+            teardown_databases(state, verbosity=0)
+    finally:
+        if path:
+            # Django only removes the database itself, not its WAL and shared
+            # memory files
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(path + suffix)
+                except FileNotFoundError:
+                    pass
+            del test_settings["NAME"]
+
+
+@contextmanager
+def kept_connections():
+    """
+    Stops requests from closing the database connection when they finish, as
+    Django's test client does, so that benchmarks don't measure reconnecting.
+    """
+
+    request_started.disconnect(close_old_connections)
+    request_finished.disconnect(close_old_connections)
+    try:
+        yield
+    finally:
+        request_started.connect(close_old_connections)
+        request_finished.connect(close_old_connections)
+
+
+def wsgi_request(application, environ):
+    """
+    Serves one request with a WSGI application, returning the status code and
+    body of the response.
+    """
+
+    statuses = []
+    response = application(environ, lambda status, headers: statuses.append(status))
+    try:
+        body = b"".join(response)
+    finally:
+        response.close()
+    return int(statuses[0].split()[0]), body
+
+
+def dns_exchange(port, queries, tcp=False, timeout=1):
+    """
+    Sends each of queries to a DNS server on localhost in turn, waiting for
+    each answer, and returns the duration of each exchange in seconds and how
+    many of them failed (timed out, or answered with an error).
+    """
+
+    samples = []
+    errors = 0
+    if tcp:
+        connection = socket.create_connection(("127.0.0.1", port), timeout=timeout)
+    else:
+        connection = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        connection.settimeout(timeout)
+        connection.connect(("127.0.0.1", port))
+
+    with connection:
+        for query in queries:
+            start = time.perf_counter()
+            try:
+                if tcp:
+                    connection.sendall(struct.pack("!H", len(query)) + query)
+                    length = struct.unpack(
+                        "!H", connection.recv(2, socket.MSG_WAITALL)
+                    )[0]
+                    reply = connection.recv(length, socket.MSG_WAITALL)
+                else:
+                    connection.send(query)
+                    reply = connection.recv(65535)
+            except socket.timeout:
+                errors += 1
+                continue
+            samples.append(time.perf_counter() - start)
+            response = dns.parse_response(reply)
+            if response["id"] != struct.unpack("!H", query[:2])[0] or response[
+                "rcode"
+            ] in (dns.FORMERR, dns.SERVFAIL):
+                errors += 1
+    return samples, errors
+
+
+class QuestionFeed:
+    """
+    Stands in for the standard input of the pipeapi command, handing it lines
+    one at a time and noting when each is read, so that the time spent on
+    each line is known. DEBUGQUIT follows the last line.
+    """
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.position = 0
+        self.read_at = []
+
+    def readline(self):
+        self.read_at.append(time.perf_counter())
+        if self.position == len(self.lines):
+            return "DEBUGQUIT\n"
+        self.position += 1
+        return self.lines[self.position - 1]
+
+    def durations(self):
+        """
+        Returns the time spent answering each line, in seconds.
+        """
+
+        return [end - start for start, end in zip(self.read_at, self.read_at[1:])]
+
+
+def seeded_name(index):
+    return "host%d.example%d.com" % (index, index % 100)
+
+
+def seed_authorisations(count, batch_size=10000):
+    for start in range(0, count, batch_size):
+        batch = []
+        for index in range(start, min(start + batch_size, count)):
+            authorisation = Authorisation(
+                name=seeded_name(index),
+                secret="%032x" % index,
+                created_by_ip="127.0.0.1",
+                account="benchmark",
+            )
+            authorisation.normalise_name()
+            batch.append(authorisation)
+        Authorisation.objects.bulk_create(batch)
+
+
+def seed_responses(count, live_every=10, batch_size=10000):
+    """
+    Seeds count responses, one in every live_every of which is left live and
+    the rest expired.
+    """
+
+    expired_at = timezone.now() - timedelta(days=1)
+    for start in range(0, count, batch_size):
+        batch = []
+        for index in range(start, min(start + batch_size, count)):
+            response = Response(
+                name=seeded_name(index),
+                response="response-%d" % index,
+                created_by_ip="127.0.0.1",
+                expired_at=None if index % live_every == 0 else expired_at,
+            )
+            response.normalise_name()
+            batch.append(response)
+        Response.objects.bulk_create(batch)
+
+
+def timings(function, arguments):
+    """
+    Calls function once for each of arguments, returning the duration of
+    each call in seconds.
+    """
+
+    samples = []
+    for argument in arguments:
+        start = time.perf_counter()
+        function(argument)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def peak_memory(function, arguments):
+    """
+    Calls function once for each of arguments, returning the most memory
+    allocated at any point during each call in bytes.
+    """
+
+    samples = []
+    tracemalloc.start()
+    try:
+        for argument in arguments:
+            tracemalloc.clear_traces()
+            function(argument)
+            samples.append(tracemalloc.get_traced_memory()[1])
+    finally:
+        tracemalloc.stop()
+    return samples
+
+
+def percentile(samples, percent):
+    ordered = sorted(samples)
+    return ordered[int(round((len(ordered) - 1) * percent / 100.0))]
+
+
+def summarise(label, samples, **extra):
+    """
+    Returns a row for tabulate describing samples (in seconds) in microseconds.
+    """
+
+    row = OrderedDict([("benchmark", label)])
+    row.update(extra)
+    row["calls"] = len(samples)
+    row["mean_us"] = round(sum(samples) / len(samples) * 1e6, 1)
+    row["p50_us"] = round(percentile(samples, 50) * 1e6, 1)
+    row["p99_us"] = round(percentile(samples, 99) * 1e6, 1)
+    return row
@@ -0,0 +1,146 @@
+"""
+Tuning of SQLite connections, and retrying of the work which fails when
+another connection holds a lock on the database.
+"""
+
+import contextlib
+import functools
+import random
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, OperationalError, connection, transaction
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+# The pragmas set unless ACMEPROXY_SQLITE_PRAGMAS says otherwise, so that the
+# API and pipeapi can share one SQLite database: readers never wait for
+# writers in WAL mode, writers wait for each other rather than failing at
+# once, and committing doesn't wait for a sync (which WAL makes safe).
+PRODUCTION_PRAGMAS = {
+    "journal_mode": "wal",
+    "busy_timeout": 5000,
+    "synchronous": "normal",
+}
+
+LOCKED_MESSAGES = ("database is locked", "database table is locked")
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != "sqlite":
+        return
+    pragmas = getattr(settings, "ACMEPROXY_SQLITE_PRAGMAS", PRODUCTION_PRAGMAS)
+    with connection.cursor() as cursor:
+        for pragma, value in pragmas.items():
+            cursor.execute("PRAGMA %s = %s" % (pragma, value))
+
+
+def is_locked(error):
+    return isinstance(error, OperationalError) and any(
+        message in str(error) for message in LOCKED_MESSAGES
+    )
+
+
+class Locked(Exception):
+    """
+    Raised by retry_locked within deferred_retry rather than pausing, with the
+    pause to make before the next attempt.
+    """
+
+    def __init__(self, delay):
+        super().__init__("database is locked, retry in %.3fs" % delay)
+        self.delay = delay
+
+
+_deferred = threading.local()
+
+
+@contextlib.contextmanager
+def deferred_retry(attempt):
+    """
+    Makes retry_locked try only once within this, having already tried attempt
+    times, and raise Locked instead of pausing in the thread. The caller can
+    then wait (e.g. on an event loop) and run the work again.
+    """
+
+    _deferred.attempt = attempt
+    try:
+        yield
+    finally:
+        del _deferred.attempt
+
+
+@contextlib.contextmanager
+def busy_timeout(milliseconds):
+    """
+    Sets how long SQLite waits on a lock within this, rather than the
+    busy_timeout pragma the connection was configured with.
+    """
+
+    if connection.vendor != "sqlite":
+        yield
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA busy_timeout")
+        configured = cursor.fetchone()[0]
+        cursor.execute("PRAGMA busy_timeout = %d" % milliseconds)
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout = %d" % configured)
+
+
+def retry_locked(function, *args, **kwargs):
+    """
+    Calls function, calling it again after an exponentially growing pause each
+    time it fails because the database is locked, at most
+    ACMEPROXY_DATABASE_LOCK_RETRIES (default 5) times.
+
+    Within an outer transaction the failed work can't be retried on its own,
+    so there the error is raised at once.
+    """
+
+    retries = getattr(settings, "ACMEPROXY_DATABASE_LOCK_RETRIES", 5)
+    delay = getattr(settings, "ACMEPROXY_DATABASE_LOCK_BACKOFF", 0.05)
+    attempt = getattr(_deferred, "attempt", None)
+    deferred = attempt is not None
+    attempt = attempt or 0
+    while True:
+        try:
+            return function(*args, **kwargs)
+        except OperationalError as e:
+            if (
+                attempt >= retries
+                or not is_locked(e)
+                or transaction.get_connection().in_atomic_block
+            ):
+                raise
+        # jittered, so that the writers which collided don't collide again
+        pause = delay * (2**attempt) * random.uniform(0.5, 1.5)
+        if deferred:
+            raise Locked(pause)
+        time.sleep(pause)
+        attempt += 1
+
+
+def database_operation(error):
+    """
+    Decorates a function returning an API result and status code, so that it
+    is retried while the database is locked, and returns a 500 with error if
+    it fails with a database error after all.
+    """
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            try:
+                return retry_locked(function, *args, **kwargs)
+            except DatabaseError:
+                return {"result": False, "error": error}, 500
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,404 @@
+"""
+Just enough of the DNS wire format (RFC 1035, with EDNS from RFC 6891) to
+answer questions for the records in records.py authoritatively.
+"""
+
+import struct
+from collections import namedtuple
+
+from . import records
+
+# record types by number, and numbers by type
+TYPES = {1: "A", 2: "NS", 6: "SOA", 16: "TXT", 28: "AAAA", 41: "OPT", 257: "CAA"}
+TYPE_NUMBERS = {name: number for number, name in TYPES.items()}
+IXFR = 251
+AXFR = 252
+ANY = 255
+
+CLASS_IN = 1
+CLASS_ANY = 255
+
+OPCODE_QUERY = 0
+
+NOERROR = 0
+FORMERR = 1
+SERVFAIL = 2
+NXDOMAIN = 3
+NOTIMP = 4
+REFUSED = 5
+BADVERS = 16
+
+FLAG_QR = 0x8000
+FLAG_AA = 0x0400
+FLAG_TC = 0x0200
+FLAG_RD = 0x0100
+FLAG_DO = 0x8000  # in the TTL field of an OPT record
+
+# the largest message sent without EDNS, and the size of the header
+UDP_LIMIT = 512
+HEADER = struct.Struct("!HHHHHH")
+
+Query = namedtuple(
+    "Query", ("id", "flags", "qname", "qtype", "qclass", "edns", "edns_version", "do")
+)
+Record = namedtuple("Record", ("name", "type", "rclass", "ttl", "rdata"))
+
+
+class FormatError(Exception):
+    """
+    A message which could not be decoded. id is None if even the header was
+    incomplete, in which case there is nobody to reply to.
+    """
+
+    def __init__(self, message, id=None):
+        super().__init__(message)
+        self.id = id
+
+
+def type_name(number):
+    return "ANY" if number == ANY else TYPES.get(number, "TYPE%d" % number)
+
+
+def read_name(data, offset):
+    """
+    Returns the name at offset, following compression pointers, and the
+    offset just past it.
+    """
+
+    labels = []
+    end = None
+    jumps = 0
+    while True:
+        if offset >= len(data):
+            raise FormatError("Name runs past the end of the message")
+        length = data[offset]
+        if length & 0xC0 == 0xC0:
+            if offset + 1 >= len(data):
+                raise FormatError("Truncated compression pointer")
+            if end is None:
+                end = offset + 2
+            jumps += 1
+            if jumps > 64:
+                raise FormatError("Compression pointer loop")
+            offset = ((length & 0x3F) << 8) | data[offset + 1]
+            continue
+        if length & 0xC0:
+            raise FormatError("Unknown label type")
+        offset += 1
+        if not length:
+            break
+        if offset + length > len(data):
+            raise FormatError("Label runs past the end of the message")
+        # undecodable bytes survive being decoded and encoded again
+        labels.append(data[offset : offset + length].decode("utf-8", "surrogateescape"))
+        offset += length
+    return ".".join(labels), offset if end is None else end
+
+
+def read_records(data, offset, count):
+    """
+    Returns count resource records starting at offset, and the offset just
+    past them.
+    """
+
+    found = []
+    for _ in range(count):
+        name, offset = read_name(data, offset)
+        if offset + 10 > len(data):
+            raise FormatError("Truncated resource record")
+        rtype, rclass, ttl, length = struct.unpack_from("!HHIH", data, offset)
+        offset += 10
+        if offset + length > len(data):
+            raise FormatError("Truncated resource record data")
+        found.append(Record(name, rtype, rclass, ttl, (offset, length)))
+        offset += length
+    return found, offset
+
+
+def parse_query(data):
+    """
+    Decodes a query containing a single question, raising FormatError if it
+    can't be.
+    """
+
+    if len(data) < HEADER.size:
+        raise FormatError("Truncated header")
+    id, flags, qdcount, ancount, nscount, arcount = HEADER.unpack_from(data)
+    if flags & FLAG_QR:
+        raise FormatError("Not a query")
+    if qdcount != 1:
+        raise FormatError("Expected a single question", id)
+
+    try:
+        qname, offset = read_name(data, HEADER.size)
+        if offset + 4 > len(data):
+            raise FormatError("Truncated question")
+        qtype, qclass = struct.unpack_from("!HH", data, offset)
+        others, offset = read_records(data, offset + 4, ancount + nscount + arcount)
+    except FormatError as e:
+        raise FormatError(str(e), id)
+
+    edns = edns_version = None
+    do = False
+    for record in others[ancount + nscount :]:
+        if record.type == TYPE_NUMBERS["OPT"]:
+            # the class holds the requester's UDP payload size, and the TTL
+            # the extended rcode, version and flags
+            edns = max(record.rclass, UDP_LIMIT)
+            edns_version = (record.ttl >> 16) & 0xFF
+            do = bool(record.ttl & FLAG_DO)
+
+    return Query(id, flags, qname, qtype, qclass, edns, edns_version, do)
+
+
+def build_query(qname, qtype, id=0, edns=None, do=False):
+    """
+    Encodes a query, with an OPT record advertising a UDP payload size of
+    edns if it is given.
+    """
+
+    message = Message()
+    message.header(id, FLAG_RD, qdcount=1, arcount=0 if edns is None else 1)
+    message.question(qname, qtype)
+    if edns is not None:
+        message.opt(edns, do=do)
+    return bytes(message.buffer)
+
+
+class Message:
+    """
+    A message being encoded, compressing names against those already in it.
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offsets = {}
+
+    def header(self, id, flags, qdcount=0, ancount=0, nscount=0, arcount=0):
+        self.buffer += HEADER.pack(id, flags, qdcount, ancount, nscount, arcount)
+
+    def set_counts(self, ancount, nscount, arcount):
+        struct.pack_into("!HHH", self.buffer, 6, ancount, nscount, arcount)
+
+    def name(self, name):
+        labels = [label for label in name.split(".") if label]
+        for index in range(len(labels)):
+            suffix = ".".join(labels[index:]).lower()
+            offset = self.offsets.get(suffix)
+            if offset is not None:
+                self.buffer += struct.pack("!H", 0xC000 | offset)
+                return
+            if len(self.buffer) < 0x4000:
+                self.offsets[suffix] = len(self.buffer)
+            label = labels[index].encode("utf-8", "surrogateescape")
+            if len(label) > 63:
+                raise ValueError("Label too long: %r" % labels[index])
+            self.buffer.append(len(label))
+            self.buffer += label
+        self.buffer.append(0)
+
+    def question(self, qname, qtype, qclass=CLASS_IN):
+        self.name(qname)
+        self.buffer += struct.pack("!HH", qtype, qclass)
+
+    def record(self, name, record):
+        """
+        Appends one of the records from records.py, owned by name.
+        """
+
+        start = len(self.buffer)
+        try:
+            self.name(name)
+            self.buffer += struct.pack(
+                "!HHIH", TYPE_NUMBERS[record["type"]], CLASS_IN, record["ttl"], 0
+            )
+            rdata = len(self.buffer)
+            ENCODERS[record["type"]](self, record["content"])
+        except (ValueError, KeyError, IndexError, struct.error):
+            # content which can't be encoded is left out, rather than failing
+            # the whole answer
+            del self.buffer[start:]
+            self.offsets = {
+                suffix: offset
+                for suffix, offset in self.offsets.items()
+                if offset < start
+            }
+            return False
+        struct.pack_into("!H", self.buffer, rdata - 2, len(self.buffer) - rdata)
+        return True
+
+    def opt(self, payload_size, rcode=0, do=False):
+        ttl = ((rcode >> 4) << 24) | (FLAG_DO if do else 0)
+        self.buffer += b"\x00" + struct.pack(
+            "!HHIH", TYPE_NUMBERS["OPT"], payload_size, ttl, 0
+        )
+
+
+def encode_strings(message, content):
+    data = content.encode("utf-8")
+    for start in range(0, max(len(data), 1), 255):
+        chunk = data[start : start + 255]
+        message.buffer.append(len(chunk))
+        message.buffer += chunk
+
+
+def encode_name(message, content):
+    message.name(content)
+
+
+def encode_soa(message, content):
+    mname, rname, *numbers = content.split()
+    message.name(mname)
+    message.name(rname)
+    message.buffer += struct.pack("!IIIII", *[int(number) for number in numbers])
+
+
+def encode_caa(message, content):
+    flags, tag, value = content.split(" ", 2)
+    tag = tag.encode("ascii")
+    message.buffer += struct.pack("!BB", int(flags), len(tag)) + tag
+    message.buffer += value.strip('"').encode("utf-8")
+
+
+ENCODERS = {
+    "TXT": encode_strings,
+    "NS": encode_name,
+    "SOA": encode_soa,
+    "CAA": encode_caa,
+}
+
+
+def decode_rdata(data, record):
+    """
+    Returns the content of a record read by read_records, in the form
+    records.py generates it.
+    """
+
+    offset, length = record.rdata
+    rtype = type_name(record.type)
+    if rtype == "TXT":
+        strings = []
+        end = offset + length
+        while offset < end:
+            strings.append(data[offset + 1 : offset + 1 + data[offset]])
+            offset += 1 + data[offset]
+        return b"".join(strings).decode("utf-8")
+    if rtype == "NS":
+        return read_name(data, offset)[0]
+    if rtype == "SOA":
+        mname, offset = read_name(data, offset)
+        rname, offset = read_name(data, offset)
+        numbers = struct.unpack_from("!IIIII", data, offset)
+        return "%s. %s. %s" % (mname, rname, " ".join(str(n) for n in numbers))
+    if rtype == "CAA":
+        flags, tag_length = struct.unpack_from("!BB", data, offset)
+        tag = data[offset + 2 : offset + 2 + tag_length].decode("ascii")
+        value = data[offset + 2 + tag_length : offset + length].decode("utf-8")
+        return '%d %s "%s"' % (flags, tag, value)
+    return bytes(data[offset : offset + length])
+
+
+def parse_response(data):
+    """
+    Decodes a response, returning its header fields and the records in each
+    of its sections. Used by the tests and load tests.
+    """
+
+    if len(data) < HEADER.size:
+        raise FormatError("Truncated header")
+    id, flags, qdcount, ancount, nscount, arcount = HEADER.unpack_from(data)
+    offset = HEADER.size
+    for _ in range(qdcount):
+        offset = read_name(data, offset)[1] + 4
+    answers, offset = read_records(data, offset, ancount)
+    authority, offset = read_records(data, offset, nscount)
+    additional, offset = read_records(data, offset, arcount)
+    return {
+        "id": id,
+        "flags": flags,
+        "rcode": flags & 0xF,
+        "answers": answers,
+        "authority": authority,
+        "additional": additional,
+    }
+
+
+def zone_of(index, name):
+    """
+    Returns the closest name at or above name which has an SOA record in the
+    index, or None if we aren't authoritative for name.
+    """
+
+    labels = name.split(".")
+    for depth in range(len(labels)):
+        types = index.get(".".join(labels[depth:]))
+        if types is not None and "SOA" in types:
+            return ".".join(labels[depth:])
+    return None
+
+
+def resolve(index, qname, qtype):
+    """
+    Answers a question from a record index, returning the rcode, whether the
+    answer is authoritative, and the answer and authority records as
+    (owner name, record) pairs.
+    """
+
+    name = qname.lower()
+    zone = zone_of(index, name)
+    if zone is None:
+        return REFUSED, False, [], []
+
+    found = records.find_records(index, name, type_name(qtype))
+    if found:
+        return NOERROR, True, [(qname, record) for record in found], []
+
+    # a name with no records of the type asked for, or no records at all
+    soa = records.find_records(index, zone, "SOA")
+    rcode = NOERROR if name in index else NXDOMAIN
+    return rcode, True, [], [(zone, record) for record in soa]
+
+
+def build_response(
+    query,
+    rcode,
+    authoritative,
+    answers,
+    authority,
+    limit,
+    payload_size,
+    truncated=False,
+):
+    """
+    Encodes the response to query, leaving out the records (and setting the
+    TC flag) if they don't fit in limit bytes. payload_size is the largest
+    UDP response we accept, which is advertised to EDNS requesters.
+    """
+
+    # the opcode and RD flag are copied from the query
+    flags = FLAG_QR | (query.flags & (0x7800 | FLAG_RD)) | (rcode & 0xF)
+    if authoritative:
+        flags |= FLAG_AA
+    if truncated:
+        flags |= FLAG_TC
+
+    message = Message()
+    message.header(query.id, flags, qdcount=1)
+    message.question(query.qname, query.qtype, query.qclass)
+    ancount = sum(message.record(name, record) for name, record in answers)
+    nscount = sum(message.record(name, record) for name, record in authority)
+    if query.edns is not None:
+        message.opt(payload_size, rcode=rcode, do=query.do)
+    message.set_counts(ancount, nscount, 0 if query.edns is None else 1)
+
+    if len(message.buffer) > limit:
+        return build_response(
+            query, rcode, authoritative, [], [], limit, payload_size, truncated=True
+        )
+    return bytes(message.buffer)
+
+
+def error_response(id, rcode):
+    message = Message()
+    message.header(id, FLAG_QR | rcode)
+    return bytes(message.buffer)
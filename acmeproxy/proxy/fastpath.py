@@ -0,0 +1,208 @@
+"""
+A lean implementation of the endpoints which act on a single name, as plain
+Django views without DRF's request wrapping, content negotiation and
+serializers, and a WSGI handler which serves the API through a minimal
+middleware chain (see acmeproxy/acmeproxy/fastwsgi.py).
+
+The views accept the same form and JSON bodies and return the same results,
+validation errors and status codes as the DRF views, sharing their logic in
+views.py.
+"""
+
+import functools
+import json
+
+from django.conf import settings
+from django.core.handlers.exception import convert_exception_to_response
+from django.core.handlers.wsgi import WSGIHandler
+from django.http import JsonResponse, QueryDict
+from django.utils.module_loading import import_string
+from django.views.decorators.csrf import csrf_exempt
+
+from . import views
+
+# the same messages as DRF's, so that clients see identical errors
+REQUIRED = "This field is required."
+BLANK = "This field may not be blank."
+INVALID = "Not a valid string."
+
+FORM_CONTENT_TYPES = ("application/x-www-form-urlencoded", "multipart/form-data")
+
+
+def json_response(data, status=200, **kwargs):
+    # compact and unescaped, like DRF's JSONRenderer
+    return JsonResponse(
+        data,
+        status=status,
+        json_dumps_params={"separators": (",", ":"), "ensure_ascii": False},
+        **kwargs
+    )
+
+
+def parse_body(request):
+    """
+    Returns the fields of the request body as a dict, or an error response if
+    it could not be parsed.
+    """
+
+    if not request.body:
+        return {}
+    if request.content_type in FORM_CONTENT_TYPES:
+        return request.POST
+    if request.content_type != "application/json":
+        return json_response(
+            {
+                "detail": 'Unsupported media type "%s" in request.'
+                % request.content_type
+            },
+            status=415,
+        )
+
+    try:
+        data = json.loads(request.body.decode("utf-8"))
+    except ValueError as e:
+        return json_response({"detail": "JSON parse error - %s" % e}, status=400)
+
+    if not isinstance(data, dict):
+        return json_response(
+            {
+                "non_field_errors": [
+                    "Invalid data. Expected a dictionary, but got %s."
+                    % type(data).__name__
+                ]
+            },
+            status=400,
+        )
+    return data
+
+
+def validate(data, required, optional=()):
+    """
+    Checks the fields of data in the way DRF's CharField does, returning the
+    cleaned values and a dict of errors for each field which failed.
+    """
+
+    values = {}
+    errors = {}
+    for field in required + optional:
+        value = data.get(field)
+        if value == "" and field in optional and isinstance(data, QueryDict):
+            # DRF treats empty optional form fields as omitted
+            value = None
+        if value is None:
+            if field in required:
+                errors[field] = [REQUIRED]
+            continue
+        if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+            errors[field] = [INVALID]
+            continue
+        value = str(value).strip()
+        if not value:
+            errors[field] = [BLANK]
+            continue
+        values[field] = value
+    return values, errors
+
+
+def parse_request(request, required, optional=()):
+    """
+    Returns the validated fields of a POST request, or a response describing
+    why they could not be.
+    """
+
+    if request.method != "POST":
+        response = json_response(
+            {"detail": 'Method "%s" not allowed.' % request.method}, status=405
+        )
+        response["Allow"] = "POST"
+        return response
+
+    data = parse_body(request)
+    if isinstance(data, JsonResponse):
+        return data
+
+    values, errors = validate(data, required, optional)
+    if errors:
+        return json_response(errors, status=400)
+    return values
+
+
+def endpoint(required, optional=()):
+    """
+    Turns operation into a view which only accepts POST requests, calling it
+    with the request and the validated fields. The view keeps the fields and
+    operation as attributes, so that other front ends can reuse them.
+    """
+
+    def decorator(operation):
+        @csrf_exempt
+        @functools.wraps(operation)
+        def view(request):
+            values = parse_request(request, required, optional)
+            if isinstance(values, JsonResponse):
+                return values
+
+            result, status = operation(request, **values)
+            return json_response(result, status=status)
+
+        view.required = required
+        view.optional = optional
+        view.operation = operation
+        return view
+
+    return decorator
+
+
+@endpoint(required=("name", "response", "secret"))
+def publish_response(request, name, response, secret):
+    return views.publish_response(name, response, secret, views.client_ip(request))
+
+
+@endpoint(required=("name", "secret"))
+def expire_response(request, name, secret):
+    return views.expire_response(name, secret)
+
+
+@endpoint(required=("name",), optional=("secret",))
+def create_authorisation(request, name, secret=""):
+    return views.create_authorisation(name, secret, views.client_ip(request))
+
+
+@endpoint(required=("name", "secret"))
+def expire_authorisation(request, name, secret):
+    return views.expire_authorisation(name, secret)
+
+
+class FastAPIHandler(WSGIHandler):
+    """
+    A WSGI handler which routes requests with acmeproxy.proxy.fasturls
+    through only the middleware listed in ACMEPROXY_FAST_MIDDLEWARE, rather
+    than the full chain the admin needs.
+    """
+
+    urlconf = "acmeproxy.proxy.fasturls"
+
+    def load_middleware(self):
+        self._view_middleware = []
+        self._template_response_middleware = []
+        self._exception_middleware = []
+
+        handler = convert_exception_to_response(self._get_response)
+        for middleware_path in reversed(
+            getattr(
+                settings,
+                "ACMEPROXY_FAST_MIDDLEWARE",
+                (
+                    "acmeproxy.proxy.metrics.MetricsMiddleware",
+                    "django.middleware.security.SecurityMiddleware",
+                ),
+            )
+        ):
+            handler = convert_exception_to_response(
+                import_string(middleware_path)(handler)
+            )
+        self._middleware_chain = handler
+
+    def get_response(self, request):
+        request.urlconf = self.urlconf
+        return super().get_response(request)
@@ -0,0 +1,35 @@
+"""
+The API served by the fast path handler. The bulk endpoints have no lean
+implementation, so they are served by their DRF views.
+"""
+
+from django.urls import path
+
+from . import fastpath, metrics, views
+
+urlpatterns = [
+    path("publish_response", fastpath.publish_response, name="publish_response"),
+    path(
+        "publish_responses",
+        views.PublishResponses.as_view(),
+        name="publish_responses",
+    ),
+    path("expire_response", fastpath.expire_response, name="expire_response"),
+    path("expire_responses", views.ExpireResponses.as_view(), name="expire_responses"),
+    path(
+        "create_authorisation",
+        fastpath.create_authorisation,
+        name="create_authorisation",
+    ),
+    path(
+        "create_authorisations",
+        views.CreateAuthorisations.as_view(),
+        name="create_authorisations",
+    ),
+    path(
+        "expire_authorisation",
+        fastpath.expire_authorisation,
+        name="expire_authorisation",
+    ),
+    path("metrics", metrics.metrics, name="metrics"),
+]
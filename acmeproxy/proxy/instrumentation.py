@@ -0,0 +1,191 @@
+"""
+Opt-in instrumentation for the pipeapi command, to find out where the time
+goes when PowerDNS times out waiting on it: each question is timed stage by
+stage, slow ones are logged with the breakdown and the number of database
+queries they made, and a sample of questions can be profiled.
+"""
+
+import cProfile
+import logging
+import logging.handlers
+import os
+import random
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class NullStage:
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+class NullTrace:
+    """
+    Stands in for a Trace when instrumentation is off, at next to no cost.
+    """
+
+    stage_context = NullStage()
+
+    def stage(self, name):
+        return self.stage_context
+
+
+NULL_TRACE = NullTrace()
+
+
+class Stage:
+    __slots__ = ("trace", "name", "start")
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        stages = self.trace.stages
+        stages[self.name] = stages.get(self.name, 0) + time.perf_counter() - self.start
+        return False
+
+
+class Trace:
+    """
+    The time spent in each stage of answering one question, and the number of
+    database queries made.
+    """
+
+    def __init__(self, line):
+        self.line = line.strip()
+        self.stages = OrderedDict()
+        self.queries = 0
+        self.start = time.perf_counter()
+
+    def stage(self, name):
+        return Stage(self, name)
+
+    def describe(self, total):
+        stages = list(self.stages.items())
+        other = total - sum(self.stages.values())
+        stages.append(("other", max(other, 0)))
+        return "Slow question %r took %.1fms with %d queries: %s" % (
+            self.line,
+            total * 1000,
+            self.queries,
+            ", ".join("%s %.1fms" % (name, taken * 1000) for name, taken in stages),
+        )
+
+
+def slow_logger(destination):
+    """
+    Returns a logger writing to stderr (which PowerDNS logs) or to syslog.
+    """
+
+    if destination == "syslog":
+        address = "/dev/log" if os.path.exists("/dev/log") else ("localhost", 514)
+        handler = logging.handlers.SysLogHandler(address=address)
+        handler.setFormatter(
+            logging.Formatter("acmeproxy-pipeapi[%(process)d]: %(message)s")
+        )
+    else:
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+
+    logger = logging.getLogger("acmeproxy.pipeapi")
+    logger.handlers = [handler]
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    return logger
+
+
+class Instrumentation:
+    """
+    Traces questions, logging those taking threshold seconds or more to
+    logger. If profile_path is given ({pid} is replaced with the process ID),
+    profile_rate of the questions are profiled, and the accumulated stats are
+    written there every profile_interval seconds for pstats to read.
+    """
+
+    def __init__(
+        self,
+        threshold=None,
+        logger=None,
+        profile_path=None,
+        profile_rate=0.01,
+        profile_interval=60,
+    ):
+        self.threshold = threshold
+        self.logger = logger
+        self.trace = None
+
+        self.profiler = None
+        self.profile_path = None
+        if profile_path:
+            self.profiler = cProfile.Profile()
+            self.profile_path = profile_path.replace("{pid}", str(os.getpid()))
+        self.profile_rate = profile_rate
+        self.profile_interval = profile_interval
+        self.profiled = 0
+        self.dumped_at = time.monotonic()
+
+    def count_query(self, execute, sql, params, many, context):
+        """
+        A database execute wrapper (see connection.execute_wrapper).
+        """
+
+        if self.trace is not None:
+            self.trace.queries += 1
+        return execute(sql, params, many, context)
+
+    @contextmanager
+    def question(self, line):
+        trace = self.trace = Trace(line)
+        profiling = self.profiler is not None and random.random() < self.profile_rate
+        if profiling:
+            self.profiler.enable()
+        try:
+            yield trace
+        finally:
+            if profiling:
+                self.profiler.disable()
+                self.profiled += 1
+            self.trace = None
+
+            total = time.perf_counter() - trace.start
+            if self.threshold is not None and total >= self.threshold:
+                self.logger.warning(trace.describe(total))
+            if (
+                self.profiler is not None
+                and time.monotonic() - self.dumped_at >= self.profile_interval
+            ):
+                self.dump()
+
+    def dump(self):
+        """
+        Replaces the profile file with the stats of every question profiled
+        so far.
+        """
+
+        self.dumped_at = time.monotonic()
+        if self.profiler is None or not self.profiled:
+            return
+        directory = os.path.dirname(os.path.abspath(self.profile_path))
+        try:
+            handle, temporary = tempfile.mkstemp(dir=directory, prefix=".profile-")
+            os.close(handle)
+            try:
+                self.profiler.dump_stats(temporary)
+                os.replace(temporary, self.profile_path)
+            except BaseException:
+                os.unlink(temporary)
+                raise
+        except OSError as e:
+            sys.stderr.write(
+                "Could not write profile to %s: %s\n" % (self.profile_path, e)
+            )
@@ -0,0 +1,331 @@
+import asyncio
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+from django.test import RequestFactory
+from django.test.utils import override_settings
+from django.utils import timezone
+from tabulate import tabulate
+
+from acmeproxy.proxy import benchmark, dns, records
+from acmeproxy.proxy.fastpath import FastAPIHandler
+from acmeproxy.proxy.management.commands import dnsserver
+from acmeproxy.proxy.models import Authorisation, Response
+
+
+class Command(BaseCommand):
+    help = (
+        "Measures a hot path against rows seeded into a temporary database, "
+        "which is destroyed afterwards."
+    )
+
+    suites = ("lookups", "api", "dns", "pipeapi")
+
+    def add_arguments(self, parser):
+        parser.add_argument("suite", choices=self.suites)
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=100000,
+            help="number of rows to seed in each table, defaults to 100000",
+        )
+        parser.add_argument(
+            "--repeat",
+            type=int,
+            default=1000,
+            help="number of times to run each measured operation, defaults to 1000",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=8,
+            help="number of clients running the operations at once, for the suites which have them, defaults to 8",
+        )
+
+    def suite_lookups(self, options):
+        """
+        Compares the case-insensitive lookups used previously with exact
+        matches on the indexed normalised names.
+        """
+
+        benchmark.seed_authorisations(options["rows"])
+        benchmark.seed_responses(options["rows"])
+
+        names = [
+            benchmark.seeded_name(random.randrange(options["rows"])).upper()
+            for _ in range(options["repeat"])
+        ]
+
+        def live(query):
+            return list(
+                Response.objects.filter(
+                    Q(expired_at__gt=timezone.now()) | Q(expired_at__isnull=True),
+                    query,
+                )
+            )
+
+        cases = [
+            (
+                "authorisation name__iexact",
+                lambda name: Authorisation.objects.get(name__iexact=name),
+            ),
+            (
+                "authorisation normalised_name",
+                lambda name: Authorisation.objects.get(normalised_name=name.lower()),
+            ),
+            ("live responses name__iexact", lambda name: live(Q(name__iexact=name))),
+            (
+                "live responses normalised_name",
+                lambda name: live(Q(normalised_name=name.lower())),
+            ),
+            (
+                "pipeapi question responses",
+                lambda name: list(
+                    records.question_responses(records.CHALLENGE_PREFIX + name)
+                ),
+            ),
+        ]
+
+        return [
+            benchmark.summarise(label, benchmark.timings(function, names))
+            for label, function in cases
+        ]
+
+    def suite_api(self, options):
+        """
+        Compares the DRF views served through the full middleware chain with
+        the fast path served by FastAPIHandler, reporting the mean peak memory
+        allocated per request alongside the timings.
+        """
+
+        benchmark.seed_authorisations(options["rows"])
+
+        endpoints = [
+            (
+                "publish_response",
+                lambda index: {
+                    "name": benchmark.seeded_name(index),
+                    "response": "benchmark",
+                    "secret": "%032x" % index,
+                },
+            ),
+            (
+                "expire_response",
+                lambda index: {
+                    "name": benchmark.seeded_name(index),
+                    "secret": "%032x" % index,
+                },
+            ),
+            (
+                "create_authorisation",
+                lambda index: {"name": "new.%s" % benchmark.seeded_name(index)},
+            ),
+        ]
+        applications = [("drf", WSGIHandler()), ("fast path", FastAPIHandler())]
+        factory = RequestFactory()
+
+        def requests(path, fields, count):
+            # the request bodies can only be read once, so build them per run
+            return [
+                factory.post(path, fields(random.randrange(options["rows"]))).environ
+                for _ in range(count)
+            ]
+
+        results = []
+        with benchmark.kept_connections(), override_settings(
+            ALLOWED_HOSTS=["testserver"], ACMEPROXY_AUTHORISATION_CREATION_SECRETS=None
+        ):
+            for path, fields in endpoints:
+                for label, application in applications:
+                    statuses = []
+
+                    def serve(environ):
+                        status, body = benchmark.wsgi_request(application, environ)
+                        statuses.append(status)
+
+                    for environ in requests("/" + path, fields, 10):
+                        serve(environ)
+                    samples = benchmark.timings(
+                        serve, requests("/" + path, fields, options["repeat"])
+                    )
+                    peaks = benchmark.peak_memory(
+                        serve, requests("/" + path, fields, options["repeat"])
+                    )
+                    results.append(
+                        benchmark.summarise(
+                            "%s %s" % (path, label),
+                            samples,
+                            requests_per_s=round(len(samples) / sum(samples)),
+                            peak_kib=round(sum(peaks) / len(peaks) / 1024, 1),
+                            errors=sum(status != 200 for status in statuses),
+                        )
+                    )
+        return results
+
+    def suite_dns(self, options):
+        """
+        Serves the seeded records with the dnsserver command on localhost, and
+        measures concurrent clients each sending --repeat queries over UDP or
+        TCP.
+        """
+
+        benchmark.seed_responses(options["rows"])
+        server = dnsserver.Command()
+        server.cache = records.RecordCache(interval=60)
+        server.cache.refresh()
+
+        # seed_responses leaves every tenth response live
+        def live_name():
+            return benchmark.seeded_name(random.randrange(0, options["rows"], 10))
+
+        def expired_name():
+            return benchmark.seeded_name(random.randrange(1, options["rows"], 2))
+
+        cases = [
+            ("udp TXT", lambda: (records.CHALLENGE_PREFIX + live_name(), 16), False),
+            (
+                "udp TXT expired",
+                lambda: (records.CHALLENGE_PREFIX + expired_name(), 16),
+                False,
+            ),
+            (
+                "udp ANY",
+                lambda: (records.CHALLENGE_PREFIX + live_name(), dns.ANY),
+                False,
+            ),
+            (
+                "udp CAA parent",
+                lambda: (records.strip_labels(live_name(), 1), 257),
+                False,
+            ),
+            ("tcp TXT", lambda: (records.CHALLENGE_PREFIX + live_name(), 16), True),
+        ]
+
+        results = []
+        loop = asyncio.new_event_loop()
+        try:
+            transport, tcp_server = loop.run_until_complete(
+                server.start("127.0.0.1", 0)
+            )
+            port = transport.get_extra_info("sockname")[1]
+            with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+                for label, question, tcp in cases:
+                    clients = [
+                        [
+                            dns.build_query(*question(), id=i % 65536)
+                            for i in range(options["repeat"])
+                        ]
+                        for _ in range(options["concurrency"])
+                    ]
+                    start = time.perf_counter()
+                    exchanges = loop.run_until_complete(
+                        asyncio.gather(
+                            *[
+                                loop.run_in_executor(
+                                    executor, benchmark.dns_exchange, port, queries, tcp
+                                )
+                                for queries in clients
+                            ]
+                        )
+                    )
+                    elapsed = time.perf_counter() - start
+
+                    samples = [sample for done, errors in exchanges for sample in done]
+                    results.append(
+                        benchmark.summarise(
+                            label,
+                            samples,
+                            queries_per_s=round(len(samples) / elapsed),
+                            errors=sum(errors for done, errors in exchanges),
+                        )
+                    )
+            transport.close()
+            tcp_server.close()
+            loop.run_until_complete(tcp_server.wait_closed())
+        finally:
+            loop.close()
+        return results
+
+    def suite_pipeapi(self, options):
+        """
+        Drives the pipeapi command in-process with --repeat questions of each
+        kind, with and without its miss cache or record cache, counting the
+        database queries made for each question.
+        """
+
+        benchmark.seed_responses(options["rows"])
+
+        # seed_responses leaves every tenth response live
+        def live_name():
+            return benchmark.seeded_name(random.randrange(0, options["rows"], 10))
+
+        def expired_name():
+            return benchmark.seeded_name(random.randrange(1, options["rows"], 2))
+
+        kinds = [
+            ("TXT", lambda: (records.CHALLENGE_PREFIX + live_name(), "TXT")),
+            ("TXT miss", lambda: (records.CHALLENGE_PREFIX + expired_name(), "TXT")),
+            ("ANY", lambda: (records.CHALLENGE_PREFIX + live_name(), "ANY")),
+            ("SOA", lambda: (live_name(), "SOA")),
+            ("CAA parent", lambda: (records.strip_labels(live_name(), 1), "CAA")),
+            ("AAAA miss", lambda: (records.CHALLENGE_PREFIX + live_name(), "AAAA")),
+        ]
+        modes = [
+            ("uncached", []),
+            ("filtered", ["--miss-cache-interval=1"]),
+            ("cached", ["--cache-interval=1"]),
+        ]
+
+        results = []
+        for kind, question in kinds:
+            for mode, arguments in modes:
+                # the first question is a warm up (which builds the cache), and
+                # isn't measured
+                questions = [
+                    "Q\t%s\tIN\t%s\t-1\t127.0.0.1\n" % question()
+                    for _ in range(options["repeat"] + 1)
+                ]
+                feed = benchmark.QuestionFeed(["HELO\t1\n"] + questions)
+                queries = [0] * (len(questions) + 2)
+
+                def count(execute, sql, params, many, context):
+                    queries[feed.position - 1] += 1
+                    return execute(sql, params, many, context)
+
+                stdin = sys.stdin
+                sys.stdin = feed
+                try:
+                    with connection.execute_wrapper(count):
+                        call_command("pipeapi", *arguments, stdout=StringIO())
+                except SystemExit:
+                    pass
+                finally:
+                    sys.stdin = stdin
+
+                samples = feed.durations()[2:]
+                measured = queries[2 : len(questions) + 1]
+                results.append(
+                    benchmark.summarise(
+                        "%s %s" % (kind, mode),
+                        samples,
+                        queries_per_s=round(len(samples) / sum(samples)),
+                        db_queries=round(sum(measured) / len(measured), 2),
+                    )
+                )
+        return results
+
+    def handle(self, *args, **options):
+        with benchmark.temporary_database():
+            results = getattr(self, "suite_%s" % options["suite"])(options)
+
+        for row in results:
+            row["rows"] = options["rows"]
+        self.stdout.write(tabulate(results, headers="keys"))
@@ -13,7 +13,7 @@ class Command(BaseCommand):
         name = options["name"]
 
         try:
-            authorisation = Authorisation.objects.get(name__iexact=name)
+            authorisation = Authorisation.objects.get(normalised_name=name.lower())
         except Authorisation.DoesNotExist:
             raise CommandError('Authorisation "%s" does not exist' % name)
 
@@ -0,0 +1,154 @@
+import asyncio
+import struct
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+
+from acmeproxy.proxy import dns, records
+
+
+class DNSProtocol(asyncio.DatagramProtocol):
+    def __init__(self, respond):
+        self.respond = respond
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, addr):
+        reply = self.respond(data)
+        if reply is not None:
+            self.transport.sendto(reply, addr)
+
+
+class Command(BaseCommand):
+    help = (
+        "Serves the challenge records authoritatively over UDP and TCP, "
+        "without PowerDNS"
+    )
+    cache = None
+    max_udp_size = 1232
+    tcp_timeout = 10
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--listen",
+            default="127.0.0.1:53",
+            metavar="HOST:PORT",
+            help="address to accept queries on over both UDP and TCP, defaults to 127.0.0.1:53",
+        )
+        parser.add_argument(
+            "--cache-interval",
+            type=float,
+            default=getattr(settings, "ACMEPROXY_RECORD_CACHE_INTERVAL", None) or 1,
+            help="how often (in seconds) to check whether the in-memory index of the records needs rebuilding, defaults to ACMEPROXY_RECORD_CACHE_INTERVAL or 1",
+        )
+        parser.add_argument(
+            "--max-udp-size",
+            type=int,
+            default=self.max_udp_size,
+            help="largest UDP response to send to EDNS clients, defaults to %d"
+            % self.max_udp_size,
+        )
+        parser.add_argument(
+            "--tcp-timeout",
+            type=float,
+            default=self.tcp_timeout,
+            metavar="SECONDS",
+            help="close idle TCP connections after this long, defaults to %d"
+            % self.tcp_timeout,
+        )
+
+    def respond(self, data, tcp=False):
+        """
+        Returns the response to a query in wire format, or None if there is
+        nothing which can be sent back.
+        """
+
+        try:
+            query = dns.parse_query(data)
+        except dns.FormatError as e:
+            return None if e.id is None else dns.error_response(e.id, dns.FORMERR)
+
+        if tcp:
+            limit = 65535
+        elif query.edns is None:
+            limit = dns.UDP_LIMIT
+        else:
+            limit = min(query.edns, self.max_udp_size)
+
+        answer = dns.REFUSED, False, [], []
+        if query.edns_version:
+            answer = dns.BADVERS, False, [], []
+        elif (query.flags >> 11) & 0xF != dns.OPCODE_QUERY:
+            answer = dns.NOTIMP, False, [], []
+        elif query.qclass in (dns.CLASS_IN, dns.CLASS_ANY) and query.qtype not in (
+            dns.AXFR,
+            dns.IXFR,
+        ):
+            try:
+                self.cache.refresh()
+            except DatabaseError:
+                answer = dns.SERVFAIL, False, [], []
+            else:
+                answer = dns.resolve(self.cache.index, query.qname, query.qtype)
+
+        return dns.build_response(query, *answer, limit, self.max_udp_size)
+
+    async def handle_tcp(self, reader, writer):
+        try:
+            while True:
+                prefix = await asyncio.wait_for(reader.readexactly(2), self.tcp_timeout)
+                data = await asyncio.wait_for(
+                    reader.readexactly(struct.unpack("!H", prefix)[0]), self.tcp_timeout
+                )
+                reply = self.respond(data, tcp=True)
+                if reply is None:
+                    break
+                writer.write(struct.pack("!H", len(reply)) + reply)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def start(self, host, port):
+        """
+        Starts listening for UDP and TCP queries, returning the UDP transport
+        and TCP server. If port is 0, both use the port picked for UDP.
+        """
+
+        loop = asyncio.get_event_loop()
+        transport, protocol = await loop.create_datagram_endpoint(
+            lambda: DNSProtocol(self.respond), local_addr=(host, port)
+        )
+        port = transport.get_extra_info("sockname")[1]
+        server = await asyncio.start_server(self.handle_tcp, host=host, port=port)
+        return transport, server
+
+    def handle(self, *args, **options):
+        host, _, port = options["listen"].rpartition(":")
+        try:
+            port = int(port)
+        except ValueError:
+            raise CommandError("--listen must be given as HOST:PORT")
+        host = host.strip("[]") or "0.0.0.0"
+
+        self.cache = records.RecordCache(options["cache_interval"])
+        self.max_udp_size = max(options["max_udp_size"], dns.UDP_LIMIT)
+        self.tcp_timeout = options["tcp_timeout"]
+
+        # index the records before accepting the first query
+        self.cache.refresh()
+
+        loop = asyncio.get_event_loop()
+        transport, server = loop.run_until_complete(self.start(host, port))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            transport.close()
+            server.close()
+            loop.run_until_complete(server.wait_closed())
@@ -0,0 +1,66 @@
+import json
+import os
+from itertools import islice
+
+from django.core.management.base import BaseCommand, CommandError
+
+from acmeproxy.proxy.models import Authorisation
+
+FIELDS = ("name", "account", "secret", "created_by_ip", "created_at")
+
+# rows are fetched from the database and written out this many at a time
+CHUNK_SIZE = 2000
+
+
+class Command(BaseCommand):
+    help = (
+        "Write authorisations, including their secrets, as JSON lines which "
+        "importauthorisations can read"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output",
+            default="-",
+            help="file to write to, defaults to standard output",
+        )
+        parser.add_argument(
+            "--account",
+            default=None,
+            help="if specified, export only authorisations for this account",
+        )
+
+    def export(self, write, options):
+        authorisations = Authorisation.objects.order_by("pk")
+        if options["account"] is not None:
+            authorisations = authorisations.filter(account=options["account"])
+
+        exported = 0
+        iterator = authorisations.values_list(*FIELDS).iterator(chunk_size=CHUNK_SIZE)
+        for chunk in iter(lambda: list(islice(iterator, CHUNK_SIZE)), []):
+            lines = []
+            for row in chunk:
+                entry = dict(zip(FIELDS, row))
+                entry["created_at"] = entry["created_at"].isoformat()
+                lines.append(json.dumps(entry) + "\n")
+            write("".join(lines))
+            exported += len(chunk)
+        return exported
+
+    def handle(self, *args, **options):
+        if options["output"] == "-":
+            self.export(lambda text: self.stdout.write(text, ending=""), options)
+            return
+
+        try:
+            # only readable by its owner, as it holds the secrets
+            handle = os.open(
+                options["output"], os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600
+            )
+            with open(handle, "w", encoding="utf-8") as out:
+                exported = self.export(out.write, options)
+        except OSError as e:
+            raise CommandError("Could not write %s: %s" % (options["output"], e))
+        self.stdout.write(
+            "Exported %d authorisations to %s" % (exported, options["output"])
+        )
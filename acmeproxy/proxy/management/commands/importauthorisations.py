@@ -0,0 +1,180 @@
+import json
+import sys
+from itertools import islice
+
+from django.core.exceptions import ValidationError
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import dateparse, timezone
+
+from acmeproxy.proxy.database import retry_locked
+from acmeproxy.proxy.models import Authorisation
+
+REQUIRED = ("name", "secret", "created_by_ip")
+FIELDS = REQUIRED + ("account",)
+
+
+class Conflict(Exception):
+    pass
+
+
+def parse_line(number, line):
+    """
+    Returns the fields of the authorisation on a line written by
+    exportauthorisations, or raises CommandError saying what is wrong with it.
+    """
+
+    try:
+        entry = json.loads(line)
+    except ValueError as e:
+        raise CommandError("Line %d is not valid JSON: %s" % (number, e))
+    if not isinstance(entry, dict):
+        raise CommandError("Line %d is not a JSON object" % number)
+
+    fields = {"account": entry.get("account") or ""}
+    for field in REQUIRED:
+        if not entry.get(field):
+            raise CommandError('Line %d has no "%s"' % (number, field))
+        fields[field] = entry[field]
+
+    try:
+        for field in FIELDS:
+            if fields[field]:
+                fields[field] = Authorisation._meta.get_field(field).clean(
+                    str(fields[field]), None
+                )
+    except ValidationError as e:
+        raise CommandError(
+            'Line %d has an invalid "%s": %s' % (number, field, " ".join(e.messages))
+        )
+
+    created_at = entry.get("created_at")
+    if created_at:
+        try:
+            fields["created_at"] = dateparse.parse_datetime(created_at)
+        except (TypeError, ValueError):
+            fields["created_at"] = None
+        if fields["created_at"] is None:
+            raise CommandError('Line %d has an invalid "created_at"' % number)
+        if timezone.is_naive(fields["created_at"]):
+            fields["created_at"] = timezone.make_aware(fields["created_at"])
+    else:
+        fields["created_at"] = timezone.now()
+    return fields
+
+
+class Command(BaseCommand):
+    help = (
+        "Create authorisations from JSON lines written by exportauthorisations, "
+        "keeping their secrets"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("file", help="file to read from, or - for standard input")
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="how many authorisations to create in each transaction",
+        )
+        parser.add_argument(
+            "--on-conflict",
+            choices=("skip", "replace", "fail"),
+            default="skip",
+            help=(
+                "what to do with names which already have an authorisation: keep "
+                "it (the default), overwrite it, or stop"
+            ),
+        )
+
+    def entries(self, lines):
+        for number, line in enumerate(lines, 1):
+            if line.strip():
+                yield number, parse_line(number, line)
+
+    def import_batch(self, batch, on_conflict):
+        """
+        Creates (or replaces) the authorisations in batch, a list of line
+        numbers and fields, in a single transaction. Returns the numbers of
+        authorisations created, replaced and skipped.
+        """
+
+        # a name repeated within the file conflicts with its earlier line
+        # just as it would across batches: the first wins when skipping and
+        # the last when replacing
+        entries = {}
+        conflicts = []
+        for number, fields in batch:
+            name = fields["name"].lower()
+            if name in entries:
+                conflicts.append((number, fields["name"]))
+                if on_conflict != "replace":
+                    continue
+            entries[name] = number, fields
+
+        with transaction.atomic():
+            # the first authorisation for a name is the one used, as in the API
+            existing = dict(
+                Authorisation.objects.filter(normalised_name__in=list(entries))
+                .order_by("-pk")
+                .values_list("normalised_name", "pk")
+            )
+            conflicts.extend(
+                (entries[name][0], entries[name][1]["name"]) for name in existing
+            )
+            if conflicts and on_conflict == "fail":
+                raise Conflict(*min(conflicts))
+
+            created = []
+            replaced = []
+            for name, (number, fields) in entries.items():
+                authorisation = Authorisation(pk=existing.get(name), **fields)
+                authorisation.normalise_name()
+                if authorisation.pk is None:
+                    created.append(authorisation)
+                elif on_conflict == "replace":
+                    replaced.append(authorisation)
+
+            Authorisation.objects.bulk_create(created)
+            # this invalidates the cached lookups of the replaced names
+            Authorisation.objects.bulk_update(
+                replaced, ("normalised_name",) + FIELDS + ("created_at",)
+            )
+
+        # the earlier lines for a repeated name were replaced or skipped too
+        superseded = len(batch) - len(entries)
+        if on_conflict == "replace":
+            counts = len(created), len(replaced) + superseded, 0
+        else:
+            counts = len(created), 0, len(batch) - len(created)
+        return counts
+
+    def import_lines(self, lines, options):
+        totals = [0, 0, 0]
+        entries = self.entries(lines)
+        for batch in iter(lambda: list(islice(entries, options["batch_size"])), []):
+            try:
+                counts = retry_locked(self.import_batch, batch, options["on_conflict"])
+            except Conflict as e:
+                raise CommandError(
+                    'Line %d: an authorisation for "%s" already exists' % e.args
+                )
+            totals = [total + count for total, count in zip(totals, counts)]
+        return totals
+
+    def handle(self, *args, **options):
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be at least 1")
+
+        if options["file"] == "-":
+            totals = self.import_lines(sys.stdin, options)
+        else:
+            try:
+                with open(options["file"], encoding="utf-8") as lines:
+                    totals = self.import_lines(lines, options)
+            except OSError as e:
+                raise CommandError("Could not read %s: %s" % (options["file"], e))
+
+        self.stdout.write(
+            "Imported %d authorisations, replaced %d, skipped %d" % tuple(totals)
+        )
@@ -1,10 +1,27 @@
-from collections import OrderedDict
+import csv
+import json
+from itertools import chain, islice
 
 from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Count
+from django.db.models.functions import TruncDate
 from django.utils import dateparse
-from tabulate import tabulate
 
-from acmeproxy.proxy.models import Response
+from acmeproxy.proxy.models import Authorisation, Response
+
+COLUMNS = ("name", "expired_at", "created_by_ip", "created_at")
+
+# rows are fetched from the database and written out this many at a time, and
+# the widths of the table's columns are fitted to the first chunk
+CHUNK_SIZE = 2000
+
+
+def cell(value):
+    return "" if value is None else str(value)
+
+
+def json_value(value):
+    return value.isoformat() if hasattr(value, "isoformat") else value
 
 
 class Command(BaseCommand):
@@ -26,8 +43,36 @@ class Command(BaseCommand):
             default=None,
             help="if specified, return only records for this name",
         )
+        parser.add_argument(
+            "--account",
+            default=None,
+            help="if specified, return only records for names authorised by this account",
+        )
+        parser.add_argument(
+            "--live-only",
+            action="store_true",
+            help="return only the records which are still being served",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="if specified, return at most this many records",
+        )
+        parser.add_argument(
+            "--summary",
+            choices=("name", "day"),
+            default=None,
+            help="if specified, count the records for each name or day rather than listing them",
+        )
+        parser.add_argument(
+            "--format",
+            choices=("table", "csv", "jsonl"),
+            default="table",
+            help="output as a table (the default), CSV, or a JSON object per line",
+        )
 
-    def handle(self, *args, **options):
+    def responses(self, options):
         query = {}
 
         if options["start"] is not None:
@@ -41,23 +86,96 @@ class Command(BaseCommand):
                 raise CommandError("Invalid end date")
 
         if options["name"] is not None:
-            query["name__iexact"] = options["name"]
+            query["normalised_name"] = options["name"].lower()
+
+        if options["account"] is not None:
+            query["normalised_name__in"] = Authorisation.objects.filter(
+                account=options["account"]
+            ).values("normalised_name")
 
         responses = Response.objects.filter(**query)
-        if len(responses) < 1:
-            raise CommandError("No responses found")
+        if options["live_only"]:
+            responses = responses.live()
+        return responses
+
+    def rows(self, options):
+        """
+        Returns the column names, and the rows as tuples in chunks.
+        """
 
-        # this is pretty inefficient but the table is likely to be small
-        table = [
-            {
-                k: v
-                for (k, v) in response.__dict__.items()
-                if k in ("expired_at", "created_at", "created_by_ip", "name")
-            }
-            for response in responses
+        responses = self.responses(options)
+        if options["summary"] == "name":
+            columns = ("name", "responses")
+            rows = (
+                responses.values_list("normalised_name")
+                .annotate(responses=Count("pk"))
+                .order_by("normalised_name")
+            )
+        elif options["summary"] == "day":
+            columns = ("day", "responses")
+            rows = (
+                responses.annotate(day=TruncDate("created_at"))
+                .values_list("day")
+                .annotate(responses=Count("pk"))
+                .order_by("day")
+            )
+        else:
+            columns = COLUMNS
+            rows = responses.order_by("pk").values_list(*COLUMNS)
+
+        if options["limit"] is not None:
+            rows = rows[: options["limit"]]
+
+        iterator = rows.iterator(chunk_size=CHUNK_SIZE)
+        chunks = iter(lambda: list(islice(iterator, CHUNK_SIZE)), [])
+        return columns, chunks
+
+    def write_table(self, columns, first, chunks):
+        # numbers are right aligned and everything else left aligned, as
+        # tabulate does
+        widths = [
+            max([len(column)] + [len(cell(row[index])) for row in first])
+            for index, column in enumerate(columns)
         ]
-        table = [
-            OrderedDict(sorted(entry.items(), key=lambda x: x[0], reverse=True))
-            for entry in table
+        numeric = [
+            all(isinstance(row[index], int) for row in first)
+            for index in range(len(columns))
         ]
-        self.stdout.write(tabulate(table, headers="keys"))
+
+        def line(values):
+            return "  ".join(
+                cell(value).rjust(width) if right else cell(value).ljust(width)
+                for value, width, right in zip(values, widths, numeric)
+            ).rstrip()
+
+        self.stdout.write(line(columns))
+        self.stdout.write("  ".join("-" * width for width in widths))
+        for chunk in chain([first], chunks):
+            self.stdout.write("".join(line(row) + "\n" for row in chunk), ending="")
+
+    def write_csv(self, columns, first, chunks):
+        writer = csv.writer(self.stdout, lineterminator="\n")
+        writer.writerow(columns)
+        for chunk in chain([first], chunks):
+            writer.writerows([[cell(value) for value in row] for row in chunk])
+
+    def write_jsonl(self, columns, first, chunks):
+        for chunk in chain([first], chunks):
+            self.stdout.write(
+                "".join(
+                    json.dumps(dict(zip(columns, map(json_value, row)))) + "\n"
+                    for row in chunk
+                ),
+                ending="",
+            )
+
+    def handle(self, *args, **options):
+        if options["limit"] is not None and options["limit"] < 1:
+            raise CommandError("--limit must be at least 1")
+
+        columns, chunks = self.rows(options)
+        first = next(chunks, None)
+        if first is None:
+            raise CommandError("No responses found")
+
+        getattr(self, "write_%s" % options["format"])(columns, first, chunks)
@@ -0,0 +1,191 @@
+import http.client
+import random
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from socketserver import ThreadingMixIn
+from urllib.parse import urlencode
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer
+
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test.utils import override_settings
+from tabulate import tabulate
+
+from acmeproxy.proxy import benchmark
+from acmeproxy.proxy.fastpath import FastAPIHandler
+from acmeproxy.proxy.tests.util import create_authorisation, create_response
+
+OPERATIONS = ("publish_response", "expire_response", "create_authorisation")
+
+
+class ThreadingWSGIServer(ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    # the default backlog of 5 would have connections retried after a second,
+    # rather than measuring the server
+    request_queue_size = 128
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Serves the API from a threaded WSGI server on localhost, and measures "
+        "it under concurrent publish, expire and create requests. Runs against "
+        "a temporary test database, which is destroyed afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=8,
+            help="number of clients making requests at once, defaults to 8",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=1000,
+            help="total number of requests to make, defaults to 1000",
+        )
+        parser.add_argument(
+            "--authorisations",
+            type=int,
+            default=1000,
+            help="number of authorisations to seed, defaults to 1000",
+        )
+        parser.add_argument(
+            "--responses",
+            type=int,
+            default=10000,
+            help="number of responses to seed, defaults to 10000",
+        )
+        parser.add_argument(
+            "--operation",
+            action="append",
+            choices=OPERATIONS,
+            help="endpoint to make requests to, chosen at random for each request "
+            "if given more than once, defaults to all of them",
+        )
+        parser.add_argument(
+            "--fast",
+            action="store_true",
+            help="serve the API with the fast path handler (see fastwsgi.py)",
+        )
+
+    def seed(self, options):
+        names = [benchmark.seeded_name(i) for i in range(options["authorisations"])]
+        with transaction.atomic():
+            for name in names:
+                create_authorisation(name)
+            for index in range(options["responses"]):
+                create_response(names[index % len(names)])
+        return names
+
+    @staticmethod
+    def request(port, operation, fields):
+        """
+        Makes one request, returning its status (or None if the connection
+        failed) and duration in seconds.
+        """
+
+        start = time.perf_counter()
+        try:
+            client = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+            try:
+                client.request(
+                    "POST",
+                    "/" + operation,
+                    urlencode(fields),
+                    {"Content-Type": "application/x-www-form-urlencoded"},
+                )
+                response = client.getresponse()
+                response.read()
+                status = response.status
+            finally:
+                client.close()
+        except (OSError, http.client.HTTPException):
+            status = None
+        return status, time.perf_counter() - start
+
+    def fields(self, operation, names):
+        if operation == "create_authorisation":
+            return {"name": "%s.loadtest.example.com" % uuid.uuid4().hex}
+        fields = {"name": random.choice(names), "secret": "test_secret"}
+        if operation == "publish_response":
+            fields["response"] = uuid.uuid4().hex
+        return fields
+
+    def run(self, options):
+        names = self.seed(options)
+        operations = options["operation"] or OPERATIONS
+
+        server = ThreadingWSGIServer(("127.0.0.1", 0), QuietRequestHandler)
+        server.set_app(FastAPIHandler() if options["fast"] else WSGIHandler())
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        port = server.server_address[1]
+
+        requests = []
+        for _ in range(options["requests"]):
+            operation = random.choice(operations)
+            requests.append((operation, self.fields(operation, names)))
+
+        try:
+            with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+                start = time.perf_counter()
+                outcomes = list(
+                    executor.map(lambda request: self.request(port, *request), requests)
+                )
+                elapsed = time.perf_counter() - start
+        finally:
+            server.shutdown()
+            server.server_close()
+
+        results = []
+        # only the operations which were picked at least once
+        for label in sorted({operation for operation, fields in requests}) + ["total"]:
+            measured = [
+                outcome
+                for (operation, fields), outcome in zip(requests, outcomes)
+                if label in ("total", operation)
+            ]
+            statuses = Counter(status for status, duration in measured)
+            results.append(
+                benchmark.summarise(
+                    label,
+                    [duration for status, duration in measured],
+                    requests_per_s=round(len(measured) / elapsed, 1),
+                    # 500s are the requests which still found the database
+                    # locked after retrying
+                    database_errors=statuses[500],
+                    other_errors=sum(
+                        count
+                        for status, count in statuses.items()
+                        if status not in (200, 500)
+                    ),
+                )
+            )
+        return results
+
+    def handle(self, *args, **options):
+        if options["concurrency"] < 1 or options["requests"] < 1:
+            raise CommandError("--concurrency and --requests must be at least 1")
+        if options["authorisations"] < 1:
+            raise CommandError("--authorisations must be at least 1")
+
+        with benchmark.temporary_database("acmeproxy-loadtest-"), override_settings(
+            ALLOWED_HOSTS=["127.0.0.1"], ACMEPROXY_AUTHORISATION_CREATION_SECRETS=None
+        ):
+            results = self.run(options)
+
+        for row in results:
+            row["concurrency"] = options["concurrency"]
+            row["responses"] = options["responses"]
+        self.stdout.write(tabulate(results, headers="keys"))
@@ -1,16 +1,103 @@
 import sys
 import time
+from collections import namedtuple
 
 from django.conf import settings
 from django.core.management.base import BaseCommand
-from django.db.models import Q
-from django.utils import timezone
+from django.db import connection
 
-from acmeproxy.proxy.models import Response
+from acmeproxy.proxy import instrumentation, metrics, records
+
+# the fields of a question in each version of the pipe backend ABI
+QUESTION_FIELDS = {
+    1: ("kind", "qname", "qclass", "qtype", "id", "remote_ip"),
+    2: ("kind", "qname", "qclass", "qtype", "id", "remote_ip", "local_ip"),
+    3: (
+        "kind",
+        "qname",
+        "qclass",
+        "qtype",
+        "id",
+        "remote_ip",
+        "local_ip",
+        "edns_subnet",
+    ),
+}
+
+Question = namedtuple("Question", QUESTION_FIELDS[3])
+Question.__new__.__defaults__ = (None, None)
 
 
 class Command(BaseCommand):
     help = "Called by PowerDNS to exchange DNS data"
+    cache = None
+    misses = None
+    metrics = None
+    tracer = None
+    trace = instrumentation.NULL_TRACE
+    abi_version = 1
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--cache-interval",
+            type=float,
+            default=getattr(settings, "ACMEPROXY_RECORD_CACHE_INTERVAL", None),
+            help="if specified, answer from an in-memory index of the records which is refreshed at most this often (in seconds)",
+        )
+        parser.add_argument(
+            "--miss-cache-interval",
+            type=float,
+            default=getattr(settings, "ACMEPROXY_MISS_CACHE_INTERVAL", None),
+            help="if specified without --cache-interval, answer questions which can't have records from memory, checking for changes at most this often (in seconds)",
+        )
+        parser.add_argument(
+            "--miss-cache-size",
+            type=int,
+            default=10000,
+            help="the most questions for known names without records to remember, defaults to 10000",
+        )
+        parser.add_argument(
+            "--metrics-file",
+            default=getattr(settings, "ACMEPROXY_PIPEAPI_METRICS_FILE", None),
+            help="if specified, write counters and latency histograms to this file in the Prometheus text format, replacing {pid} with the process ID",
+        )
+        parser.add_argument(
+            "--metrics-interval",
+            type=float,
+            default=getattr(settings, "ACMEPROXY_PIPEAPI_METRICS_INTERVAL", 10),
+            help="how often (in seconds) to rewrite the metrics file while answering questions, defaults to ACMEPROXY_PIPEAPI_METRICS_INTERVAL or 10",
+        )
+        parser.add_argument(
+            "--slow-threshold",
+            type=float,
+            default=getattr(settings, "ACMEPROXY_PIPEAPI_SLOW_THRESHOLD", None),
+            metavar="SECONDS",
+            help="if specified, log questions taking at least this long with the time spent in each stage and the number of database queries made",
+        )
+        parser.add_argument(
+            "--slow-log",
+            choices=("stderr", "syslog"),
+            default="stderr",
+            help="where to log slow questions, defaults to stderr",
+        )
+        parser.add_argument(
+            "--profile-file",
+            default=getattr(settings, "ACMEPROXY_PIPEAPI_PROFILE_FILE", None),
+            help="if specified, profile a sample of the questions and write the stats to this file for pstats, replacing {pid} with the process ID",
+        )
+        parser.add_argument(
+            "--profile-rate",
+            type=float,
+            default=0.01,
+            help="the fraction of questions to profile, defaults to 0.01",
+        )
+        parser.add_argument(
+            "--profile-interval",
+            type=float,
+            default=60,
+            metavar="SECONDS",
+            help="how often to rewrite the profile file, defaults to 60",
+        )
 
     @staticmethod
     def format_data(qname, qtype, answer, ttl=60):
@@ -25,98 +112,200 @@ class Command(BaseCommand):
         self.stdout.write(line)
         self.stdout.flush()
 
+    def send_answers(self, answers):
+        """
+        Writes DATA lines for each (qname, record) pair followed by END, all
+        in a single write.
+        """
+
+        # ABI version 3 prefixes answers with the EDNS scope mask and auth bit
+        prefix = "DATA\t0\t1\t" if self.abi_version >= 3 else "DATA\t"
+        with self.trace.stage("format"):
+            lines = [
+                prefix
+                + self.format_data(
+                    qname, record["type"], record["content"], record["ttl"]
+                )
+                + "\n"
+                for qname, record in answers
+            ]
+            lines.append("END\n")
+        with self.trace.stage("write"):
+            self.stdout.write("".join(lines))
+            self.stdout.flush()
+
     @staticmethod
     def strip_labels(name, count):
-        return ".".join(name.split(".")[count:])
+        return records.strip_labels(name, count)
 
-    def generate_records(self):
-        responses = Response.objects.filter(
-            Q(expired_at__gt=timezone.now()) | Q(expired_at__isnull=True)
-        )
-        records = []
-
-        for response in responses:
-            # Serve the challenge TXT record for the requested zone
-            records.append(
-                {
-                    "name": "_acme-challenge.%s" % response.name,
-                    "type": "TXT",
-                    "ttl": 5,
-                    "content": response.response,
-                }
-            )
+    def generate_records(self, qname=None):
+        """
+        Generates the records for every live response, or if qname is given
+        only for the responses which could answer a question for that name.
+        """
 
-            # In case just the _acme-challenge.foo name was delegated, ensure authority at that level
-            records.append(
-                {
-                    "name": "_acme-challenge.%s" % response.name,
-                    "type": "SOA",
-                    "ttl": 5,
-                    "content": "%s. %s. %s 0 0 0 0"
-                    % (
-                        settings.ACMEPROXY_SOA_HOSTNAME,
-                        settings.ACMEPROXY_SOA_CONTACT,
-                        str(int(time.time())),
-                    ),
-                }
-            )
-            records.append(  # Serve NS for _acme-challenge.foo.example.com
-                {
-                    "name": "_acme-challenge.%s" % response.name,
-                    "type": "NS",
-                    "ttl": 5,
-                    "content": settings.ACMEPROXY_SOA_HOSTNAME,
-                }
+        if qname is None:
+            responses = records.live_responses()
+        else:
+            responses = records.question_responses(qname)
+
+        with self.trace.stage("query"):
+            rows = list(responses.values_list("normalised_name", "response"))
+        with self.trace.stage("records"):
+            return [
+                record
+                for name, response in rows
+                for record in records.response_records(name, response)
+            ]
+
+    def lookup(self, qname, qtype):
+        """
+        Returns the records that answer a question for qname and qtype.
+        """
+
+        if self.cache is not None:
+            with self.trace.stage("cache"):
+                return self.cache.lookup(qname, qtype)
+
+        generated = self.generate_records(qname)
+        with self.trace.stage("records"):
+            index = {}
+            for record in generated:
+                records.index_record(index, record)
+            return records.find_records(index, qname, qtype)
+
+    def list_records(self, zone=None):
+        """
+        Returns every live record in zone, or every live record at all if no
+        zone is given (as in ABI versions 1 to 3).
+        """
+
+        if self.cache is not None:
+            with self.trace.stage("cache"):
+                return self.cache.list(zone)
+
+        if zone is None:
+            responses = records.live_responses()
+        else:
+            responses = records.zone_responses(zone)
+
+        with self.trace.stage("query"):
+            rows = list(responses.values_list("normalised_name", "response"))
+        with self.trace.stage("records"):
+            index = {}
+            for name, response in rows:
+                for record in records.response_records(name, response):
+                    records.index_record(index, record)
+            return records.list_records(index, zone)
+
+    def parse_question(self, line):
+        """
+        Splits a question line according to the negotiated ABI version,
+        returning None if it has the wrong number of fields.
+        """
+
+        fields = line.strip().split()
+        if len(fields) != len(QUESTION_FIELDS[self.abi_version]):
+            return None
+        return Question(*fields)
+
+    def setup_cache(self, options):
+        if options["cache_interval"] is not None:
+            self.cache = records.RecordCache(options["cache_interval"])
+        elif options["miss_cache_interval"] is not None:
+            # the record cache answers misses from memory already
+            self.misses = records.MissCache(
+                options["miss_cache_interval"], options["miss_cache_size"]
             )
-            records.append(  # Serve CAA for _acme-challenge.foo.example.com
-                {
-                    "name": "_acme-challenge.%s" % response.name,
-                    "type": "CAA",
-                    "ttl": 5,
-                    "content": '0 issue "letsencrypt.org"',
-                }
+
+    def setup_metrics(self, options):
+        if options["metrics_file"]:
+            self.metrics = metrics.PipeMetrics(
+                options["metrics_file"], options["metrics_interval"]
             )
 
-            # Also claim to be authoritative for foo.example.com and example.com to handle CAA for the various ways in which the challenge
-            # might have been delegated (e.g. at the foo.example.com or example.com levels)
-
-            for depth in (0, 1):
-                extra_zone_name = self.strip_labels(response.name, depth)
-
-                records.append(
-                    {
-                        "name": extra_zone_name,
-                        "type": "SOA",
-                        "ttl": 5,
-                        "content": "%s. %s. %s 0 0 0 0"
-                        % (
-                            settings.ACMEPROXY_SOA_HOSTNAME,
-                            settings.ACMEPROXY_SOA_CONTACT,
-                            str(int(time.time())),
-                        ),
-                    }
-                )
-                records.append(
-                    {
-                        "name": extra_zone_name,
-                        "type": "NS",
-                        "ttl": 5,
-                        "content": settings.ACMEPROXY_SOA_HOSTNAME,
-                    }
-                )
-                records.append(
-                    {
-                        "name": extra_zone_name,
-                        "type": "CAA",
-                        "ttl": 5,
-                        "content": '0 issue "letsencrypt.org"',
-                    }
-                )
+    def setup_tracer(self, options):
+        if options["slow_threshold"] is None and not options["profile_file"]:
+            return
+        self.tracer = instrumentation.Instrumentation(
+            threshold=options["slow_threshold"],
+            logger=instrumentation.slow_logger(options["slow_log"]),
+            profile_path=options["profile_file"],
+            profile_rate=options["profile_rate"],
+            profile_interval=options["profile_interval"],
+        )
+
+    def observe(self, kind, qtype, answers, start):
+        if self.metrics is not None:
+            self.metrics.observe(kind, qtype, answers, time.perf_counter() - start)
+
+    def quit(self):
+        if self.metrics is not None:
+            self.metrics.write()
+        if self.tracer is not None:
+            self.tracer.dump()
+        sys.exit(0)
 
-        return records
+    def answer(self, line):
+        """
+        Answers a single line from PowerDNS.
+        """
+
+        start = time.perf_counter()
+
+        if line.startswith("AXFR"):
+            # AXFR <id> in ABI versions 1 to 3, PowerDNS only adds the zone from
+            # version 4 but it is honoured if given
+            fields = line.strip().split()
+            zone = fields[2] if len(fields) > 2 else None
+            answers = [(record["name"], record) for record in self.list_records(zone)]
+            self.send_answers(answers)
+            self.observe("AXFR", "AXFR", len(answers), start)
+            return
+
+        with self.trace.stage("parse"):
+            question = self.parse_question(line)
+        if question is None:
+            if line.startswith("DEBUGQUIT"):
+                self.quit()
+            elif line.startswith("PING"):
+                self.send("END")
+                self.observe("PING", "", 0, start)
+            return
+
+        if question.kind == "Q":
+            if self.misses is not None:
+                with self.trace.stage("misses"):
+                    miss = self.misses.is_miss(question.qname, question.qtype)
+                if miss:
+                    self.send("END")
+                    self.observe("Q", question.qtype, 0, start)
+                    return
+
+            answers = [
+                (question.qname, record)
+                for record in self.lookup(question.qname, question.qtype)
+            ]
+            if not answers and self.misses is not None:
+                self.misses.add(question.qname, question.qtype)
+            self.send_answers(answers)
+            self.observe("Q", question.qtype, len(answers), start)
+        else:
+            self.send("END")
+
+    def answer_traced(self, line):
+        with self.tracer.question(line) as self.trace:
+            try:
+                self.answer(line)
+            finally:
+                self.trace = instrumentation.NULL_TRACE
 
     def handle(self, *args, **options):
-        # handshake and accept version 1 of the ABI
+        self.setup_cache(options)
+        self.setup_metrics(options)
+        self.setup_tracer(options)
+
+        # handshake and accept versions 1 to 3 of the ABI
         line = sys.stdin.readline()
         try:
             query, version = line.strip().split()
@@ -124,45 +313,18 @@ class Command(BaseCommand):
             self.send("FAIL")
             sys.exit(1)
 
-        if query != "HELO" and version != "1":
+        if query != "HELO" or version not in ("1", "2", "3"):
             self.send("FAIL")
             sys.exit(1)
 
+        self.abi_version = int(version)
         self.send("OK", "ACME Proxy API")
 
         # loop forever answering questions
-        while True:
-            line = sys.stdin.readline()
+        if self.tracer is None:
+            while True:
+                self.answer(sys.stdin.readline())
 
-            try:
-                (
-                    question_type,
-                    qname,
-                    qclass,
-                    qtype,
-                    id,
-                    remote_ip,
-                ) = line.strip().split()
-            except ValueError:
-                if line.startswith("DEBUGQUIT"):
-                    sys.exit(0)
-                else:
-                    continue
-
-            records = self.generate_records()
-            found = 0
-            if question_type == "Q":
-                for record in records:
-                    if (
-                        qtype in ("ANY", record["type"])
-                        and qname.lower() == record["name"]
-                    ):
-                        found = found + 1
-                        self.send(
-                            "DATA",
-                            self.format_data(
-                                qname, record["type"], record["content"], record["ttl"]
-                            ),
-                        )
-
-            self.send("END")
+        with connection.execute_wrapper(self.tracer.count_query):
+            while True:
+                self.answer_traced(sys.stdin.readline())
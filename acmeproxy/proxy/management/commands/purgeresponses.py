@@ -0,0 +1,77 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from acmeproxy.proxy import purge
+
+
+class Command(BaseCommand):
+    help = "Delete published responses which are older than the retention period"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--older-than",
+            type=float,
+            default=None,
+            metavar="DAYS",
+            help="delete responses older than this many days, defaults to ACMEPROXY_RESPONSE_RETENTION",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=500,
+            help="number of responses to delete in each transaction, defaults to 500",
+        )
+        parser.add_argument(
+            "--pause",
+            type=float,
+            default=0,
+            metavar="SECONDS",
+            help="time to wait between batches, defaults to 0",
+        )
+        parser.add_argument(
+            "--archive",
+            default=None,
+            metavar="PATH",
+            help="if specified, append each deleted response to this file as a line of JSON",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="only count the responses which would be deleted",
+        )
+
+    def handle(self, *args, **options):
+        if options["older_than"] is not None:
+            retention = timedelta(days=options["older_than"])
+        elif purge.retention() is not None:
+            retention = purge.retention()
+        else:
+            raise CommandError(
+                "No retention period, use --older-than or set ACMEPROXY_RESPONSE_RETENTION"
+            )
+
+        if options["batch_size"] < 1:
+            raise CommandError("Batch size must be at least 1")
+
+        cutoff = timezone.now() - retention
+
+        if options["dry_run"]:
+            count = purge.purgeable_responses(cutoff).count()
+            self.stdout.write(
+                "Would delete %d responses created before %s" % (count, cutoff)
+            )
+            return
+
+        kwargs = {"batch_size": options["batch_size"], "pause": options["pause"]}
+        if options["archive"] is not None:
+            try:
+                with open(options["archive"], "a") as archive:
+                    count = purge.purge_responses(cutoff, archive=archive, **kwargs)
+            except OSError as e:
+                raise CommandError("Could not write archive: %s" % e)
+        else:
+            count = purge.purge_responses(cutoff, **kwargs)
+
+        self.stdout.write("Deleted %d responses created before %s" % (count, cutoff))
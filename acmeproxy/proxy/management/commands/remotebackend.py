@@ -0,0 +1,331 @@
+import asyncio
+import functools
+import json
+import os
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from django.conf import settings
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connection, connections
+
+from acmeproxy.proxy import instrumentation, purge
+from acmeproxy.proxy.database import retry_locked
+from acmeproxy.proxy.management.commands import pipeapi
+
+HTTP_REASONS = {200: "OK", 400: "Bad Request"}
+
+# the parameters each method needs, without which pdns is answered with a failure
+REQUIRED_PARAMETERS = {"lookup": ("qname", "qtype"), "list": ("zonename",)}
+
+
+class Command(pipeapi.Command):
+    help = (
+        "Serves DNS data to the PowerDNS remote backend over a unix socket and/or HTTP"
+    )
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument(
+            "--socket",
+            default=None,
+            help="path of a unix socket to accept connections from pdns on",
+        )
+        parser.add_argument(
+            "--listen",
+            default=None,
+            metavar="HOST:PORT",
+            help="address to accept HTTP connections from pdns on",
+        )
+        parser.add_argument(
+            "--purge-interval",
+            type=float,
+            default=getattr(settings, "ACMEPROXY_RESPONSE_PURGE_INTERVAL", None),
+            metavar="SECONDS",
+            help="if specified, purge responses older than ACMEPROXY_RESPONSE_RETENTION this often",
+        )
+
+    def setup(self):
+        # every lookup runs on this one thread, so the process shares a single
+        # database connection and the record cache is never used concurrently
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def teardown(self):
+        self.executor.submit(connections.close_all).result()
+        self.executor.shutdown()
+        if self.metrics is not None:
+            self.metrics.write()
+        if self.tracer is not None:
+            self.tracer.dump()
+
+    def method_initialize(self, parameters):
+        return True
+
+    def method_lookup(self, parameters):
+        start = time.perf_counter()
+        qname, qtype = parameters["qname"], parameters["qtype"]
+        name = qname[:-1] if qname.endswith(".") else qname
+
+        if self.misses is not None:
+            with self.trace.stage("misses"):
+                miss = self.misses.is_miss(name, qtype)
+            if miss:
+                self.observe("Q", qtype, 0, start)
+                return []
+
+        found = self.lookup(name, qtype)
+        if not found and self.misses is not None:
+            self.misses.add(name, qtype)
+        self.observe("Q", qtype, len(found), start)
+        return [
+            {
+                "qtype": record["type"],
+                "qname": qname,
+                "content": record["content"],
+                "ttl": record["ttl"],
+                "auth": True,
+            }
+            for record in found
+        ]
+
+    def method_list(self, parameters):
+        start = time.perf_counter()
+        zone = parameters["zonename"].rstrip(".")
+        found = self.list_records(zone)
+        self.observe("AXFR", "AXFR", len(found), start)
+        return [
+            {
+                "qtype": record["type"],
+                "qname": record["name"] + ".",
+                "content": record["content"],
+                "ttl": record["ttl"],
+                "auth": True,
+            }
+            for record in found
+        ]
+
+    def method_getDomainMetadata(self, parameters):
+        return []
+
+    def method_getAllDomainMetadata(self, parameters):
+        return {}
+
+    def dispatch(self, request):
+        """
+        Answers a single decoded remote backend request, returning the reply.
+        """
+
+        if not isinstance(request, dict):
+            return {"result": False}
+        method = request.get("method")
+        parameters = request.get("parameters") or {}
+        handler = getattr(self, "method_%s" % method, None)
+        # methods pdns may call which aren't implemented, such as getDomainKeys
+        if handler is None or not isinstance(parameters, dict):
+            return {"result": False}
+        if any(name not in parameters for name in REQUIRED_PARAMETERS.get(method, ())):
+            return {"result": False}
+
+        # pdns still gets an answer, rather than the connection dropping
+        try:
+            return {"result": handler(parameters)}
+        except DatabaseError as e:
+            self.stderr.write("Could not answer remote backend request: %s" % e)
+        except Exception:
+            self.stderr.write(
+                "Could not answer remote backend request %r:\n%s"
+                % (request, traceback.format_exc())
+            )
+        return {"result": False}
+
+    def dispatch_traced(self, request):
+        with connection.execute_wrapper(self.tracer.count_query):
+            with self.tracer.question(json.dumps(request)) as self.trace:
+                try:
+                    return self.dispatch(request)
+                finally:
+                    self.trace = instrumentation.NULL_TRACE
+
+    async def reply(self, request):
+        """
+        Answers a remote backend request in the executor, returning the
+        encoded reply.
+        """
+
+        dispatch = self.dispatch if self.tracer is None else self.dispatch_traced
+        loop = asyncio.get_event_loop()
+        reply = await loop.run_in_executor(self.executor, dispatch, request)
+        return json.dumps(reply).encode("utf-8")
+
+    async def handle_socket(self, reader, writer):
+        decoder = json.JSONDecoder()
+        buffer = ""
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                buffer += data.decode("utf-8")
+
+                # pdns doesn't delimit its messages, so decode as many complete
+                # JSON objects as the buffer holds and keep the remainder
+                while buffer.strip():
+                    try:
+                        request, end = decoder.raw_decode(buffer.lstrip())
+                    except ValueError:
+                        break
+                    buffer = buffer.lstrip()[end:]
+                    writer.write(await self.reply(request) + b"\n")
+                await writer.drain()
+        finally:
+            writer.close()
+
+    @staticmethod
+    def http_request(method, target, body):
+        """
+        Decodes a request from any of the pdns HTTP connector modes (plain
+        GET, post and post_json) into a remote backend request.
+        """
+
+        path = [unquote(part) for part in urlsplit(target).path.split("/") if part]
+        if not path:
+            return None
+
+        if method == "POST":
+            try:
+                if body.lstrip().startswith(b"{"):
+                    return json.loads(body.decode("utf-8"))
+                parameters = parse_qs(body.decode("utf-8")).get("parameters", ["{}"])
+                return {"method": path[-1], "parameters": json.loads(parameters[0])}
+            except ValueError:
+                return None
+
+        # in GET mode lookups are /lookup/<qname>/<qtype> under the configured url
+        if len(path) >= 3 and path[-3] == "lookup":
+            return {
+                "method": "lookup",
+                "parameters": {"qname": path[-2], "qtype": path[-1]},
+            }
+        return {"method": path[-1], "parameters": {}}
+
+    async def handle_http(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if not line.strip():
+                        break
+                    key, _, value = line.decode("latin-1").partition(":")
+                    headers[key.strip().lower()] = value.strip()
+
+                body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+                try:
+                    method, target, version = request_line.decode("latin-1").split()
+                except ValueError:
+                    status, payload = 400, b'{"result": false}'
+                else:
+                    request = self.http_request(method, target, body)
+                    if request is None:
+                        status, payload = 400, b'{"result": false}'
+                    else:
+                        status, payload = 200, await self.reply(request)
+
+                writer.write(
+                    (
+                        "HTTP/1.1 %d %s\r\n"
+                        "Content-Type: application/json\r\n"
+                        "Content-Length: %d\r\n"
+                        "\r\n" % (status, HTTP_REASONS[status], len(payload))
+                    ).encode("latin-1")
+                    + payload
+                )
+                await writer.drain()
+
+                if headers.get("connection", "").lower() == "close":
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def purge_periodically(self, interval, batch_size=500):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(interval)
+
+            # one batch per job, so that lookups queued meanwhile aren't held up
+            while True:
+                try:
+                    purged = await loop.run_in_executor(
+                        self.executor,
+                        functools.partial(
+                            retry_locked,
+                            purge.purge_expired_responses,
+                            batch_size=batch_size,
+                            max_batches=1,
+                        ),
+                    )
+                except DatabaseError as e:
+                    # lookups carry on, and the purge is tried again next time
+                    self.stderr.write("Could not purge responses: %s" % e)
+                    break
+                if purged < batch_size:
+                    break
+
+    async def start(self, socket_path=None, listen=None):
+        """
+        Starts listening on the requested addresses, returning the servers.
+        """
+
+        servers = []
+        if socket_path is not None:
+            if os.path.exists(socket_path):
+                os.unlink(socket_path)
+            servers.append(
+                await asyncio.start_unix_server(self.handle_socket, path=socket_path)
+            )
+        if listen is not None:
+            host, _, port = listen.rpartition(":")
+            servers.append(
+                await asyncio.start_server(
+                    self.handle_http, host=host or None, port=int(port)
+                )
+            )
+        return servers
+
+    def handle(self, *args, **options):
+        if options["socket"] is None and options["listen"] is None:
+            raise CommandError("At least one of --socket or --listen is required")
+        if options["purge_interval"] is not None and purge.retention() is None:
+            raise CommandError(
+                "--purge-interval requires ACMEPROXY_RESPONSE_RETENTION to be set"
+            )
+
+        self.setup_cache(options)
+        self.setup_metrics(options)
+        self.setup_tracer(options)
+        self.setup()
+
+        loop = asyncio.get_event_loop()
+        servers = loop.run_until_complete(
+            self.start(options["socket"], options["listen"])
+        )
+        if options["purge_interval"] is not None:
+            loop.create_task(self.purge_periodically(options["purge_interval"]))
+        try:
+            loop.run_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for server in servers:
+                server.close()
+                loop.run_until_complete(server.wait_closed())
+            self.teardown()
@@ -0,0 +1,311 @@
+"""
+Counters and latency histograms for the API and the pipe backend, in the
+Prometheus text format.
+
+The API's metrics are kept per process and served at /metrics when
+ACMEPROXY_METRICS is set. PowerDNS owns the pipe backend's stdin and stdout,
+so the pipeapi command writes its metrics to a file instead (see
+ACMEPROXY_PIPEAPI_METRICS_FILE), for a textfile collector to pick up.
+"""
+
+import bisect
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.http import Http404, HttpResponse
+
+from .authcache import authorisation_cache
+
+# upper bounds in seconds, from the 100us a cached DNS question takes to the
+# seconds an API request can spend waiting on a locked database
+LATENCY_BUCKETS = (
+    0.0001,
+    0.00025,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+def format_labels(names, values):
+    if not names:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"'
+        % (
+            name,
+            str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"),
+        )
+        for name, value in zip(names, values)
+    )
+
+
+class Metric:
+    """
+    A family of samples which share a name, and are told apart by the values
+    of their labels.
+    """
+
+    type = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.lock = threading.Lock()
+        self.values = {}
+
+    def render(self):
+        lines = [
+            "# HELP %s %s" % (self.name, self.help),
+            "# TYPE %s %s" % (self.name, self.type),
+        ]
+        with self.lock:
+            values = sorted(self.values.items())
+        for label_values, value in values:
+            lines.extend(self.samples(label_values, value))
+        return lines
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def value(self, *label_values):
+        with self.lock:
+            return self.values.get(label_values, 0)
+
+    def samples(self, label_values, value):
+        yield "%s_total%s %s" % (
+            self.name,
+            format_labels(self.labels, label_values),
+            format_value(value),
+        )
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *label_values):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                # a count for each bucket, then for +Inf, then the sum
+                counts = self.values[label_values] = [0] * (len(self.buckets) + 2)
+            counts[index] += 1
+            counts[-1] += value
+
+    def count(self, *label_values):
+        with self.lock:
+            counts = self.values.get(label_values)
+            return sum(counts[:-1]) if counts else 0
+
+    def samples(self, label_values, counts):
+        total = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            total += count
+            yield "%s_bucket%s %d" % (
+                self.name,
+                format_labels(
+                    self.labels + ("le",), label_values + (format_value(bound),)
+                ),
+                total,
+            )
+        labels = format_labels(self.labels, label_values)
+        yield "%s_count%s %d" % (self.name, labels, total)
+        yield "%s_sum%s %s" % (self.name, labels, format_value(counts[-1]))
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def counter(self, *args, **kwargs):
+        metric = Counter(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, *args, **kwargs):
+        metric = Histogram(*args, **kwargs)
+        self.metrics.append(metric)
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """
+        Replaces the file at path with the rendered metrics, so that readers
+        never see it half written.
+        """
+
+        directory = os.path.dirname(os.path.abspath(path))
+        handle, temporary = tempfile.mkstemp(dir=directory, prefix=".metrics-")
+        try:
+            with os.fdopen(handle, "w") as f:
+                f.write(self.render())
+            os.chmod(temporary, 0o644)
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+
+api = Registry()
+api_requests = api.counter(
+    "acmeproxy_api_requests",
+    "API requests served, by view and status code.",
+    labels=("view", "status"),
+)
+api_latency = api.histogram(
+    "acmeproxy_api_request_duration_seconds",
+    "Time taken to serve API requests, by view.",
+    labels=("view",),
+)
+
+
+def observe_request(view, status, duration):
+    api_requests.inc(view, status)
+    api_latency.observe(duration, view)
+
+
+class MetricsMiddleware:
+    """
+    Counts and times every request, labelled with the name of the view which
+    served it. Put it first so that the other middleware are timed too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+        match = getattr(request, "resolver_match", None)
+        # unmatched paths share a label, so that they can't grow the metrics
+        observe_request(
+            match.view_name if match else "unmatched",
+            response.status_code,
+            time.perf_counter() - start,
+        )
+        return response
+
+
+def authorisation_cache_metrics():
+    registry = Registry()
+    stats = authorisation_cache.stats()
+    for key, help in (
+        ("hits", "Authorisation lookups answered from the cache."),
+        ("misses", "Authorisation lookups which had to query the database."),
+        ("invalidations", "Cached authorisations invalidated by changes."),
+    ):
+        registry.counter("acmeproxy_authorisation_cache_%s" % key, help).inc(
+            amount=stats[key]
+        )
+    return registry
+
+
+def metrics(request):
+    if not getattr(settings, "ACMEPROXY_METRICS", False):
+        raise Http404
+    return HttpResponse(
+        api.render() + authorisation_cache_metrics().render(),
+        content_type=CONTENT_TYPE,
+    )
+
+
+class PipeMetrics:
+    """
+    The metrics of one pipeapi process, written to path (in which {pid} is
+    replaced with the process ID) at most every interval seconds. PowerDNS
+    runs several of them, so every sample is labelled with its process ID.
+    """
+
+    def __init__(self, path, interval):
+        self.pid = str(os.getpid())
+        self.path = path.replace("{pid}", self.pid)
+        self.interval = interval
+        self.written_at = None
+
+        self.registry = Registry()
+        self.questions = self.registry.counter(
+            "acmeproxy_pipeapi_questions",
+            "Questions answered, by kind (Q, AXFR or PING) and type.",
+            labels=("pid", "kind", "qtype"),
+        )
+        self.lookups = self.registry.counter(
+            "acmeproxy_pipeapi_lookups",
+            "Q questions which were answered with records (hit) or without (miss).",
+            labels=("pid", "result"),
+        )
+        self.answers = self.registry.counter(
+            "acmeproxy_pipeapi_answers",
+            "Records sent, by the type of question they answered.",
+            labels=("pid", "qtype"),
+        )
+        self.latency = self.registry.histogram(
+            "acmeproxy_pipeapi_question_duration_seconds",
+            "Time taken to answer questions, by kind.",
+            labels=("pid", "kind"),
+        )
+
+    def observe(self, kind, qtype, answers, duration):
+        self.questions.inc(self.pid, kind, qtype)
+        self.answers.inc(self.pid, qtype, amount=answers)
+        if kind == "Q":
+            self.lookups.inc(self.pid, "hit" if answers else "miss")
+        self.latency.observe(duration, self.pid, kind)
+        self.maybe_write()
+
+    def maybe_write(self):
+        if (
+            self.written_at is None
+            or time.monotonic() - self.written_at >= self.interval
+        ):
+            self.write()
+
+    def write(self):
+        self.written_at = time.monotonic()
+        try:
+            self.registry.write(self.path)
+        except OSError as e:
+            # answering PowerDNS matters more than the metrics; stderr ends up
+            # in its log
+            sys.stderr.write("Could not write metrics to %s: %s\n" % (self.path, e))
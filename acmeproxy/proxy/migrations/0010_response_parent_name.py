@@ -0,0 +1,31 @@
+# Generated by Django 2.2.28 on 2026-10-18 09:12
+
+from django.db import migrations, models
+from django.db.models.functions import Lower, StrIndex, Substr
+
+
+def populate_parent_name(apps, schema_editor):
+    # Everything after the first dot, as name.lower().partition(".")[2] would give.
+    Response = apps.get_model("proxy", "Response")
+    Response.objects.filter(name__contains=".").update(
+        parent_name=Substr(Lower("name"), StrIndex("name", models.Value(".")) + 1)
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("proxy", "0009_auto_20200611_0403"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="response",
+            name="parent_name",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=255
+            ),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_parent_name, migrations.RunPython.noop),
+    ]
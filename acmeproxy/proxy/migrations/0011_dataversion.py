@@ -0,0 +1,34 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:02
+
+from django.db import migrations, models
+
+
+def create_version(apps, schema_editor):
+    DataVersion = apps.get_model("proxy", "DataVersion")
+    DataVersion.objects.get_or_create(pk=1)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("proxy", "0010_response_parent_name"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="DataVersion",
+            fields=[
+                (
+                    "id",
+                    models.AutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("version", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(create_version, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 2.2.28 on 2026-10-18 10:41
+
+from django.db import migrations, models
+from django.db.models.functions import Lower
+
+
+def populate_normalised_names(apps, schema_editor):
+    for model_name in ("Authorisation", "Response"):
+        model = apps.get_model("proxy", model_name)
+        model.objects.update(normalised_name=Lower("name"))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("proxy", "0011_dataversion"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="authorisation",
+            name="normalised_name",
+            field=models.CharField(
+                db_index=True, default="", editable=False, max_length=255
+            ),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name="response",
+            name="normalised_name",
+            field=models.CharField(default="", editable=False, max_length=255),
+            preserve_default=False,
+        ),
+        migrations.RunPython(populate_normalised_names, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="response",
+            index=models.Index(
+                fields=["normalised_name", "expired_at"],
+                name="proxy_response_name_expired",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="response",
+            index=models.Index(fields=["created_at"], name="proxy_response_created_at"),
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 2.2.28 on 2026-10-18 12:05
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("proxy", "0012_normalised_names"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="authorisation",
+            name="created_at",
+            field=models.DateTimeField(
+                default=django.utils.timezone.now, editable=False
+            ),
+        ),
+    ]
@@ -2,40 +2,153 @@ import binascii
 import os
 from datetime import timedelta
 
+from django.conf import settings
 from django.db import models
+from django.db.models import F, Q
 from django.utils import timezone
 
+from .authcache import authorisation_cache
+
+
+def response_lifetime():
+    """
+    Returns how long a response is served for unless it is expired sooner.
+    """
+
+    return getattr(settings, "ACMEPROXY_RESPONSE_LIFETIME", timedelta(minutes=5))
+
+
+class AuthorisationQuerySet(models.QuerySet):
+    def update(self, **kwargs):
+        """
+        Updates the authorisations, invalidating their cached lookups as the
+        signals which otherwise do so aren't sent.
+        """
+
+        if authorisation_cache.timeout() is None:
+            return super().update(**kwargs)
+        before = dict(self.values_list("pk", "normalised_name"))
+        count = super().update(**kwargs)
+        # the normalised name may have changed too
+        names = set(before.values()).union(
+            Authorisation.objects.filter(pk__in=before).values_list(
+                "normalised_name", flat=True
+            )
+        )
+        for name in names:
+            authorisation_cache.invalidate(name)
+        return count
+
 
 class Authorisation(models.Model):
     name = models.CharField(max_length=255)
+    # lowercased copy of the name, which lookups match exactly so they can use the index
+    normalised_name = models.CharField(max_length=255, db_index=True, editable=False)
     secret = models.CharField(max_length=128)
-    created_at = models.DateTimeField(auto_now_add=True, editable=False)
+    # a default rather than auto_now_add, so importauthorisations can keep the time
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
     created_by_ip = models.GenericIPAddressField(verbose_name="Created by IP address")
     account = models.CharField(max_length=255)
 
+    objects = AuthorisationQuerySet.as_manager()
+
     def __str__(self):
         return self.name
 
+    def save(self, *args, **kwargs):
+        self.normalise_name()
+        super().save(*args, **kwargs)
+
+    def normalise_name(self):
+        self.normalised_name = self.name.lower()
+
     def reset_secret(self):
         self.secret = binascii.hexlify(os.urandom(16)).decode(
             "cp437"
         )  # generate a random 128 bit secret
 
 
+class ResponseQuerySet(models.QuerySet):
+    def live(self):
+        now = timezone.now()
+        return self.filter(created_at__gt=now - response_lifetime()).filter(
+            Q(expired_at__gt=now) | Q(expired_at__isnull=True)
+        )
+
+
 class Response(models.Model):
     name = models.CharField(max_length=255)
+    # lowercased copy of the name, which lookups match exactly so they can use the index
+    normalised_name = models.CharField(max_length=255, editable=False)
+    # the name with its first label removed, where SOA, NS and CAA are also served
+    parent_name = models.CharField(max_length=255, db_index=True, editable=False)
     response = models.CharField(max_length=255)
     created_at = models.DateTimeField(auto_now_add=True, editable=False)
     created_by_ip = models.GenericIPAddressField(verbose_name="Created by IP address")
     expired_at = models.DateTimeField(null=True, blank=True)
 
+    objects = ResponseQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["normalised_name", "expired_at"],
+                name="proxy_response_name_expired",
+            ),
+            models.Index(fields=["created_at"], name="proxy_response_created_at"),
+        ]
+
     def __str__(self):
         return "_acme-challenge.%s IN TXT %s" % (self.name, self.response)
 
+    def save(self, *args, **kwargs):
+        self.normalise_name()
+        super().save(*args, **kwargs)
+
+    def normalise_name(self):
+        """
+        Fills in the names derived from name, save() does this but bulk_create() doesn't.
+        """
+
+        self.normalised_name = self.name.lower()
+        self.parent_name = self.normalised_name.partition(".")[2]
+
+    def deadline(self):
+        """
+        Returns the time at which this response stops being served.
+        """
+
+        deadline = self.created_at + response_lifetime()
+        if self.expired_at is not None and self.expired_at < deadline:
+            return self.expired_at
+        return deadline
+
     def live(self):
-        threshold = timezone.now() - timedelta(minutes=5)
-        return self.created_at > threshold and (
-            self.expired_at is None or self.expired_at > timezone.now()
-        )
+        return self.deadline() > timezone.now()
 
     live.boolean = True
+
+
+class DataVersion(models.Model):
+    """
+    A single row counting changes to the published responses, so that the DNS
+    backends can cheaply tell when the records they serve need to be reloaded.
+    """
+
+    version = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return str(self.version)
+
+    @classmethod
+    def bump(cls):
+        """
+        Increments the version, call this in the same transaction as the change.
+        """
+
+        if not cls.objects.filter(pk=1).update(version=F("version") + 1):
+            cls.objects.get_or_create(pk=1, defaults={"version": 1})
+
+    @classmethod
+    def current(cls):
+        return cls.objects.filter(pk=1).values_list("version", flat=True).first() or 0
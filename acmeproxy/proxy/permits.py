@@ -0,0 +1,174 @@
+"""
+Matching of names against the permit lists of the accounts configured in
+ACMEPROXY_AUTHORISATION_CREATION_SECRETS, or in the file named by
+ACMEPROXY_PERMITS_FILE, which running processes reload whenever it changes.
+"""
+
+import json
+import os
+import sys
+import threading
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+# markers stored alongside the labels in a trie node, which no label can equal
+EXACT = object()
+SUFFIX = object()
+
+
+class PermitTrie:
+    """
+    A permit list stored as a trie of labels, starting from the rightmost,
+    so that checking a name takes one step per label it has.
+
+    A permit of "example.com" matches only that name, and one of
+    ".example.com" matches only names below it (such as "www.example.com",
+    but neither "example.com" nor "badexample.com").
+    """
+
+    def __init__(self, permits):
+        self.root = {}
+        for permit in permits:
+            permit = permit.lower()
+            marker = SUFFIX if permit.startswith(".") else EXACT
+            node = self.root
+            for label in reversed(permit.lstrip(".").split(".")):
+                node = node.setdefault(label, {})
+            node[marker] = True
+
+    def permits(self, name):
+        labels = name.lower().split(".")
+        node = self.root
+        for depth, label in enumerate(reversed(labels), 1):
+            node = node.get(label)
+            if node is None:
+                return False
+            if SUFFIX in node and depth < len(labels):
+                return True
+        return EXACT in node
+
+
+def permits_file():
+    return getattr(settings, "ACMEPROXY_PERMITS_FILE", None)
+
+
+def modified_at(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def load_permits_file(path):
+    """
+    Returns the permit lists in path, a JSON object mapping account names to
+    lists of permits.
+    """
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            permits = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ImproperlyConfigured("Could not read permits from %s: %s" % (path, e))
+    if not isinstance(permits, dict) or not all(
+        isinstance(permit, list) and all(isinstance(name, str) for name in permit)
+        for permit in permits.values()
+    ):
+        raise ImproperlyConfigured(
+            "%s must map account names to lists of permitted names" % path
+        )
+    return permits
+
+
+class AccountPermits:
+    """
+    The permit lists of every account, compiled on first use and again
+    whenever the setting is replaced, the permits file changes or reload() is
+    called.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.secrets = None
+        self.path = None
+        self.modified_at = None
+        self.compiled = {}
+
+    def reload(self):
+        """
+        Compiles the permit lists, raising ImproperlyConfigured if the
+        permits file can't be used.
+        """
+
+        secrets = settings.ACMEPROXY_AUTHORISATION_CREATION_SECRETS
+        path = permits_file()
+        modified = None
+        overrides = {}
+        if path:
+            modified = modified_at(path)
+            overrides = load_permits_file(path)
+
+        compiled = {}
+        for secret, user in (secrets or {}).items():
+            # the file's list for an account replaces the one in its settings
+            permit = overrides.get(user.get("name"), user.get("permit"))
+            if permit is not None:
+                compiled[secret] = PermitTrie(permit)
+        with self.lock:
+            self.secrets = secrets
+            self.path = path
+            self.modified_at = modified
+            self.compiled = compiled
+
+    def stale(self):
+        if self.secrets is not settings.ACMEPROXY_AUTHORISATION_CREATION_SECRETS:
+            return True
+        path = permits_file()
+        return path != self.path or (
+            path is not None and modified_at(path) != self.modified_at
+        )
+
+    def permits(self, secret, name):
+        """
+        Returns True if the account with secret may create an authorisation
+        for name.
+        """
+
+        return self.permits_many(secret, [name])[0]
+
+    def permits_many(self, secret, names):
+        """
+        Like permits for each of names, finding the account's permit list once.
+        """
+
+        if self.stale():
+            try:
+                self.reload()
+            except ImproperlyConfigured as e:
+                # keep the lists compiled before until the file changes again,
+                # rather than trying on every request
+                sys.stderr.write("Could not reload permits: %s\n" % e)
+                with self.lock:
+                    self.secrets = settings.ACMEPROXY_AUTHORISATION_CREATION_SECRETS
+                    self.path = permits_file()
+                    self.modified_at = modified_at(self.path)
+
+        trie = self.compiled.get(secret)
+        if trie is None:
+            return [True] * len(names)
+        return [trie.permits(name) for name in names]
+
+
+account_permits = AccountPermits()
+
+
+@receiver(setting_changed)
+def reload_permits(setting, **kwargs):
+    if setting in (
+        "ACMEPROXY_AUTHORISATION_CREATION_SECRETS",
+        "ACMEPROXY_PERMITS_FILE",
+    ):
+        account_permits.reload()
@@ -0,0 +1,99 @@
+"""
+Removal of historical challenge responses once they are past retention.
+"""
+
+import json
+import time
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import DataVersion, Response, response_lifetime
+
+ARCHIVE_FIELDS = ("name", "response", "created_at", "created_by_ip", "expired_at")
+
+
+def retention():
+    """
+    Returns the configured retention period as a timedelta, or None if
+    responses should be kept forever.
+    """
+
+    return getattr(settings, "ACMEPROXY_RESPONSE_RETENTION", None)
+
+
+def purgeable_responses(cutoff):
+    """
+    Returns the responses which were created and (if they were explicitly
+    expired) expired before cutoff.
+    """
+
+    return Response.objects.filter(created_at__lt=cutoff).filter(
+        Q(expired_at__isnull=True) | Q(expired_at__lt=cutoff)
+    )
+
+
+def purge_responses(cutoff, batch_size=500, archive=None, pause=0, max_batches=None):
+    """
+    Deletes the responses from before cutoff, at most batch_size rows per
+    transaction so that publishing is never locked out for long, optionally
+    appending each one to the archive file object as JSON first.
+
+    Returns the number of responses deleted.
+    """
+
+    # responses created before the lifetime are no longer served, so deleting
+    # them needs no new data version unless the cutoff reaches past that
+    may_be_live = cutoff > timezone.now() - response_lifetime()
+    purged = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        batches += 1
+        with transaction.atomic():
+            batch = list(
+                purgeable_responses(cutoff)
+                .order_by("pk")
+                .values("pk", *ARCHIVE_FIELDS)[:batch_size]
+            )
+            if not batch:
+                break
+
+            if archive is not None:
+                archive.write(
+                    "".join(
+                        json.dumps(
+                            {field: row[field] for field in ARCHIVE_FIELDS},
+                            cls=DjangoJSONEncoder,
+                        )
+                        + "\n"
+                        for row in batch
+                    )
+                )
+
+            responses = Response.objects.filter(pk__in=[row["pk"] for row in batch])
+            if may_be_live and responses.live().exists():
+                DataVersion.bump()
+            responses.delete()
+
+        purged += len(batch)
+        if archive is not None:
+            archive.flush()
+        if len(batch) < batch_size:
+            break
+        if pause:
+            time.sleep(pause)
+
+    return purged
+
+
+def purge_expired_responses(**kwargs):
+    """
+    Purges the responses older than the configured retention, if there is one.
+    """
+
+    if retention() is None:
+        return 0
+    return purge_responses(timezone.now() - retention(), **kwargs)
@@ -0,0 +1,356 @@
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import DataVersion, Response, response_lifetime
+
+CHALLENGE_PREFIX = "_acme-challenge."
+
+
+def strip_labels(name, count):
+    return ".".join(name.split(".")[count:])
+
+
+def soa_content():
+    return "%s. %s. %s 0 0 0 0" % (
+        settings.ACMEPROXY_SOA_HOSTNAME,
+        settings.ACMEPROXY_SOA_CONTACT,
+        str(int(time.time())),
+    )
+
+
+def response_records(name, response):
+    """
+    Generates every record served on behalf of a single challenge response.
+    """
+
+    challenge_name = CHALLENGE_PREFIX + name
+    soa = soa_content()
+
+    # Serve the challenge TXT record for the requested zone
+    yield {"name": challenge_name, "type": "TXT", "ttl": 5, "content": response}
+
+    # In case just the _acme-challenge.foo name was delegated, ensure authority at that level
+    yield {"name": challenge_name, "type": "SOA", "ttl": 5, "content": soa}
+    yield {  # Serve NS for _acme-challenge.foo.example.com
+        "name": challenge_name,
+        "type": "NS",
+        "ttl": 5,
+        "content": settings.ACMEPROXY_SOA_HOSTNAME,
+    }
+    yield {  # Serve CAA for _acme-challenge.foo.example.com
+        "name": challenge_name,
+        "type": "CAA",
+        "ttl": 5,
+        "content": '0 issue "letsencrypt.org"',
+    }
+
+    # Also claim to be authoritative for foo.example.com and example.com to handle CAA for the various ways in which the challenge
+    # might have been delegated (e.g. at the foo.example.com or example.com levels)
+
+    for depth in (0, 1):
+        extra_zone_name = strip_labels(name, depth)
+
+        yield {"name": extra_zone_name, "type": "SOA", "ttl": 5, "content": soa}
+        yield {
+            "name": extra_zone_name,
+            "type": "NS",
+            "ttl": 5,
+            "content": settings.ACMEPROXY_SOA_HOSTNAME,
+        }
+        yield {
+            "name": extra_zone_name,
+            "type": "CAA",
+            "ttl": 5,
+            "content": '0 issue "letsencrypt.org"',
+        }
+
+
+def live_responses():
+    return Response.objects.live()
+
+
+def candidate_names(qname):
+    """
+    Returns the response names which could produce a record named qname.
+
+    Responses one label below qname also produce records there, these are
+    matched on Response.parent_name rather than being listed here.
+    """
+
+    qname = qname.lower()
+    names = {qname}
+    if qname.startswith(CHALLENGE_PREFIX):
+        names.add(qname[len(CHALLENGE_PREFIX) :])
+    return names
+
+
+def question_responses(qname):
+    """
+    Returns only the live responses which could answer a question for qname.
+    """
+
+    return live_responses().filter(
+        Q(normalised_name__in=candidate_names(qname)) | Q(parent_name=qname.lower())
+    )
+
+
+def in_zone(name, zone):
+    return name == zone or name.endswith("." + zone)
+
+
+def zone_responses(zone):
+    """
+    Returns only the live responses which could produce records in zone.
+    """
+
+    zone = zone.lower()
+    names = {zone}
+    if zone.startswith(CHALLENGE_PREFIX):
+        names.add(zone[len(CHALLENGE_PREFIX) :])
+    return live_responses().filter(
+        Q(normalised_name__in=names) | Q(normalised_name__endswith="." + zone)
+    )
+
+
+def record_key(record):
+    # a name only has one SOA record, whatever serial it was generated with
+    return None if record["type"] == "SOA" else record["content"]
+
+
+def index_record(index, record):
+    records = index.setdefault(record["name"], OrderedDict()).setdefault(
+        record["type"], OrderedDict()
+    )
+    records.setdefault(record_key(record), record)
+
+
+def unindex_record(index, name, record_type, key):
+    types = index[name]
+    records = types[record_type]
+    del records[key]
+    if not records:
+        del types[record_type]
+        if not types:
+            del index[name]
+
+
+def find_records(index, qname, qtype):
+    types = index.get(qname.lower())
+    if types is None:
+        return []
+
+    if qtype == "ANY":
+        return [record for records in types.values() for record in records.values()]
+
+    records = types.get(qtype)
+    if records is None:
+        return []
+    return list(records.values())
+
+
+def list_records(index, zone=None):
+    """
+    Returns every record in the index, or only those in zone if it is given.
+    """
+
+    if zone is not None:
+        zone = zone.lower()
+    return [
+        record
+        for name, types in index.items()
+        if zone is None or in_zone(name, zone)
+        for records in types.values()
+        for record in records.values()
+    ]
+
+
+class RecordCache:
+    """
+    Every live record indexed by lowercased name and then type, so that a
+    question can be answered with a dictionary lookup rather than a database
+    query.
+
+    The data version is polled at most once every ``interval`` seconds, and
+    the index is only rebuilt if it has moved since the last build. Between
+    builds, responses are dropped from the index as their deadlines pass
+    using a min-heap, and the records they contributed are removed once no
+    other live response shares them.
+    """
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.index = {}
+        self.references = {}
+        self.deadlines = []
+        self.version = None
+        self.checked_at = None
+
+    def invalidate(self):
+        self.version = None
+        self.checked_at = None
+
+    def add(self, name, response, deadline, sequence):
+        keys = []
+        for record in response_records(name, response):
+            key = (record["name"], record["type"], record_key(record))
+            if key not in self.references:
+                index_record(self.index, record)
+                self.references[key] = 0
+            self.references[key] += 1
+            keys.append(key)
+        heapq.heappush(self.deadlines, (deadline, sequence, keys))
+
+    def expire(self, now):
+        """
+        Drops the responses whose deadlines have passed, returning how many.
+        """
+
+        expired = 0
+        while self.deadlines and self.deadlines[0][0] <= now:
+            deadline, sequence, keys = heapq.heappop(self.deadlines)
+            for key in keys:
+                self.references[key] -= 1
+                if not self.references[key]:
+                    del self.references[key]
+                    unindex_record(self.index, *key)
+            expired += 1
+        return expired
+
+    def refresh(self):
+        """
+        Rebuilds the index if the data version has moved, returning True if it was rebuilt.
+        """
+
+        self.expire(timezone.now())
+
+        if (
+            self.checked_at is not None
+            and time.monotonic() - self.checked_at < self.interval
+        ):
+            return False
+
+        self.checked_at = time.monotonic()
+
+        version = DataVersion.current()
+        if version == self.version:
+            return False
+
+        self.build()
+        self.version = version
+        return True
+
+    def build(self):
+        self.index = {}
+        self.references = {}
+        self.deadlines = []
+
+        lifetime = response_lifetime()
+        sequence = itertools.count()
+        for name, response, created_at, expired_at in live_responses().values_list(
+            "normalised_name", "response", "created_at", "expired_at"
+        ):
+            deadline = created_at + lifetime
+            if expired_at is not None and expired_at < deadline:
+                deadline = expired_at
+            self.add(name, response, deadline, next(sequence))
+
+    def lookup(self, qname, qtype):
+        self.refresh()
+        return find_records(self.index, qname, qtype)
+
+    def list(self, zone=None):
+        self.refresh()
+        return list_records(self.index, zone)
+
+
+class MissCache:
+    """
+    Answers questions which can't have any records without a database query.
+
+    The names of the live responses, and their parents, are held in sets
+    which are rebuilt whenever the data version has moved, polled at most
+    once every ``interval`` seconds. A question for a name outside them
+    can't be answered. Questions for known names which were answered without
+    records are remembered too, in a least recently used cache of at most
+    ``size`` entries, which is cleared along with the sets. New responses
+    always move the data version, and responses expiring only take records
+    away, so neither can turn a remembered miss into an answer.
+    """
+
+    def __init__(self, interval, size=10000):
+        self.interval = interval
+        self.size = size
+        self.names = frozenset()
+        self.parents = frozenset()
+        self.misses = OrderedDict()
+        self.version = None
+        self.checked_at = None
+
+    def refresh(self):
+        """
+        Rebuilds the sets if the data version has moved, returning True if they were rebuilt.
+        """
+
+        if (
+            self.checked_at is not None
+            and time.monotonic() - self.checked_at < self.interval
+        ):
+            return False
+
+        self.checked_at = time.monotonic()
+
+        version = DataVersion.current()
+        if version == self.version:
+            return False
+
+        names = set()
+        parents = set()
+        for name, parent in live_responses().values_list(
+            "normalised_name", "parent_name"
+        ):
+            names.add(name)
+            parents.add(parent)
+        self.names = frozenset(names)
+        self.parents = frozenset(parents)
+        self.misses.clear()
+        self.version = version
+        return True
+
+    def known(self, qname):
+        """
+        Returns whether qname could have records, mirroring question_responses.
+        """
+
+        return (
+            not self.names.isdisjoint(candidate_names(qname))
+            or qname.lower() in self.parents
+        )
+
+    def is_miss(self, qname, qtype):
+        """
+        Returns True if the question is certain to have no records.
+        """
+
+        self.refresh()
+        if not self.known(qname):
+            return True
+        key = (qname.lower(), qtype)
+        if key in self.misses:
+            self.misses.move_to_end(key)
+            return True
+        return False
+
+    def add(self, qname, qtype):
+        """
+        Remembers that a question for a known name had no records.
+        """
+
+        self.misses[(qname.lower(), qtype)] = True
+        if len(self.misses) > self.size:
+            self.misses.popitem(last=False)
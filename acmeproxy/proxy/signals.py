@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from .authcache import authorisation_cache
+from .models import Authorisation
+
+
+@receiver(pre_save, sender=Authorisation)
+def invalidate_renamed_authorisation(sender, instance, **kwargs):
+    # the name may be changing (e.g. in the admin), so drop the old one too
+    if instance.pk is not None and authorisation_cache.timeout() is not None:
+        for name in Authorisation.objects.filter(pk=instance.pk).values_list(
+            "normalised_name", flat=True
+        ):
+            authorisation_cache.invalidate(name)
+
+
+@receiver(post_save, sender=Authorisation)
+@receiver(post_delete, sender=Authorisation)
+def invalidate_authorisation(sender, instance, **kwargs):
+    authorisation_cache.invalidate(instance.normalised_name)
@@ -0,0 +1,43 @@
+from contextlib import contextmanager
+
+import pytest
+from django.core.management import call_command
+from django.db import connections
+
+from acmeproxy.proxy.tests.util import in_thread
+
+
+@pytest.fixture
+def sqlite_file(tmp_path):
+    """
+    Points the connections made by new threads at a freshly migrated SQLite
+    file, as the in-memory test database can't use WAL.
+    """
+
+    database = connections.databases["default"]
+    if database["ENGINE"] != "django.db.backends.sqlite3":
+        pytest.skip("only SQLite needs the pragmas")
+
+    name = database["NAME"]
+    database["NAME"] = str(tmp_path / "stress.sqlite3")
+    try:
+        in_thread(call_command, "migrate", "--verbosity=0")
+        yield database["NAME"]
+    finally:
+        database["NAME"] = name
+
+
+@pytest.fixture
+def test_database(monkeypatch):
+    """
+    Has the benchmark commands run against the test database, which the
+    server threads share, rather than creating a temporary one.
+    """
+
+    @contextmanager
+    def temporary_database(prefix=None):
+        yield
+
+    monkeypatch.setattr(
+        "acmeproxy.proxy.benchmark.temporary_database", temporary_database
+    )
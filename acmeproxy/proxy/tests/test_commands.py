@@ -1,10 +1,31 @@
+import asyncio
+import csv
+import json
+import os
+import pstats
+import socket
+import struct
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
 from io import StringIO
 
 import pytest
 from django.core.management import call_command
 from django.core.management.base import CommandError
+from django.db import DatabaseError
+from django.utils import timezone
 
-from acmeproxy.proxy.models import Authorisation
+from acmeproxy.proxy import dns, instrumentation, metrics
+from acmeproxy.proxy.management.commands import (
+    dnsserver,
+    listresponses,
+    loadtest,
+    remotebackend,
+)
+from acmeproxy.proxy.models import Authorisation, DataVersion, Response
+from acmeproxy.proxy.records import MissCache, RecordCache
 from acmeproxy.proxy.tests.util import create_authorisation, create_response
 
 
@@ -28,6 +49,12 @@ class TestDeleteAuthorisation:
         call_command("deleteauthorisation", "eXAmple.cOm", stdout=out)
         assert Authorisation.objects.count() == 0
 
+    def test_legacy_mixed_case(self):
+        create_authorisation(name="eXAmple.cOm")
+        out = StringIO()
+        call_command("deleteauthorisation", "example.com", stdout=out)
+        assert Authorisation.objects.count() == 0
+
 
 @pytest.mark.django_db
 class TestListAuthorisations:
@@ -43,6 +70,123 @@ class TestListAuthorisations:
             call_command("listauthorisations", stdout=out)
 
 
+@pytest.mark.django_db
+class TestExportImportAuthorisations:
+    def export(self, *args):
+        out = StringIO()
+        call_command("exportauthorisations", *args, stdout=out)
+        return out.getvalue()
+
+    def import_lines(self, tmp_path, lines, *args):
+        path = tmp_path / "authorisations.jsonl"
+        path.write_text("".join(json.dumps(line) + "\n" for line in lines))
+        out = StringIO()
+        call_command("importauthorisations", str(path), *args, stdout=out)
+        return out.getvalue()
+
+    def entry(self, name, secret="imported_secret", **fields):
+        return dict(name=name, secret=secret, created_by_ip="192.0.2.1", **fields)
+
+    def test_export(self, tmp_path):
+        create_authorisation(name="example.com")
+        Authorisation.objects.create(
+            name="example.org", secret="s", created_by_ip="::1", account="other"
+        )
+        rows = [json.loads(line) for line in self.export().splitlines()]
+        assert [row["name"] for row in rows] == ["example.com", "example.org"]
+        assert rows[0]["secret"] == "test_secret"
+        assert set(rows[0]) == {
+            "name",
+            "account",
+            "secret",
+            "created_by_ip",
+            "created_at",
+        }
+        assert [
+            json.loads(line)["name"]
+            for line in self.export("--account=other").splitlines()
+        ] == ["example.org"]
+
+        path = tmp_path / "authorisations.jsonl"
+        assert "Exported 2 authorisations" in self.export("--output=%s" % path)
+        assert os.stat(str(path)).st_mode & 0o777 == 0o600
+
+    def test_round_trip(self, tmp_path):
+        for index in range(5):
+            create_authorisation(name="host%d.example.com" % index)
+        Authorisation.objects.update(created_at=timezone.now() - timedelta(days=400))
+        before = list(
+            Authorisation.objects.order_by("pk").values_list(
+                "name", "normalised_name", "secret", "created_by_ip", "created_at"
+            )
+        )
+        path = tmp_path / "authorisations.jsonl"
+        self.export("--output=%s" % path)
+        Authorisation.objects.all().delete()
+
+        out = StringIO()
+        call_command("importauthorisations", str(path), "--batch-size=2", stdout=out)
+        assert "Imported 5 authorisations, replaced 0, skipped 0" in out.getvalue()
+        after = list(
+            Authorisation.objects.order_by("pk").values_list(
+                "name", "normalised_name", "secret", "created_by_ip", "created_at"
+            )
+        )
+        assert after == before
+
+    def test_conflicts(self, tmp_path):
+        create_authorisation(name="example.com")
+        lines = [
+            self.entry("new.example.com", secret="first"),
+            self.entry("EXAMPLE.com", account="imported"),
+            self.entry("new.example.com", secret="second"),
+        ]
+
+        out = self.import_lines(tmp_path, lines)
+        assert "Imported 1 authorisations, replaced 0, skipped 2" in out
+        assert Authorisation.objects.get(name="new.example.com").secret == "first"
+        assert Authorisation.objects.get(name="example.com").secret == "test_secret"
+
+        out = self.import_lines(tmp_path, lines, "--on-conflict=replace")
+        assert "Imported 0 authorisations, replaced 3, skipped 0" in out
+        assert Authorisation.objects.count() == 2
+        assert Authorisation.objects.get(name="new.example.com").secret == "second"
+        replaced = Authorisation.objects.get(normalised_name="example.com")
+        assert (replaced.name, replaced.account) == ("EXAMPLE.com", "imported")
+
+        with pytest.raises(CommandError, match='Line 1: .*"new.example.com"'):
+            self.import_lines(tmp_path, lines, "--on-conflict=fail")
+
+    def test_invalid_lines(self, tmp_path):
+        path = tmp_path / "authorisations.jsonl"
+        for content, message in (
+            ("{\n", "Line 1 is not valid JSON"),
+            ("\n[]\n", "Line 2 is not a JSON object"),
+            ('{"name": "example.com"}\n', 'Line 1 has no "secret"'),
+            (
+                json.dumps(dict(self.entry("example.com"), created_by_ip="nope")),
+                'Line 1 has an invalid "created_by_ip"',
+            ),
+            (
+                json.dumps(dict(self.entry("example.com"), created_at="yesterday")),
+                'Line 1 has an invalid "created_at"',
+            ),
+        ):
+            path.write_text(content)
+            with pytest.raises(CommandError, match=message):
+                call_command("importauthorisations", str(path), stdout=StringIO())
+        assert Authorisation.objects.count() == 0
+
+    def test_stdin(self, monkeypatch):
+        monkeypatch.setattr(
+            "sys.stdin", StringIO(json.dumps(self.entry("example.com")) + "\n")
+        )
+        out = StringIO()
+        call_command("importauthorisations", "-", stdout=out)
+        assert "Imported 1 authorisations" in out.getvalue()
+        assert Authorisation.objects.get().created_by_ip == "192.0.2.1"
+
+
 @pytest.mark.django_db
 class TestListResponses:
     def test_successful_list(self):
@@ -57,6 +201,180 @@ class TestListResponses:
         with pytest.raises(CommandError):
             call_command("listresponses", stdout=out)
 
+    def list(self, *args):
+        out = StringIO()
+        call_command("listresponses", *args, stdout=out)
+        return out.getvalue()
+
+    def test_table(self, monkeypatch):
+        # the columns are fitted to the first chunk
+        monkeypatch.setattr(listresponses, "CHUNK_SIZE", 2)
+        for name in ("a.example.com", "b.example.com", "longer.c.example.com"):
+            create_response(name=name)
+        lines = self.list().splitlines()
+        assert lines[0].split() == [
+            "name",
+            "expired_at",
+            "created_by_ip",
+            "created_at",
+        ]
+        assert lines[1].startswith("-------------  ----------  -------------  ---")
+        assert [line.split()[0] for line in lines[2:]] == [
+            "a.example.com",
+            "b.example.com",
+            "longer.c.example.com",
+        ]
+
+    def test_csv(self):
+        create_response(name="example.com")
+        Response.objects.update(expired_at=timezone.now())
+        rows = list(csv.reader(StringIO(self.list("--format=csv"))))
+        assert rows[0] == ["name", "expired_at", "created_by_ip", "created_at"]
+        response = Response.objects.get()
+        assert rows[1:] == [
+            [
+                "example.com",
+                str(response.expired_at),
+                "127.0.0.1",
+                str(response.created_at),
+            ]
+        ]
+
+    def test_jsonl(self, monkeypatch):
+        monkeypatch.setattr(listresponses, "CHUNK_SIZE", 2)
+        for index in range(5):
+            create_response(name="host%d.example.com" % index)
+        rows = [json.loads(line) for line in self.list("--format=jsonl").splitlines()]
+        assert [row["name"] for row in rows] == [
+            "host%d.example.com" % index for index in range(5)
+        ]
+        assert rows[0]["expired_at"] is None
+        assert rows[0]["created_at"] == Response.objects.first().created_at.isoformat()
+
+    def test_filters(self):
+        create_authorisation(name="ops.example.com")
+        Authorisation.objects.update(account="ops")
+        create_authorisation(name="dev.example.com")
+        for name in ("ops.example.com", "dev.example.com", "old.example.com"):
+            create_response(name=name)
+        Response.objects.filter(name="old.example.com").update(
+            created_at=timezone.now() - timedelta(days=1)
+        )
+
+        def names(*args):
+            return [
+                row["name"]
+                for row in map(
+                    json.loads, self.list("--format=jsonl", *args).splitlines()
+                )
+            ]
+
+        assert names("--account=ops") == ["ops.example.com"]
+        assert names("--live-only") == ["ops.example.com", "dev.example.com"]
+        assert names("--limit=1") == ["ops.example.com"]
+        with pytest.raises(CommandError):
+            self.list("--account=nobody")
+        with pytest.raises(CommandError):
+            self.list("--limit=0")
+
+    def test_summary(self):
+        for name in ("a.example.com", "b.example.com", "a.example.com"):
+            create_response(name=name)
+        Response.objects.filter(pk=Response.objects.first().pk).update(
+            created_at=timezone.now() - timedelta(days=2)
+        )
+        assert self.list("--summary=name").splitlines() == [
+            "name           responses",
+            "-------------  ---------",
+            "a.example.com          2",
+            "b.example.com          1",
+        ]
+        days = list(csv.reader(StringIO(self.list("--summary=day", "--format=csv"))))
+        assert days[0] == ["day", "responses"]
+        assert [count for day, count in days[1:]] == ["1", "2"]
+
+
+@pytest.mark.django_db
+class TestPurgeResponses:
+    def create_old_responses(self):
+        now = timezone.now()
+        for days, expired_days in ((40, None), (40, 35), (40, 1), (1, None), (0, 0)):
+            create_response(name="%d-%s.example.com" % (days, expired_days))
+            Response.objects.filter(
+                name="%d-%s.example.com" % (days, expired_days)
+            ).update(
+                created_at=now - timedelta(days=days),
+                expired_at=None
+                if expired_days is None
+                else now - timedelta(days=expired_days),
+            )
+
+    def test_purge(self):
+        self.create_old_responses()
+        version = DataVersion.current()
+        out = StringIO()
+        call_command("purgeresponses", "--older-than=30", "--batch-size=1", stdout=out)
+        assert "Deleted 2 responses" in out.getvalue()
+        assert sorted(Response.objects.values_list("name", flat=True)) == [
+            "0-0.example.com",
+            "1-None.example.com",
+            "40-1.example.com",
+        ]
+        # none of them were still being served
+        assert DataVersion.current() == version
+
+    def test_purge_live(self, settings):
+        settings.ACMEPROXY_RESPONSE_LIFETIME = timedelta(days=2)
+        self.create_old_responses()
+        version = DataVersion.current()
+        call_command(
+            "purgeresponses", "--older-than=0.5", "--batch-size=1", stdout=StringIO()
+        )
+        assert sorted(Response.objects.values_list("name", flat=True)) == [
+            "0-0.example.com"
+        ]
+        # only the batch with the live response needs a new version
+        assert DataVersion.current() == version + 1
+
+    def test_retention_setting(self, settings):
+        settings.ACMEPROXY_RESPONSE_RETENTION = timedelta(days=30)
+        self.create_old_responses()
+        call_command("purgeresponses", stdout=StringIO())
+        assert Response.objects.count() == 3
+
+    def test_no_retention(self):
+        with pytest.raises(CommandError):
+            call_command("purgeresponses", stdout=StringIO())
+
+    def test_dry_run(self):
+        self.create_old_responses()
+        out = StringIO()
+        call_command("purgeresponses", "--older-than=30", "--dry-run", stdout=out)
+        assert "Would delete 2 responses" in out.getvalue()
+        assert Response.objects.count() == 5
+
+    def test_archive(self, tmp_path):
+        self.create_old_responses()
+        archive = tmp_path / "responses.jsonl"
+        call_command(
+            "purgeresponses",
+            "--older-than=30",
+            "--archive=%s" % archive,
+            stdout=StringIO(),
+        )
+        rows = [json.loads(line) for line in archive.read_text().splitlines()]
+        assert sorted(row["name"] for row in rows) == [
+            "40-35.example.com",
+            "40-None.example.com",
+        ]
+        assert set(rows[0]) == {
+            "name",
+            "response",
+            "created_at",
+            "created_by_ip",
+            "expired_at",
+        }
+
 
 @pytest.mark.django_db
 class TestPipeAPI:
@@ -106,7 +424,8 @@ class TestPipeAPI:
             ),
         ],
     )
-    def test_query(self, monkeypatch, test_input, output):
+    @pytest.mark.parametrize("cache_args", [[], ["--cache-interval=0"]])
+    def test_query(self, monkeypatch, test_input, output, cache_args):
         create_authorisation(name="example.com")
         create_response(name="example.com")
         out = StringIO()
@@ -116,5 +435,718 @@ class TestPipeAPI:
         )
         monkeypatch.setattr("time.time", lambda: 1592267735)
         with pytest.raises(SystemExit):
-            call_command("pipeapi", stdout=out)
+            call_command("pipeapi", *cache_args, stdout=out)
         assert out.getvalue() == output
+
+    @pytest.mark.parametrize("cache_args", [[], ["--cache-interval=0"]])
+    def test_parent_query(self, monkeypatch, cache_args):
+        create_response(name="secure.example.com")
+        create_response(name="other.example.com")
+        out = StringIO()
+        monkeypatch.setattr(
+            "sys.stdin",
+            StringIO("HELO\t1\nQ\texample.com\tIN\tCAA\t-1\t127.0.0.1\nDEBUGQUIT"),
+        )
+        with pytest.raises(SystemExit):
+            call_command("pipeapi", *cache_args, stdout=out)
+        assert (
+            out.getvalue()
+            == 'OK\tACME Proxy API\nDATA\texample.com\tIN\tCAA\t5\t1\t0 issue "letsencrypt.org"\nEND\n'
+        )
+
+    def run_pipeapi(self, monkeypatch, test_input, *args):
+        out = StringIO()
+        monkeypatch.setattr("sys.stdin", StringIO(test_input))
+        monkeypatch.setattr("time.time", lambda: 1592267735)
+        with pytest.raises(SystemExit):
+            call_command("pipeapi", *args, stdout=out)
+        return out.getvalue()
+
+    @pytest.mark.parametrize("version", ["0", "4", "one"])
+    def test_unsupported_version(self, monkeypatch, version):
+        assert self.run_pipeapi(monkeypatch, "HELO\t%s\nDEBUGQUIT" % version) == (
+            "FAIL\n"
+        )
+
+    def test_abi_2(self, monkeypatch):
+        create_response(name="example.com")
+        assert self.run_pipeapi(
+            monkeypatch,
+            "HELO\t2\nQ\t_acme-challenge.example.com\tIN\tTXT\t-1\t192.0.2.1\t192.0.2.53\n"
+            "Q\texample.com\tIN\tTXT\t-1\t192.0.2.1\nDEBUGQUIT",
+        ) == (
+            "OK\tACME Proxy API\n"
+            "DATA\t_acme-challenge.example.com\tIN\tTXT\t5\t1\ttest_response\nEND\n"
+        )
+
+    def test_abi_3(self, monkeypatch):
+        create_response(name="example.com")
+        assert self.run_pipeapi(
+            monkeypatch,
+            "HELO\t3\nQ\t_acme-challenge.example.com\tIN\tTXT\t-1\t192.0.2.1\t192.0.2.53\t192.0.2.0/24\n"
+            "PING\nDEBUGQUIT",
+        ) == (
+            "OK\tACME Proxy API\n"
+            "DATA\t0\t1\t_acme-challenge.example.com\tIN\tTXT\t5\t1\ttest_response\nEND\n"
+            "END\n"
+        )
+
+    @pytest.mark.parametrize("cache_args", [[], ["--cache-interval=0"]])
+    def test_axfr(self, monkeypatch, cache_args):
+        create_response(name="secure.example.com")
+        create_response(name="example.org")
+        output = self.run_pipeapi(
+            monkeypatch, "HELO\t3\nAXFR\t1\tsecure.example.com\nDEBUGQUIT", *cache_args
+        )
+        assert output.splitlines() == [
+            "OK\tACME Proxy API",
+            "DATA\t0\t1\t_acme-challenge.secure.example.com\tIN\tTXT\t5\t1\ttest_response",
+            "DATA\t0\t1\t_acme-challenge.secure.example.com\tIN\tSOA\t5\t1\tacme-proxy-ns1.example.com. hostmaster.example.com. 1592267735 0 0 0 0",
+            "DATA\t0\t1\t_acme-challenge.secure.example.com\tIN\tNS\t5\t1\tacme-proxy-ns1.example.com",
+            'DATA\t0\t1\t_acme-challenge.secure.example.com\tIN\tCAA\t5\t1\t0 issue "letsencrypt.org"',
+            "DATA\t0\t1\tsecure.example.com\tIN\tSOA\t5\t1\tacme-proxy-ns1.example.com. hostmaster.example.com. 1592267735 0 0 0 0",
+            "DATA\t0\t1\tsecure.example.com\tIN\tNS\t5\t1\tacme-proxy-ns1.example.com",
+            'DATA\t0\t1\tsecure.example.com\tIN\tCAA\t5\t1\t0 issue "letsencrypt.org"',
+            "END",
+        ]
+
+    @pytest.mark.parametrize("abi_version", [1, 3])
+    def test_axfr_everything(self, monkeypatch, abi_version):
+        create_response(name="secure.example.com")
+        create_response(name="example.org")
+        output = self.run_pipeapi(
+            monkeypatch, "HELO\t%d\nAXFR\t1\nDEBUGQUIT" % abi_version
+        )
+        assert len(output.splitlines()) == 1 + 10 + 10 + 1
+
+    def test_miss_cache(self, monkeypatch, django_assert_num_queries):
+        create_response(name="example.com")
+        DataVersion.bump()
+        # the handshake checks the data version and lists the names, and the
+        # first AAAA question is looked up before it is remembered
+        with django_assert_num_queries(4):
+            output = self.run_pipeapi(
+                monkeypatch,
+                "HELO\t1\nQ\t_acme-challenge.example.com\tIN\tTXT\t-1\t192.0.2.1\n"
+                "Q\twww.example.net\tIN\tA\t-1\t192.0.2.1\n"
+                "Q\texample.com\tIN\tAAAA\t-1\t192.0.2.1\n"
+                "Q\texample.com\tIN\tAAAA\t-1\t192.0.2.1\nDEBUGQUIT",
+                "--miss-cache-interval=60",
+            )
+        assert output == (
+            "OK\tACME Proxy API\n"
+            "DATA\t_acme-challenge.example.com\tIN\tTXT\t5\t1\ttest_response\nEND\n"
+            "END\nEND\nEND\n"
+        )
+
+    def test_metrics(self, monkeypatch, tmp_path):
+        create_response(name="example.com")
+        path = tmp_path / "pipeapi-{pid}.prom"
+        self.run_pipeapi(
+            monkeypatch,
+            "HELO\t1\nQ\t_acme-challenge.example.com\tIN\tTXT\t-1\t192.0.2.1\n"
+            "Q\tother.example.org\tIN\tTXT\t-1\t192.0.2.1\nAXFR\t1\nPING\nDEBUGQUIT",
+            "--metrics-file=%s" % path,
+        )
+        pid = os.getpid()
+        lines = (tmp_path / ("pipeapi-%d.prom" % pid)).read_text().splitlines()
+        for sample in (
+            'acmeproxy_pipeapi_questions_total{pid="%d",kind="Q",qtype="TXT"} 2',
+            'acmeproxy_pipeapi_questions_total{pid="%d",kind="AXFR",qtype="AXFR"} 1',
+            'acmeproxy_pipeapi_questions_total{pid="%d",kind="PING",qtype=""} 1',
+            'acmeproxy_pipeapi_lookups_total{pid="%d",result="hit"} 1',
+            'acmeproxy_pipeapi_lookups_total{pid="%d",result="miss"} 1',
+            'acmeproxy_pipeapi_answers_total{pid="%d",qtype="AXFR"} 10',
+            'acmeproxy_pipeapi_answers_total{pid="%d",qtype="TXT"} 1',
+            'acmeproxy_pipeapi_question_duration_seconds_count{pid="%d",kind="Q"} 2',
+        ):
+            assert sample % pid in lines
+
+    @pytest.mark.parametrize("cache_args", [[], ["--cache-interval=0"]])
+    def test_slow_log(self, monkeypatch, capsys, cache_args):
+        create_response(name="example.com")
+        output = self.run_pipeapi(
+            monkeypatch,
+            "HELO\t1\nQ\t_acme-challenge.example.com\tIN\tTXT\t-1\t192.0.2.1\n"
+            "DEBUGQUIT",
+            "--slow-threshold=0",
+            *cache_args
+        )
+        assert output.endswith("\ttest_response\nEND\n")
+        logged = capsys.readouterr().err.splitlines()
+        assert len(logged) == 2
+        assert logged[0].startswith(
+            "Slow question 'Q\\t_acme-challenge.example.com\\tIN\\tTXT\\t-1\\t192.0.2.1' took "
+        )
+        stages = ["parse", "cache"] if cache_args else ["parse", "query", "records"]
+        for stage in stages + ["format", "write", "other"]:
+            assert " %s " % stage in logged[0]
+        # the cache checks the data version and builds its index
+        assert " with %d queries: " % (2 if cache_args else 1) in logged[0]
+        assert logged[1].startswith("Slow question 'DEBUGQUIT' took ")
+
+    def test_slow_threshold(self, monkeypatch, capsys):
+        self.run_pipeapi(monkeypatch, "HELO\t1\nPING\nDEBUGQUIT", "--slow-threshold=60")
+        assert capsys.readouterr().err == ""
+
+    def test_profile(self, monkeypatch, tmp_path):
+        create_response(name="example.com")
+        path = tmp_path / "pipeapi-{pid}.prof"
+        self.run_pipeapi(
+            monkeypatch,
+            "HELO\t1\nQ\t_acme-challenge.example.com\tIN\tTXT\t-1\t192.0.2.1\n"
+            "DEBUGQUIT",
+            "--profile-file=%s" % path,
+            "--profile-rate=1",
+        )
+        stats = pstats.Stats(str(tmp_path / ("pipeapi-%d.prof" % os.getpid())))
+        assert any(
+            function == "lookup" and filename.endswith("pipeapi.py")
+            for filename, line, function in stats.stats
+        )
+
+    def test_metrics_unwritable(self, monkeypatch, tmp_path, capsys):
+        output = self.run_pipeapi(
+            monkeypatch,
+            "HELO\t1\nPING\nDEBUGQUIT",
+            "--metrics-file=%s" % (tmp_path / "missing" / "pipeapi.prom"),
+        )
+        assert output == "OK\tACME Proxy API\nEND\n"
+        assert "Could not write metrics" in capsys.readouterr().err
+
+
+@pytest.mark.django_db
+@pytest.mark.usefixtures("test_database")
+class TestBenchmark:
+    def test_lookups(self):
+        out = StringIO()
+        call_command("benchmark", "lookups", "--rows=50", "--repeat=5", stdout=out)
+        assert "authorisation normalised_name" in out.getvalue()
+        assert "pipeapi question responses" in out.getvalue()
+
+    def test_api(self):
+        out = StringIO()
+        call_command("benchmark", "api", "--rows=20", "--repeat=5", stdout=out)
+        rows = [line.split() for line in out.getvalue().splitlines()[2:]]
+        assert len(rows) == 6
+        # the errors column, counted from the right as labels contain spaces
+        assert all(row[-6] == "0" for row in rows)
+
+    def test_pipeapi(self):
+        out = StringIO()
+        call_command("benchmark", "pipeapi", "--rows=50", "--repeat=5", stdout=out)
+        rows = {
+            " ".join(row[:-7]): row[-7:]
+            for row in (line.split() for line in out.getvalue().splitlines()[2:])
+        }
+        assert len(rows) == 18
+        # one query per question without the cache, none with it
+        assert rows["TXT uncached"][1] == "1"
+        assert rows["TXT cached"][1] == "0"
+        # and none for names the miss cache knows have no records
+        assert rows["TXT miss filtered"][1] == "0"
+        assert rows["TXT filtered"][1] == "1"
+        assert rows["CAA parent cached"][2] == "5"
+
+    def test_dns(self):
+        out = StringIO()
+        call_command(
+            "benchmark", "dns", "--rows=50", "--repeat=5", "--concurrency=2", stdout=out
+        )
+        rows = [line.split() for line in out.getvalue().splitlines()[2:]]
+        assert len(rows) == 5
+        # every query was answered, without errors
+        assert all(row[-6:-4] == ["0", "10"] for row in rows)
+
+    def test_temporary_database(self, tmp_path):
+        # in another process, as creating the database would replace the one
+        # these tests use
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "django",
+                "benchmark",
+                "lookups",
+                "--rows=50",
+                "--repeat=5",
+            ],
+            env=dict(os.environ, TMPDIR=str(tmp_path)),
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        assert os.listdir(str(tmp_path)) == []
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.usefixtures("test_database")
+class TestLoadTest:
+    def test_loadtest(self):
+        out = StringIO()
+        call_command(
+            "loadtest",
+            "--requests=30",
+            "--concurrency=2",
+            "--authorisations=5",
+            "--responses=10",
+            stdout=out,
+        )
+        rows = {
+            row[0]: row[1:]
+            for row in (line.split() for line in out.getvalue().splitlines()[2:])
+        }
+        assert set(rows) == set(loadtest.OPERATIONS) | {"total"}
+        # calls, and no errors other than the database being locked
+        assert rows["total"][3] == "30"
+        assert all(row[2] == "0" for row in rows.values())
+        created = int(rows["create_authorisation"][3]) - int(
+            rows["create_authorisation"][1]
+        )
+        assert Authorisation.objects.count() == 5 + created
+
+    def test_one_operation(self):
+        out = StringIO()
+        call_command(
+            "loadtest",
+            "--requests=10",
+            "--concurrency=2",
+            "--authorisations=2",
+            "--responses=0",
+            "--operation=publish_response",
+            "--fast",
+            stdout=out,
+        )
+        rows = [line.split() for line in out.getvalue().splitlines()[2:]]
+        assert [row[0] for row in rows] == ["publish_response", "total"]
+        assert Response.objects.count() == 10 - int(rows[1][2])
+
+    def test_unpicked_operations(self, monkeypatch):
+        # operations which no request happened to pick are left out
+        monkeypatch.setattr(loadtest.random, "choice", lambda choices: choices[0])
+        out = StringIO()
+        call_command(
+            "loadtest",
+            "--requests=3",
+            "--authorisations=1",
+            "--responses=0",
+            stdout=out,
+        )
+        rows = [line.split() for line in out.getvalue().splitlines()[2:]]
+        assert [row[0] for row in rows] == [loadtest.OPERATIONS[0], "total"]
+
+    def test_invalid(self):
+        with pytest.raises(CommandError):
+            call_command("loadtest", "--concurrency=0")
+
+    def test_temporary_database(self, tmp_path):
+        # in another process, as creating the database would replace the one
+        # these tests use
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "django",
+                "loadtest",
+                "--requests=10",
+                "--authorisations=2",
+                "--responses=0",
+            ],
+            env=dict(os.environ, TMPDIR=str(tmp_path)),
+            stdout=subprocess.DEVNULL,
+            check=True,
+        )
+        # nothing is left behind, including the WAL and shared memory files
+        assert os.listdir(str(tmp_path)) == []
+
+
+@pytest.mark.django_db
+class TestRemoteBackend:
+    def test_initialize(self):
+        command = remotebackend.Command()
+        assert command.dispatch(
+            {"method": "initialize", "parameters": {"command": "", "timeout": 2000}}
+        ) == {"result": True}
+
+    def test_lookup(self):
+        create_response(name="example.com")
+        command = remotebackend.Command()
+        reply = command.dispatch(
+            {
+                "method": "lookup",
+                "parameters": {"qname": "_acme-challenge.example.com.", "qtype": "TXT"},
+            }
+        )
+        assert reply == {
+            "result": [
+                {
+                    "qtype": "TXT",
+                    "qname": "_acme-challenge.example.com.",
+                    "content": "test_response",
+                    "ttl": 5,
+                    "auth": True,
+                }
+            ]
+        }
+
+    def test_list(self):
+        create_response(name="example.com")
+        command = remotebackend.Command()
+        reply = command.dispatch(
+            {
+                "method": "list",
+                "parameters": {
+                    "zonename": "_acme-challenge.example.com.",
+                    "domain_id": -1,
+                },
+            }
+        )
+        assert [record["qtype"] for record in reply["result"]] == [
+            "TXT",
+            "SOA",
+            "NS",
+            "CAA",
+        ]
+        assert {record["qname"] for record in reply["result"]} == {
+            "_acme-challenge.example.com."
+        }
+
+    def test_lookup_miss(self):
+        command = remotebackend.Command()
+        reply = command.dispatch(
+            {"method": "lookup", "parameters": {"qname": "example.com.", "qtype": "A"}}
+        )
+        assert reply == {"result": []}
+
+    @pytest.mark.parametrize(
+        "request_",
+        [
+            {"method": "getDomainKeys", "parameters": {"name": "example.com."}},
+            {"method": "lookup", "parameters": {}},
+            {"parameters": {}},
+            [],
+        ],
+    )
+    def test_unsupported(self, request_):
+        command = remotebackend.Command()
+        assert command.dispatch(request_) == {"result": False}
+
+    def test_database_error(self, monkeypatch, capsys):
+        command = remotebackend.Command()
+
+        def lookup(name, qtype):
+            raise DatabaseError("disk I/O error")
+
+        monkeypatch.setattr(command, "lookup", lookup)
+        reply = command.dispatch(
+            {"method": "lookup", "parameters": {"qname": "example.com.", "qtype": "A"}}
+        )
+        assert reply == {"result": False}
+        assert "disk I/O error" in capsys.readouterr().err
+
+    def test_handler_error(self, monkeypatch, capsys):
+        command = remotebackend.Command()
+
+        def lookup(name, qtype):
+            raise ValueError("a bug")
+
+        monkeypatch.setattr(command, "lookup", lookup)
+        reply = command.dispatch(
+            {"method": "lookup", "parameters": {"qname": "example.com.", "qtype": "A"}}
+        )
+        assert reply == {"result": False}
+        assert "ValueError: a bug" in capsys.readouterr().err
+
+    def test_misses_and_metrics(self, monkeypatch, tmp_path):
+        create_response(name="example.com")
+        command = remotebackend.Command()
+        command.misses = MissCache(interval=60)
+        command.metrics = metrics.PipeMetrics(str(tmp_path / "remote.prom"), 0)
+        lookup = command.lookup
+        looked_up = []
+
+        def counted_lookup(name, qtype):
+            looked_up.append(name)
+            return lookup(name, qtype)
+
+        monkeypatch.setattr(command, "lookup", counted_lookup)
+        for qname in ("_acme-challenge.example.com.", "random.example.org."):
+            command.dispatch(
+                {"method": "lookup", "parameters": {"qname": qname, "qtype": "TXT"}}
+            )
+        # the name without responses was answered from the miss cache
+        assert looked_up == ["_acme-challenge.example.com"]
+        lines = (tmp_path / "remote.prom").read_text().splitlines()
+        assert (
+            'acmeproxy_pipeapi_lookups_total{pid="%d",result="miss"} 1' % (os.getpid())
+            in lines
+        )
+
+    def test_slow_log(self, capsys):
+        command = remotebackend.Command()
+        command.tracer = instrumentation.Instrumentation(
+            threshold=0, logger=instrumentation.slow_logger("stderr")
+        )
+        reply = command.dispatch_traced(
+            {"method": "lookup", "parameters": {"qname": "example.com.", "qtype": "A"}}
+        )
+        assert reply == {"result": []}
+        assert capsys.readouterr().err.startswith('Slow question \'{"method": ')
+
+    def test_purge_survives_errors(self, monkeypatch, capsys):
+        calls = []
+
+        def purge_expired_responses(**kwargs):
+            calls.append(kwargs)
+            if len(calls) == 1:
+                raise DatabaseError("disk I/O error")
+            return 0
+
+        monkeypatch.setattr(
+            remotebackend.purge, "purge_expired_responses", purge_expired_responses
+        )
+        command = remotebackend.Command()
+        command.setup()
+
+        async def purge_twice():
+            task = asyncio.ensure_future(command.purge_periodically(0.01))
+            while len(calls) < 2 and not task.done():
+                await asyncio.sleep(0.01)
+            task.cancel()
+            await asyncio.wait([task])
+            return task
+
+        loop = asyncio.new_event_loop()
+        try:
+            task = loop.run_until_complete(purge_twice())
+        finally:
+            loop.close()
+            command.teardown()
+
+        assert len(calls) == 2
+        assert task.cancelled()
+        assert "Could not purge responses: disk I/O error" in capsys.readouterr().err
+
+    @pytest.mark.parametrize(
+        "method, target, body, request_",
+        [
+            (
+                "GET",
+                "/dnsapi/lookup/example.com./SOA",
+                b"",
+                {
+                    "method": "lookup",
+                    "parameters": {"qname": "example.com.", "qtype": "SOA"},
+                },
+            ),
+            (
+                "POST",
+                "/dnsapi/lookup",
+                b"parameters=%7B%22qname%22%3A%22example.com.%22%2C%22qtype%22%3A%22SOA%22%7D",
+                {
+                    "method": "lookup",
+                    "parameters": {"qname": "example.com.", "qtype": "SOA"},
+                },
+            ),
+            (
+                "POST",
+                "/dnsapi",
+                b'{"method": "initialize", "parameters": {}}',
+                {"method": "initialize", "parameters": {}},
+            ),
+            ("GET", "/", b"", None),
+            ("POST", "/dnsapi", b"{garbage", None),
+        ],
+    )
+    def test_http_request(self, method, target, body, request_):
+        assert remotebackend.Command.http_request(method, target, body) == request_
+
+    def test_missing_listener(self):
+        with pytest.raises(CommandError):
+            call_command("remotebackend")
+
+    def test_purge_without_retention(self):
+        with pytest.raises(CommandError):
+            call_command("remotebackend", "--listen=127.0.0.1:0", "--purge-interval=60")
+
+
+@pytest.mark.django_db(transaction=True)
+def test_remote_backend_server(tmp_path):
+    create_response(name="example.com")
+    command = remotebackend.Command()
+    command.cache = RecordCache(interval=60)
+    command.setup()
+    socket_path = str(tmp_path / "pdns.sock")
+
+    async def exchange():
+        servers = await command.start(socket_path=socket_path, listen="127.0.0.1:0")
+        port = servers[1].sockets[0].getsockname()[1]
+
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+        # two requests in one write, as pdns may send them back to back
+        writer.write(
+            b'{"method": "initialize", "parameters": {}}'
+            b'{"method": "lookup", "parameters": {"qname": "example.com.", "qtype": "NS"}}'
+        )
+        socket_replies = [
+            json.loads(await reader.readline()),
+            json.loads(await reader.readline()),
+        ]
+        writer.close()
+
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(
+            b"GET /dnsapi/lookup/_acme-challenge.example.com./TXT HTTP/1.1\r\n"
+            b"Host: localhost\r\nConnection: close\r\n\r\n"
+        )
+        http_reply = await reader.read()
+        writer.close()
+
+        for server in servers:
+            server.close()
+            await server.wait_closed()
+        return socket_replies, http_reply
+
+    loop = asyncio.new_event_loop()
+    try:
+        socket_replies, http_reply = loop.run_until_complete(exchange())
+    finally:
+        loop.close()
+        command.teardown()
+
+    assert socket_replies[0] == {"result": True}
+    assert [record["content"] for record in socket_replies[1]["result"]] == [
+        "acme-proxy-ns1.example.com"
+    ]
+    assert http_reply.startswith(b"HTTP/1.1 200 OK\r\n")
+    headers, _, body = http_reply.partition(b"\r\n\r\n")
+    assert json.loads(body)["result"][0]["content"] == "test_response"
+
+
+@pytest.mark.django_db
+class TestDNSServer:
+    @pytest.fixture
+    def command(self):
+        command = dnsserver.Command()
+        command.cache = RecordCache(interval=0)
+        return command
+
+    def ask(self, command, qname, qtype, tcp=False, **kwargs):
+        data = command.respond(dns.build_query(qname, qtype, id=42, **kwargs), tcp=tcp)
+        return data, dns.parse_response(data)
+
+    def test_answer(self, command):
+        create_response(name="example.com")
+        data, response = self.ask(command, "_acme-challenge.example.com", 16)
+        assert response["id"] == 42
+        assert response["rcode"] == dns.NOERROR
+        assert [dns.decode_rdata(data, record) for record in response["answers"]] == [
+            "test_response"
+        ]
+
+    def test_follows_changes(self, command):
+        data, response = self.ask(command, "_acme-challenge.example.com", 16)
+        assert response["rcode"] == dns.REFUSED
+        create_response(name="example.com")
+        DataVersion.bump()
+        data, response = self.ask(command, "_acme-challenge.example.com", 16)
+        assert len(response["answers"]) == 1
+
+    def test_nxdomain(self, command):
+        create_response(name="www.example.com")
+        data, response = self.ask(command, "_acme-challenge.example.com", 16)
+        assert response["rcode"] == dns.NXDOMAIN
+        assert [dns.type_name(r.type) for r in response["authority"]] == ["SOA"]
+
+    def test_edns(self, command):
+        create_response(name="example.com")
+        data, response = self.ask(command, "example.com", 257, edns=4096)
+        [opt] = response["additional"]
+        assert dns.type_name(opt.type) == "OPT"
+        assert opt.rclass == command.max_udp_size
+
+    def test_truncation(self, command):
+        # too many for 512 bytes, but few enough for the default EDNS limit
+        for i in range(20):
+            Response.objects.create(
+                name="example.com", response="%040d" % i, created_by_ip="127.0.0.1"
+            )
+        data, response = self.ask(command, "_acme-challenge.example.com", 16)
+        assert response["flags"] & dns.FLAG_TC
+        data, response = self.ask(command, "_acme-challenge.example.com", 16, edns=4096)
+        assert len(response["answers"]) == 20
+        data, response = self.ask(command, "_acme-challenge.example.com", 16, tcp=True)
+        assert len(response["answers"]) == 20
+
+    @pytest.mark.parametrize(
+        "query, rcode",
+        [
+            (dns.build_query("example.com", dns.AXFR), dns.REFUSED),
+            # opcode 2 (STATUS)
+            (b"\x00\x01\x10\x00" + dns.build_query("example.com", 16)[4:], dns.NOTIMP),
+            # an OPT record with EDNS version 1
+            (
+                dns.build_query("example.com", 16, edns=1232)[:-6]
+                + b"\x00\x01\x00\x00\x00\x00",
+                dns.BADVERS & 0xF,
+            ),
+            (b"\x00\x01\x00\x00\x00\x00\x00\x00\x00\x00\x00\x00", dns.FORMERR),
+        ],
+    )
+    def test_errors(self, command, query, rcode):
+        create_response(name="example.com")
+        assert dns.parse_response(command.respond(query))["rcode"] == rcode
+
+    def test_ignores_garbage(self, command):
+        assert command.respond(b"\x00") is None
+
+    def test_serves_sockets(self, command):
+        create_response(name="example.com")
+
+        def exchange(port):
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp:
+                udp.settimeout(5)
+                udp.sendto(
+                    dns.build_query("_acme-challenge.example.com", 16, id=1),
+                    ("127.0.0.1", port),
+                )
+                udp_reply = udp.recv(65535)
+            with socket.create_connection(("127.0.0.1", port), timeout=5) as tcp:
+                tcp_replies = []
+                for id in (2, 3):
+                    query = dns.build_query("example.com", 257, id=id)
+                    tcp.sendall(struct.pack("!H", len(query)) + query)
+                for id in (2, 3):
+                    length = struct.unpack("!H", tcp.recv(2, socket.MSG_WAITALL))[0]
+                    tcp_replies.append(tcp.recv(length, socket.MSG_WAITALL))
+            return udp_reply, tcp_replies
+
+        loop = asyncio.new_event_loop()
+        try:
+            transport, server = loop.run_until_complete(command.start("127.0.0.1", 0))
+            port = transport.get_extra_info("sockname")[1]
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                udp_reply, tcp_replies = loop.run_until_complete(
+                    loop.run_in_executor(executor, exchange, port)
+                )
+            transport.close()
+            server.close()
+            loop.run_until_complete(server.wait_closed())
+        finally:
+            loop.close()
+
+        response = dns.parse_response(udp_reply)
+        assert response["id"] == 1
+        assert [dns.decode_rdata(udp_reply, r) for r in response["answers"]] == [
+            "test_response"
+        ]
+        assert [dns.parse_response(reply)["id"] for reply in tcp_replies] == [2, 3]
+        assert (
+            dns.decode_rdata(
+                tcp_replies[0], dns.parse_response(tcp_replies[0])["answers"][0]
+            )
+            == '0 issue "letsencrypt.org"'
+        )
+
+    def test_bad_listen(self):
+        with pytest.raises(CommandError):
+            call_command("dnsserver", "--listen=localhost")
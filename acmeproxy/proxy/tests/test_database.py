@@ -0,0 +1,156 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django.db import OperationalError, connection, transaction
+from django.test import Client
+
+from acmeproxy.proxy import records
+from acmeproxy.proxy.database import (
+    Locked,
+    database_operation,
+    deferred_retry,
+    retry_locked,
+)
+from acmeproxy.proxy.models import DataVersion, Response
+from acmeproxy.proxy.tests.util import create_authorisation, in_thread
+
+
+class Flaky:
+    def __init__(self, failures, message="database is locked"):
+        self.failures = failures
+        self.message = message
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise OperationalError(self.message)
+        return "done"
+
+
+@pytest.mark.django_db
+class TestRetryLocked:
+    @pytest.fixture(autouse=True)
+    def no_backoff(self, settings):
+        settings.ACMEPROXY_DATABASE_LOCK_BACKOFF = 0
+
+    def test_retries(self):
+        # the test transaction would stop any retries
+        flaky = Flaky(failures=3)
+        assert in_thread(retry_locked, flaky) == "done"
+        assert flaky.calls == 4
+
+    def test_gives_up(self, settings):
+        settings.ACMEPROXY_DATABASE_LOCK_RETRIES = 2
+        flaky = Flaky(failures=3)
+        with pytest.raises(OperationalError):
+            in_thread(retry_locked, flaky)
+        assert flaky.calls == 3
+
+    def test_other_errors(self):
+        flaky = Flaky(failures=1, message="no such table: proxy_response")
+        with pytest.raises(OperationalError):
+            in_thread(retry_locked, flaky)
+        assert flaky.calls == 1
+
+    def test_in_transaction(self):
+        flaky = Flaky(failures=1)
+        with pytest.raises(OperationalError):
+            with transaction.atomic():
+                retry_locked(flaky)
+        assert flaky.calls == 1
+
+    def test_deferred(self, settings):
+        settings.ACMEPROXY_DATABASE_LOCK_RETRIES = 2
+        flaky = Flaky(failures=3)
+
+        def attempt(attempts):
+            with deferred_retry(attempts):
+                return retry_locked(flaky)
+
+        with pytest.raises(Locked):
+            in_thread(attempt, 1)
+        # the last attempt fails as it would have without deferring
+        with pytest.raises(OperationalError):
+            in_thread(attempt, 2)
+        assert flaky.calls == 2
+
+    def test_database_operation(self):
+        operation = database_operation("Could not do it")(Flaky(failures=1))
+        assert operation() == ({"result": False, "error": "Could not do it"}, 500)
+
+
+@pytest.mark.django_db
+class TestSQLitePragmas:
+    def pragmas(self):
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA busy_timeout")
+            busy_timeout = cursor.fetchone()[0]
+            cursor.execute("PRAGMA synchronous")
+            synchronous = cursor.fetchone()[0]
+        return busy_timeout, synchronous
+
+    def test_defaults(self):
+        # synchronous = NORMAL is 1
+        assert in_thread(self.pragmas) == (5000, 1)
+
+    def test_setting(self, settings):
+        settings.ACMEPROXY_SQLITE_PRAGMAS = {"busy_timeout": 100}
+        assert in_thread(self.pragmas) == (100, 2)
+
+
+@pytest.mark.django_db(transaction=True)
+def test_concurrent_readers_and_writers(sqlite_file):
+    names = ["host%d.example.com" % i for i in range(8)]
+    rounds = 25
+    for name in names:
+        in_thread(create_authorisation, name)
+
+    statuses = []
+    read_errors = []
+    reads = []
+    writing = threading.Event()
+    writing.set()
+
+    def write(name):
+        client = Client()
+        fields = {"name": name, "response": "r", "secret": "test_secret"}
+        try:
+            for _ in range(rounds):
+                statuses.append(client.post("/publish_response", fields).status_code)
+                del fields["response"]
+                statuses.append(client.post("/expire_response", fields).status_code)
+                fields["response"] = "r"
+        finally:
+            connection.close()
+
+    def read():
+        try:
+            while writing.is_set():
+                DataVersion.current()
+                for name in names:
+                    list(records.question_responses(records.CHALLENGE_PREFIX + name))
+                reads.append(1)
+        except Exception as e:
+            read_errors.append(e)
+        finally:
+            connection.close()
+
+    readers = [threading.Thread(target=read) for _ in range(2)]
+    for reader in readers:
+        reader.start()
+    with ThreadPoolExecutor(max_workers=len(names)) as executor:
+        list(executor.map(write, names))
+    writing.clear()
+    for reader in readers:
+        reader.join()
+
+    assert statuses == [200] * len(names) * rounds * 2
+    assert read_errors == []
+    assert reads
+
+    def counts():
+        return Response.objects.count(), Response.objects.live().count()
+
+    assert in_thread(counts) == (len(names) * rounds, 0)
@@ -0,0 +1,157 @@
+import struct
+
+import pytest
+
+from acmeproxy.proxy import dns, records
+
+
+def index_of(*names):
+    index = {}
+    for name in names:
+        for record in records.response_records(name, "response-" + name):
+            records.index_record(index, record)
+    return index
+
+
+def encode(query, answer, limit=65535):
+    return dns.build_response(query, *answer, limit, 1232)
+
+
+class TestWireFormat:
+    def test_parse_query(self):
+        query = dns.parse_query(dns.build_query("Example.COM", 16, id=1234))
+        assert query.id == 1234
+        assert query.qname == "Example.COM"
+        assert query.qtype == 16
+        assert query.qclass == dns.CLASS_IN
+        assert query.edns is None
+
+    def test_parse_edns(self):
+        query = dns.parse_query(dns.build_query("example.com", 16, edns=4096, do=True))
+        assert (query.edns, query.edns_version, query.do) == (4096, 0, True)
+        # payload sizes below 512 are treated as 512
+        assert dns.parse_query(dns.build_query("example.com", 16, edns=100)).edns == 512
+
+    @pytest.mark.parametrize(
+        "data, id",
+        [
+            (b"\x00\x01", None),
+            # a response rather than a query
+            (struct.pack("!HHHHHH", 7, dns.FLAG_QR, 1, 0, 0, 0), None),
+            (struct.pack("!HHHHHH", 7, 0, 2, 0, 0, 0), 7),
+            # the question name runs past the end
+            (struct.pack("!HHHHHH", 7, 0, 1, 0, 0, 0) + b"\x05abc", 7),
+            # a compression pointer to itself
+            (struct.pack("!HHHHHH", 7, 0, 1, 0, 0, 0) + b"\xc0\x0c\x00\x10\x00\x01", 7),
+        ],
+    )
+    def test_malformed(self, data, id):
+        with pytest.raises(dns.FormatError) as e:
+            dns.parse_query(data)
+        assert e.value.id == id
+
+    def test_round_trip(self):
+        index = index_of("www.example.com")
+        query = dns.parse_query(dns.build_query("_ACME-challenge.www.example.com", 255))
+        data = encode(query, dns.resolve(index, query.qname, query.qtype))
+        response = dns.parse_response(data)
+        assert response["flags"] & dns.FLAG_AA
+        assert response["rcode"] == dns.NOERROR
+        # answered with the case the question was asked in
+        assert [
+            (record.name, dns.type_name(record.type), dns.decode_rdata(data, record))
+            for record in response["answers"]
+        ] == [
+            ("_ACME-challenge.www.example.com", record["type"], record["content"])
+            for record in records.find_records(
+                index, "_acme-challenge.www.example.com", "ANY"
+            )
+        ]
+
+    def test_compression(self):
+        index = index_of("www.example.com")
+        query = dns.parse_query(dns.build_query("www.example.com", 255))
+        data = encode(query, dns.resolve(index, query.qname, query.qtype))
+        # every owner name after the question is a two byte pointer
+        assert data.count(b"\x03www\x07example\x03com\x00") == 1
+
+    def test_long_txt(self):
+        index = {}
+        record = {"name": "example.com", "type": "TXT", "ttl": 5, "content": "x" * 600}
+        records.index_record(index, record)
+        records.index_record(index, dict(record, type="SOA", content="a. b. 1 0 0 0 0"))
+        query = dns.parse_query(dns.build_query("example.com", 16))
+        data = encode(query, dns.resolve(index, query.qname, query.qtype))
+        [answer] = dns.parse_response(data)["answers"]
+        assert dns.decode_rdata(data, answer) == "x" * 600
+
+
+class TestResolve:
+    index = index_of("www.example.com")
+
+    def test_answer(self):
+        rcode, authoritative, answers, authority = dns.resolve(
+            self.index, "_acme-challenge.www.example.com", 16
+        )
+        assert (rcode, authoritative, authority) == (dns.NOERROR, True, [])
+        assert [record["content"] for name, record in answers] == [
+            "response-www.example.com"
+        ]
+
+    def test_no_data(self):
+        rcode, authoritative, answers, authority = dns.resolve(
+            self.index, "example.com", 16
+        )
+        assert (rcode, answers) == (dns.NOERROR, [])
+        assert [(name, record["type"]) for name, record in authority] == [
+            ("example.com", "SOA")
+        ]
+
+    def test_nxdomain(self):
+        rcode, authoritative, answers, authority = dns.resolve(
+            self.index, "other.example.com", 16
+        )
+        assert (rcode, authoritative, answers) == (dns.NXDOMAIN, True, [])
+        assert [(name, record["type"]) for name, record in authority] == [
+            ("example.com", "SOA")
+        ]
+
+    def test_refused(self):
+        assert dns.resolve(self.index, "example.org", 16) == (
+            dns.REFUSED,
+            False,
+            [],
+            [],
+        )
+
+    def test_truncation(self):
+        index = {}
+        for i in range(40):
+            records.index_record(
+                index,
+                {
+                    "name": "example.com",
+                    "type": "TXT",
+                    "ttl": 5,
+                    "content": "%040d" % i,
+                },
+            )
+        records.index_record(
+            index,
+            {
+                "name": "example.com",
+                "type": "SOA",
+                "ttl": 5,
+                "content": "a. b. 1 0 0 0 0",
+            },
+        )
+        query = dns.parse_query(dns.build_query("example.com", 16))
+        answer = dns.resolve(index, query.qname, query.qtype)
+
+        udp = dns.parse_response(encode(query, answer, limit=dns.UDP_LIMIT))
+        assert udp["flags"] & dns.FLAG_TC
+        assert udp["answers"] == []
+
+        tcp = dns.parse_response(encode(query, answer))
+        assert not tcp["flags"] & dns.FLAG_TC
+        assert len(tcp["answers"]) == 40
@@ -0,0 +1,92 @@
+import pytest
+
+from acmeproxy.proxy import metrics
+from acmeproxy.proxy.tests.util import create_authorisation
+
+
+def test_counter():
+    registry = metrics.Registry()
+    counter = registry.counter("things", "Things seen.", labels=("kind",))
+    counter.inc("a")
+    counter.inc("a", amount=2)
+    counter.inc('b"\\')
+    assert counter.value("a") == 3
+    assert registry.render().splitlines() == [
+        "# HELP things Things seen.",
+        "# TYPE things counter",
+        'things_total{kind="a"} 3',
+        'things_total{kind="b\\"\\\\"} 1',
+    ]
+
+
+def test_histogram():
+    registry = metrics.Registry()
+    histogram = registry.histogram("latency", "How long.", buckets=(0.1, 1))
+    for value in (0.05, 0.1, 0.5, 2):
+        histogram.observe(value)
+    assert histogram.count() == 4
+    assert registry.render().splitlines() == [
+        "# HELP latency How long.",
+        "# TYPE latency histogram",
+        'latency_bucket{le="0.1"} 2',
+        'latency_bucket{le="1"} 3',
+        'latency_bucket{le="+Inf"} 4',
+        "latency_count 4",
+        "latency_sum 2.65",
+    ]
+
+
+def test_write(tmp_path):
+    registry = metrics.Registry()
+    registry.counter("things", "Things seen.").inc()
+    path = tmp_path / "metrics.prom"
+    registry.write(str(path))
+    assert path.read_text() == registry.render()
+    assert [p.name for p in tmp_path.iterdir()] == ["metrics.prom"]
+
+
+@pytest.mark.django_db
+class TestAPIMetrics:
+    @pytest.fixture(autouse=True)
+    def enabled(self, settings):
+        settings.ACMEPROXY_METRICS = True
+
+    def test_disabled(self, client, settings):
+        settings.ACMEPROXY_METRICS = False
+        assert client.get("/metrics").status_code == 404
+
+    def test_requests(self, client):
+        create_authorisation(name="example.com")
+        published = metrics.api_requests.value("publish_response", 200)
+        denied = metrics.api_requests.value("publish_response", 403)
+        timed = metrics.api_latency.count("publish_response")
+        unmatched = metrics.api_requests.value("unmatched", 404)
+
+        fields = {"name": "example.com", "response": "r", "secret": "test_secret"}
+        client.post("/publish_response", fields)
+        fields["secret"] = "wrong"
+        client.post("/publish_response", fields)
+        client.get("/nothing/here")
+
+        assert metrics.api_requests.value("publish_response", 200) == published + 1
+        assert metrics.api_requests.value("publish_response", 403) == denied + 1
+        assert metrics.api_latency.count("publish_response") == timed + 2
+        assert metrics.api_requests.value("unmatched", 404) == unmatched + 1
+
+    def test_endpoint(self, client):
+        client.post("/create_authorisation", {"name": "example.com"})
+        response = client.get("/metrics")
+        assert response.status_code == 200
+        assert response["Content-Type"] == metrics.CONTENT_TYPE
+        lines = response.content.decode("utf-8").splitlines()
+        assert "# TYPE acmeproxy_api_request_duration_seconds histogram" in lines
+        assert any(
+            line.startswith(
+                'acmeproxy_api_requests_total{view="create_authorisation",status="200"}'
+            )
+            for line in lines
+        )
+        assert any(
+            line.startswith("acmeproxy_authorisation_cache_hits_total ")
+            for line in lines
+        )
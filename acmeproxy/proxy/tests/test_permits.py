@@ -0,0 +1,105 @@
+import json
+import os
+
+import pytest
+from django.core.exceptions import ImproperlyConfigured
+
+from acmeproxy.proxy.permits import AccountPermits, PermitTrie
+
+
+class TestPermitTrie:
+    @pytest.mark.parametrize(
+        "permits, name, permitted",
+        [
+            (["example.com"], "example.com", True),
+            (["example.com"], "EXAMPLE.com", True),
+            (["EXAMPLE.com"], "example.com", True),
+            (["example.com"], "www.example.com", False),
+            (["example.com"], "com", False),
+            ([".example.com"], "www.example.com", True),
+            ([".example.com"], "a.b.example.com", True),
+            ([".example.com"], "example.com", False),
+            ([".example.com"], "badexample.com", False),
+            ([".example.com"], "www.badexample.com", False),
+            ([".example.com"], "example.com.evil.org", False),
+            (["example.com", ".example.com"], "example.com", True),
+            (["example.com", ".example.com"], "www.example.com", True),
+            ([".www.example.com", "example.org"], "example.com", False),
+            ([".www.example.com", "example.org"], "a.www.example.com", True),
+            ([], "example.com", False),
+        ],
+    )
+    def test_permits(self, permits, name, permitted):
+        assert PermitTrie(permits).permits(name) is permitted
+
+    def test_many_permits(self):
+        trie = PermitTrie(["host%d.example.com" % i for i in range(5000)])
+        assert trie.permits("host4999.example.com")
+        assert not trie.permits("host5000.example.com")
+
+
+class TestAccountPermits:
+    def test_unrestricted(self, settings):
+        settings.ACMEPROXY_AUTHORISATION_CREATION_SECRETS = {
+            "secret": {"name": "operations"}
+        }
+        assert AccountPermits().permits("secret", "example.com")
+
+    def test_setting_replaced(self, settings):
+        permits = AccountPermits()
+        settings.ACMEPROXY_AUTHORISATION_CREATION_SECRETS = {
+            "secret": {"name": "operations", "permit": ["example.com"]}
+        }
+        assert permits.permits("secret", "example.com")
+        settings.ACMEPROXY_AUTHORISATION_CREATION_SECRETS = {
+            "secret": {"name": "operations", "permit": ["example.org"]}
+        }
+        assert not permits.permits("secret", "example.com")
+
+    def test_reload(self, settings):
+        secrets = {"secret": {"name": "operations", "permit": ["example.com"]}}
+        settings.ACMEPROXY_AUTHORISATION_CREATION_SECRETS = secrets
+        permits = AccountPermits()
+        assert not permits.permits("secret", "example.org")
+        secrets["secret"]["permit"].append("example.org")
+        assert not permits.permits("secret", "example.org")
+        permits.reload()
+        assert permits.permits("secret", "example.org")
+
+    def test_permits_many(self, settings):
+        settings.ACMEPROXY_AUTHORISATION_CREATION_SECRETS = {
+            "secret": {"name": "operations", "permit": [".example.com"]},
+            "other": {"name": "developers"},
+        }
+        permits = AccountPermits()
+        names = ["www.example.com", "example.com", "WWW.EXAMPLE.COM"]
+        assert permits.permits_many("secret", names) == [True, False, True]
+        assert permits.permits_many("other", names) == [True, True, True]
+
+    def test_permits_file(self, settings, tmp_path, capsys):
+        path = tmp_path / "permits.json"
+        path.write_text(json.dumps({"operations": ["example.org"]}))
+        settings.ACMEPROXY_AUTHORISATION_CREATION_SECRETS = {
+            "secret": {"name": "operations", "permit": ["example.com"]},
+            "other": {"name": "developers", "permit": ["example.com"]},
+        }
+        settings.ACMEPROXY_PERMITS_FILE = str(path)
+        permits = AccountPermits()
+        assert permits.permits_many("secret", ["example.com", "example.org"]) == [
+            False,
+            True,
+        ]
+        assert permits.permits("other", "example.com")
+
+        # picked up by the running process, without calling reload()
+        path.write_text(json.dumps({"operations": ["example.net"]}))
+        os.utime(str(path), ns=(0, 10**9))
+        assert permits.permits("secret", "example.net")
+
+        # a broken file leaves the lists compiled before in place
+        path.write_text("{")
+        os.utime(str(path), ns=(0, 2 * 10**9))
+        assert permits.permits("secret", "example.net")
+        assert "Could not reload permits" in capsys.readouterr().err
+        with pytest.raises(ImproperlyConfigured):
+            AccountPermits().reload()
@@ -0,0 +1,281 @@
+from datetime import timedelta
+
+import pytest
+from django.utils import timezone
+
+from acmeproxy.proxy.models import DataVersion, Response
+from acmeproxy.proxy.records import (
+    MissCache,
+    RecordCache,
+    candidate_names,
+    question_responses,
+)
+from acmeproxy.proxy.tests.util import create_response
+
+
+def contents(records):
+    return [(record["type"], record["content"]) for record in records]
+
+
+@pytest.mark.django_db
+class TestRecordCache:
+    def test_lookup(self):
+        create_response(name="secure.example.com")
+        cache = RecordCache(interval=60)
+        assert contents(cache.lookup("_acme-challenge.secure.example.com", "TXT")) == [
+            ("TXT", "test_response")
+        ]
+        assert [
+            record["type"]
+            for record in cache.lookup("_acme-challenge.SECURE.example.com", "ANY")
+        ] == ["TXT", "SOA", "NS", "CAA"]
+        assert contents(cache.lookup("example.com", "CAA")) == [
+            ("CAA", '0 issue "letsencrypt.org"')
+        ]
+        assert cache.lookup("other.example.com", "ANY") == []
+        assert cache.lookup("example.com", "TXT") == []
+
+    def test_duplicate_parents(self):
+        create_response(name="a.example.com")
+        create_response(name="b.example.com")
+        cache = RecordCache(interval=60)
+        assert len(cache.lookup("example.com", "SOA")) == 1
+        assert len(cache.lookup("_acme-challenge.a.example.com", "TXT")) == 1
+
+    def test_refresh_on_publish(self):
+        cache = RecordCache(interval=0)
+        assert cache.lookup("_acme-challenge.example.com", "TXT") == []
+        create_response(name="example.com")
+        assert len(cache.lookup("_acme-challenge.example.com", "TXT")) == 0
+        DataVersion.bump()
+        assert len(cache.lookup("_acme-challenge.example.com", "TXT")) == 1
+
+    def test_refresh_on_expire(self):
+        create_response(name="example.com")
+        cache = RecordCache(interval=0)
+        assert len(cache.lookup("_acme-challenge.example.com", "TXT")) == 1
+        Response.objects.update(expired_at=timezone.now())
+        DataVersion.bump()
+        assert cache.lookup("_acme-challenge.example.com", "TXT") == []
+
+    def test_interval(self):
+        cache = RecordCache(interval=3600)
+        assert cache.refresh()
+        create_response(name="example.com")
+        DataVersion.bump()
+        assert not cache.refresh()
+        cache.invalidate()
+        assert cache.refresh()
+
+    def test_future_expiry(self, monkeypatch):
+        now = timezone.now()
+        create_response(name="example.com")
+        Response.objects.update(expired_at=now + timedelta(minutes=1))
+        cache = RecordCache(interval=3600)
+        assert len(cache.lookup("_acme-challenge.example.com", "TXT")) == 1
+        monkeypatch.setattr(
+            "django.utils.timezone.now", lambda: now + timedelta(minutes=2)
+        )
+        assert cache.lookup("_acme-challenge.example.com", "TXT") == []
+
+    def test_lifetime(self):
+        create_response(name="example.com")
+        Response.objects.update(created_at=timezone.now() - timedelta(minutes=6))
+        cache = RecordCache(interval=3600)
+        assert cache.lookup("_acme-challenge.example.com", "TXT") == []
+        assert list(question_responses("_acme-challenge.example.com")) == []
+
+    def test_deadlines(self, monkeypatch, django_assert_num_queries):
+        now = timezone.now()
+        create_response(name="a.example.com")
+        create_response(name="b.example.com")
+        Response.objects.filter(name="a.example.com").update(
+            created_at=now - timedelta(minutes=4)
+        )
+        cache = RecordCache(interval=3600)
+        assert len(cache.lookup("_acme-challenge.a.example.com", "TXT")) == 1
+
+        monkeypatch.setattr(
+            "django.utils.timezone.now", lambda: now + timedelta(minutes=2)
+        )
+        with django_assert_num_queries(0):
+            assert cache.lookup("_acme-challenge.a.example.com", "ANY") == []
+            assert cache.lookup("a.example.com", "ANY") == []
+            # still served on behalf of b.example.com
+            assert len(cache.lookup("example.com", "SOA")) == 1
+            assert len(cache.lookup("_acme-challenge.b.example.com", "TXT")) == 1
+
+        monkeypatch.setattr(
+            "django.utils.timezone.now", lambda: now + timedelta(minutes=6)
+        )
+        assert cache.lookup("example.com", "SOA") == []
+        assert cache.index == {}
+        assert cache.references == {}
+
+    def test_lifetime_setting(self, settings, monkeypatch):
+        settings.ACMEPROXY_RESPONSE_LIFETIME = timedelta(minutes=30)
+        now = timezone.now()
+        create_response(name="example.com")
+        cache = RecordCache(interval=3600)
+        monkeypatch.setattr(
+            "django.utils.timezone.now", lambda: now + timedelta(minutes=10)
+        )
+        assert len(cache.lookup("_acme-challenge.example.com", "TXT")) == 1
+        assert Response.objects.get().live()
+
+
+@pytest.mark.django_db
+class TestMissCache:
+    @pytest.mark.parametrize(
+        "qname, miss",
+        [
+            ("_acme-challenge.secure.example.com", False),
+            ("_acme-challenge.SECURE.example.com", False),
+            ("secure.example.com", False),
+            ("example.com", False),
+            ("com", True),
+            ("www.secure.example.com", True),
+            ("_acme-challenge.www.secure.example.com", True),
+            ("_acme-challenge.expired.example.com", True),
+            ("other.example.org", True),
+        ],
+    )
+    def test_known_names(self, qname, miss):
+        create_response(name="secure.example.com")
+        create_response(name="expired.example.com")
+        Response.objects.filter(name="expired.example.com").update(
+            expired_at=timezone.now()
+        )
+        assert MissCache(interval=60).is_miss(qname, "TXT") == miss
+
+    def test_no_queries(self, django_assert_num_queries):
+        create_response(name="example.com")
+        cache = MissCache(interval=3600)
+        cache.refresh()
+        with django_assert_num_queries(0):
+            assert cache.is_miss("www.example.com", "A")
+            assert not cache.is_miss("_acme-challenge.example.com", "TXT")
+
+    def test_remembers_misses(self):
+        create_response(name="example.com")
+        cache = MissCache(interval=60, size=2)
+        assert not cache.is_miss("example.com", "AAAA")
+        cache.add("example.com", "AAAA")
+        cache.add("example.com", "A")
+        assert cache.is_miss("EXAMPLE.com", "AAAA")
+        assert not cache.is_miss("example.com", "TXT")
+
+        # the least recently used miss is forgotten first
+        cache.add("example.com", "MX")
+        assert cache.is_miss("example.com", "AAAA")
+        assert not cache.is_miss("example.com", "A")
+
+    def test_refresh_on_publish(self):
+        cache = MissCache(interval=0)
+        assert cache.is_miss("_acme-challenge.example.com", "TXT")
+        create_response(name="example.com")
+        assert cache.is_miss("_acme-challenge.example.com", "TXT")
+        DataVersion.bump()
+        assert not cache.is_miss("_acme-challenge.example.com", "TXT")
+
+    def test_refresh_forgets_misses(self):
+        create_response(name="example.com")
+        cache = MissCache(interval=0)
+        cache.refresh()
+        cache.add("example.com", "TXT")
+        assert cache.is_miss("example.com", "TXT")
+        DataVersion.bump()
+        assert not cache.is_miss("example.com", "TXT")
+
+    def test_interval(self):
+        cache = MissCache(interval=3600)
+        assert cache.refresh()
+        create_response(name="example.com")
+        DataVersion.bump()
+        assert not cache.refresh()
+        assert cache.is_miss("example.com", "SOA")
+
+
+@pytest.mark.django_db
+class TestResponseLive:
+    def test_live(self):
+        create_response(name="example.com")
+        assert Response.objects.get().live()
+        assert Response.objects.live().count() == 1
+
+    def test_old(self):
+        create_response(name="example.com")
+        Response.objects.update(created_at=timezone.now() - timedelta(minutes=6))
+        assert not Response.objects.get().live()
+        assert Response.objects.live().count() == 0
+
+    def test_expired(self):
+        create_response(name="example.com")
+        Response.objects.update(expired_at=timezone.now())
+        assert not Response.objects.get().live()
+        assert Response.objects.live().count() == 0
+
+    def test_deadline(self):
+        create_response(name="example.com")
+        response = Response.objects.get()
+        assert response.deadline() == response.created_at + timedelta(minutes=5)
+        response.expired_at = response.created_at + timedelta(minutes=1)
+        assert response.deadline() == response.expired_at
+
+
+@pytest.mark.django_db
+class TestDataVersion:
+    def test_bump(self):
+        version = DataVersion.current()
+        DataVersion.bump()
+        assert DataVersion.current() == version + 1
+
+    def test_missing_row(self):
+        DataVersion.objects.all().delete()
+        assert DataVersion.current() == 0
+        DataVersion.bump()
+        assert DataVersion.current() == 1
+
+
+class TestCandidateNames:
+    @pytest.mark.parametrize(
+        "qname, names",
+        [
+            ("example.com", {"example.com"}),
+            ("EXAMPLE.com", {"example.com"}),
+            (
+                "_acme-challenge.example.com",
+                {"_acme-challenge.example.com", "example.com"},
+            ),
+        ],
+    )
+    def test_candidate_names(self, qname, names):
+        assert candidate_names(qname) == names
+
+
+@pytest.mark.django_db
+class TestQuestionResponses:
+    def names(self, qname):
+        return sorted(question_responses(qname).values_list("name", flat=True))
+
+    def test_challenge(self):
+        create_response(name="secure.example.com")
+        create_response(name="other.example.com")
+        assert self.names("_acme-challenge.secure.example.com") == [
+            "secure.example.com"
+        ]
+
+    def test_parents(self):
+        create_response(name="secure.example.com")
+        create_response(name="deeper.secure.example.com")
+        assert self.names("secure.example.com") == [
+            "deeper.secure.example.com",
+            "secure.example.com",
+        ]
+        assert self.names("example.com") == ["secure.example.com"]
+        assert self.names("com") == []
+
+    def test_expired(self):
+        create_response(name="example.com")
+        Response.objects.update(expired_at=timezone.now())
+        assert self.names("example.com") == []
@@ -1,6 +1,25 @@
+import asyncio
+import json
+import sqlite3
+from datetime import timedelta
+from io import StringIO
+from urllib.parse import urlencode
+
 import pytest
+from django.apps import apps
+from django.core.exceptions import ImproperlyConfigured
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management import call_command
+from django.db import transaction
+from django.test import RequestFactory
+from django.utils import timezone
 
-from acmeproxy.proxy.tests.util import create_authorisation, create_response
+from acmeproxy.proxy import benchmark, fastpath, metrics
+from acmeproxy.proxy.asgi import ASGIHandler
+from acmeproxy.proxy.authcache import authorisation_cache
+from acmeproxy.proxy.fastpath import FastAPIHandler
+from acmeproxy.proxy.models import Authorisation, DataVersion, Response
+from acmeproxy.proxy.tests.util import create_authorisation, create_response, in_thread
 
 
 @pytest.mark.django_db
@@ -169,6 +188,19 @@ class TestResponse:
         assert resp.json()["result"]["authorisation"] == "example.com"
         assert resp.json()["result"]["published"] is True
 
+    def test_publish_bumps_version(self, client):
+        create_authorisation(name="example.com")
+        version = DataVersion.current()
+        client.post(
+            "/publish_response",
+            data={
+                "name": "example.com",
+                "response": "random_secret",
+                "secret": "test_secret",
+            },
+        )
+        assert DataVersion.current() == version + 1
+
     def test_publish_response_mixed_case(self, client):
         create_authorisation(name="example.com")
         resp = client.post(
@@ -183,6 +215,19 @@ class TestResponse:
         assert resp.json()["result"]["authorisation"] == "example.com"
         assert resp.json()["result"]["published"] is True
 
+    def test_publish_legacy_mixed_case(self, client):
+        create_authorisation(name="ExAmple.com")
+        resp = client.post(
+            "/publish_response",
+            data={
+                "name": "example.COM",
+                "response": "random_secret",
+                "secret": "test_secret",
+            },
+        )
+        assert resp.status_code == 200
+        assert Response.objects.get().normalised_name == "example.com"
+
     def test_publish_wrong_secret(self, client):
         create_authorisation(name="example.com")
         resp = client.post(
@@ -230,6 +275,29 @@ class TestResponse:
         assert resp.status_code == 200
         assert resp.json()["result"]["authorisation"] == "example.com"
 
+    def test_expire_bumps_version(self, client):
+        create_authorisation(name="example.com")
+        create_response(name="example.com")
+        version = DataVersion.current()
+        client.post(
+            "/expire_response",
+            data={"name": "example.com", "secret": "test_secret"},
+        )
+        assert DataVersion.current() == version + 1
+
+    def test_expire_only_live(self, client):
+        create_authorisation(name="example.com")
+        create_response(name="example.com")
+        expired_at = timezone.now() - timedelta(days=1)
+        Response.objects.update(expired_at=expired_at)
+        resp = client.post(
+            "/expire_response",
+            data={"name": "example.com", "secret": "test_secret"},
+        )
+        assert resp.status_code == 200
+        assert resp.json()["result"]["expired"] is False
+        assert Response.objects.get().expired_at == expired_at
+
     def test_expire_response_mixed_case(self, client):
         create_authorisation(name="example.com")
         create_response(name="example.com")
@@ -261,12 +329,14 @@ class TestResponse:
     def test_expire_wrong_secret(self, client):
         create_authorisation(name="example.com")
         create_response(name="example.com")
+        version = DataVersion.current()
         resp = client.post(
             "/expire_response",
             data={"name": "example.com", "secret": "wrong_secret"},
         )
         assert resp.status_code == 403
         assert resp.json()["result"] is False
+        assert DataVersion.current() == version
 
     def test_publish_wrong_method(self, client):
         resp = client.get("/publish_response", data={"name": "example.com"})
@@ -275,3 +345,716 @@ class TestResponse:
     def test_expire_wrong_method(self, client):
         resp = client.get("/expire_response", data={"name": "example.com"})
         assert resp.status_code == 405
+
+
+@pytest.mark.django_db
+class TestBulkResponses:
+    def publish(self, client, responses):
+        return client.post(
+            "/publish_responses",
+            data={"responses": responses},
+            content_type="application/json",
+        )
+
+    def test_publish_responses(self, client):
+        create_authorisation(name="example.com")
+        create_authorisation(name="example.org")
+        version = DataVersion.current()
+        resp = self.publish(
+            client,
+            [
+                {"name": "example.com", "response": "one", "secret": "test_secret"},
+                {"name": "EXAMPLE.org", "response": "two", "secret": "test_secret"},
+                {"name": "example.org", "response": "three", "secret": "wrong"},
+                {"name": "example.net", "response": "four", "secret": "test_secret"},
+            ],
+        )
+        assert resp.status_code == 200
+        assert resp.json()["result"] == [
+            {"authorisation": "example.com", "published": True},
+            {"authorisation": "example.org", "published": True},
+            {
+                "name": "example.org",
+                "published": False,
+                "error": "Invalid authorisation token",
+            },
+            {
+                "name": "example.net",
+                "published": False,
+                "error": "Invalid authorisation token",
+            },
+        ]
+        assert sorted(
+            Response.objects.values_list("normalised_name", "parent_name", "response")
+        ) == [("example.com", "com", "one"), ("example.org", "org", "two")]
+        assert DataVersion.current() == version + 1
+
+    def test_publish_nothing_authorised(self, client):
+        version = DataVersion.current()
+        resp = self.publish(
+            client,
+            [{"name": "example.com", "response": "one", "secret": "test_secret"}],
+        )
+        assert resp.status_code == 200
+        assert resp.json()["result"][0]["published"] is False
+        assert Response.objects.count() == 0
+        assert DataVersion.current() == version
+
+    def test_publish_queries(self, client, django_assert_max_num_queries):
+        for index in range(20):
+            create_authorisation(name="host%d.example.com" % index)
+        with django_assert_max_num_queries(6):
+            self.publish(
+                client,
+                [
+                    {
+                        "name": "host%d.example.com" % index,
+                        "response": "response",
+                        "secret": "test_secret",
+                    }
+                    for index in range(20)
+                ],
+            )
+        assert Response.objects.count() == 20
+
+    @pytest.mark.parametrize(
+        "responses",
+        [
+            [],
+            [{"name": "example.com", "secret": "test_secret"}],
+            "example.com",
+        ],
+    )
+    def test_publish_invalid(self, client, responses):
+        create_authorisation(name="example.com")
+        resp = self.publish(client, responses)
+        assert resp.status_code == 400
+        assert Response.objects.count() == 0
+
+    def test_publish_too_many(self, client, monkeypatch):
+        monkeypatch.setattr("acmeproxy.proxy.views.BULK_LIMIT", 2)
+        create_authorisation(name="example.com")
+        resp = self.publish(
+            client,
+            [{"name": "example.com", "response": "one", "secret": "test_secret"}] * 3,
+        )
+        assert resp.status_code == 400
+
+    def test_publish_wrong_method(self, client):
+        resp = client.get("/publish_responses")
+        assert resp.status_code == 405
+
+    def expire(self, client, responses):
+        return client.post(
+            "/expire_responses",
+            data={"responses": responses},
+            content_type="application/json",
+        )
+
+    def test_expire_responses(self, client, django_assert_max_num_queries):
+        expired_at = timezone.now() - timedelta(days=1)
+        for name in ("example.com", "example.org", "example.net", "example.info"):
+            create_authorisation(name=name)
+        create_response(name="example.com")
+        create_response(name="example.com")
+        create_response(name="example.org")
+        create_response(name="example.info")
+        Response.objects.filter(name="example.info").update(expired_at=expired_at)
+        create_response(name="example.net")
+        version = DataVersion.current()
+
+        with django_assert_max_num_queries(6):
+            resp = self.expire(
+                client,
+                [
+                    {"name": "example.com", "secret": "test_secret"},
+                    {"name": "example.org", "secret": "wrong"},
+                    {"name": "EXAMPLE.info", "secret": "test_secret"},
+                    {"name": "example.test", "secret": "test_secret"},
+                ],
+            )
+
+        assert resp.status_code == 200
+        assert resp.json()["result"] == [
+            {"authorisation": "example.com", "expired": True},
+            {
+                "name": "example.org",
+                "expired": False,
+                "error": "Invalid authorisation token",
+            },
+            {"authorisation": "example.info", "expired": False},
+            {
+                "name": "example.test",
+                "expired": False,
+                "error": "Invalid authorisation token",
+            },
+        ]
+        assert sorted(
+            Response.objects.live().values_list("normalised_name", flat=True)
+        ) == ["example.net", "example.org"]
+        # already expired responses keep their original expiry time
+        assert Response.objects.get(name="example.info").expired_at == expired_at
+        assert DataVersion.current() == version + 1
+
+    def test_expire_nothing_live(self, client):
+        create_authorisation(name="example.com")
+        version = DataVersion.current()
+        resp = self.expire(client, [{"name": "example.com", "secret": "test_secret"}])
+        assert resp.json()["result"] == [
+            {"authorisation": "example.com", "expired": False}
+        ]
+        assert DataVersion.current() == version
+
+    def test_expire_invalid(self, client):
+        resp = self.expire(client, [{"name": "example.com"}])
+        assert resp.status_code == 400
+
+
+@pytest.mark.django_db
+class TestBulkAuthorisations:
+    token = "18084e750a1cff6f2d627e7a568ab81a"
+
+    def create(self, client, names, **data):
+        return client.post(
+            "/create_authorisations",
+            data=dict(data, names=names),
+            content_type="application/json",
+        )
+
+    def test_create_authorisations(self, client, django_assert_max_num_queries):
+        with django_assert_max_num_queries(3):
+            resp = self.create(client, ["example.com", "WWW.example.com"])
+        assert resp.status_code == 200
+        result = resp.json()["result"]
+        assert [entry["authorisation"] for entry in result] == [
+            "example.com",
+            "www.example.com",
+        ]
+        for entry in result:
+            authorisation = Authorisation.objects.get(name=entry["authorisation"])
+            assert authorisation.secret == entry["secret"]
+            assert authorisation.normalised_name == entry["authorisation"]
+        assert result[0]["secret"] != result[1]["secret"]
+
+        # the secrets work like those from create_authorisation
+        resp = client.post(
+            "/publish_response",
+            {"name": "example.com", "response": "r", "secret": result[0]["secret"]},
+        )
+        assert resp.status_code == 200
+
+    def test_permits(self, client, settings):
+        settings.ACMEPROXY_AUTHORISATION_CREATION_SECRETS = {
+            self.token: {"name": "developers", "permit": [".example.com"]}
+        }
+        resp = self.create(
+            client, ["a.example.com", "example.com", "b.example.com"], secret=self.token
+        )
+        assert resp.status_code == 200
+        result = resp.json()["result"]
+        assert [entry.get("authorisation") for entry in result] == [
+            "a.example.com",
+            None,
+            "b.example.com",
+        ]
+        assert result[1] == {
+            "name": "example.com",
+            "error": "Changes to this domain are not permitted with this account token",
+        }
+        assert sorted(Authorisation.objects.values_list("name", "account")) == [
+            ("a.example.com", "developers"),
+            ("b.example.com", "developers"),
+        ]
+
+    @pytest.mark.parametrize("secret", ["wrong", None])
+    def test_invalid_account_token(self, client, settings, secret):
+        settings.ACMEPROXY_AUTHORISATION_CREATION_SECRETS = {
+            self.token: {"name": "developers"}
+        }
+        data = {} if secret is None else {"secret": secret}
+        resp = self.create(client, ["example.com"], **data)
+        assert resp.status_code == 403
+        assert resp.json() == {"result": False, "error": "Invalid account token"}
+        assert Authorisation.objects.count() == 0
+
+    @pytest.mark.parametrize(
+        "names", [[], "example.com", ["example.com", "EXAMPLE.com"], ["x" * 256]]
+    )
+    def test_invalid(self, client, names):
+        resp = self.create(client, names)
+        assert resp.status_code == 400
+        assert Authorisation.objects.count() == 0
+
+    def test_too_many(self, client, monkeypatch):
+        monkeypatch.setattr("acmeproxy.proxy.views.BULK_LIMIT", 2)
+        resp = self.create(client, ["a.example.com", "b.example.com", "c.example.com"])
+        assert resp.status_code == 400
+
+
+# the cache is invalidated once changes are committed
+@pytest.mark.django_db(transaction=True)
+class TestAuthorisationCache:
+    @pytest.fixture(autouse=True)
+    def enable_cache(self, settings, tmp_path):
+        settings.CACHES = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "authorisations": {
+                "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+                "LOCATION": str(tmp_path),
+            },
+        }
+        settings.ACMEPROXY_AUTHORISATION_CACHE = "authorisations"
+        # a fresh directory for each test, so there is nothing to clear
+        settings.ACMEPROXY_AUTHORISATION_CACHE_TIMEOUT = 60
+
+    def publish(self, client, secret="test_secret", name="example.com"):
+        return client.post(
+            "/publish_response",
+            data={"name": name, "response": "response", "secret": secret},
+        )
+
+    def test_cached(self, client, django_assert_num_queries):
+        create_authorisation(name="example.com")
+        stats = authorisation_cache.stats()
+        assert self.publish(client).status_code == 200
+        # only the insert and the version bump, in one transaction
+        with django_assert_num_queries(3) as queries:
+            assert self.publish(client).status_code == 200
+        assert all("proxy_authorisation" not in query["sql"] for query in queries)
+        assert self.publish(client, secret="wrong").status_code == 403
+        after = authorisation_cache.stats()
+        assert after["hits"] == stats["hits"] + 2
+        assert after["misses"] == stats["misses"] + 1
+
+    def test_expire_authorisation(self, client):
+        create_authorisation(name="example.com")
+        assert self.publish(client).status_code == 200
+        resp = client.post(
+            "/expire_authorisation",
+            data={"name": "example.com", "secret": "test_secret"},
+        )
+        secret = resp.json()["result"]["secret"]
+        assert Authorisation.objects.get().secret == secret
+        assert self.publish(client).status_code == 403
+        assert self.publish(client, secret=secret).status_code == 200
+
+    def test_fill_races_expiry(self, client, monkeypatch):
+        create_authorisation(name="example.com")
+        set_many = authorisation_cache.set_many
+        expired = []
+
+        def expire_then_set_many(entries, tokens):
+            # the secret is replaced after this request read the row, but
+            # before it fills the cache
+            if not expired:
+                authorisation = Authorisation.objects.get()
+                authorisation.reset_secret()
+                authorisation.save()
+                expired.append(authorisation.secret)
+            set_many(entries, tokens)
+
+        monkeypatch.setattr(authorisation_cache, "set_many", expire_then_set_many)
+        assert self.publish(client).status_code == 200
+        assert self.publish(client).status_code == 403
+        assert self.publish(client, secret=expired[0]).status_code == 200
+
+    def test_delete_authorisation(self, client):
+        create_authorisation(name="example.com")
+        assert self.publish(client).status_code == 200
+        call_command("deleteauthorisation", "example.com", stdout=StringIO())
+        assert self.publish(client).status_code == 403
+
+    def test_import_replaced_authorisation(self, client, tmp_path):
+        create_authorisation(name="example.com")
+        assert self.publish(client).status_code == 200
+        path = tmp_path / "authorisations.jsonl"
+        path.write_text(
+            json.dumps(
+                {"name": "example.com", "secret": "other", "created_by_ip": "::1"}
+            )
+        )
+        call_command(
+            "importauthorisations",
+            str(path),
+            "--on-conflict=replace",
+            stdout=StringIO(),
+        )
+        assert self.publish(client).status_code == 403
+        assert self.publish(client, secret="other").status_code == 200
+
+    def test_rename_authorisation(self, client):
+        create_authorisation(name="example.com")
+        assert self.publish(client).status_code == 200
+        authorisation = Authorisation.objects.get()
+        authorisation.name = "example.org"
+        authorisation.save()
+        assert self.publish(client).status_code == 403
+
+    def test_unsignalled_changes(self, client):
+        # neither QuerySet.update() nor delete() use the instances' signals
+        create_authorisation(name="example.com")
+        assert self.publish(client).status_code == 200
+        Authorisation.objects.filter(name="example.com").update(secret="other")
+        assert self.publish(client).status_code == 403
+        assert self.publish(client, secret="other").status_code == 200
+        Authorisation.objects.update(name="example.org", normalised_name="example.org")
+        assert self.publish(client, secret="other").status_code == 403
+        assert self.publish(client, "other", "example.org").status_code == 200
+        Authorisation.objects.all().delete()
+        assert self.publish(client, "other", "example.org").status_code == 403
+
+    def test_per_process(self, settings):
+        settings.ACMEPROXY_AUTHORISATION_CACHE = "default"
+        with pytest.raises(ImproperlyConfigured):
+            authorisation_cache.get_many(["example.com"])
+        with pytest.raises(ImproperlyConfigured):
+            apps.get_app_config("proxy").ready()
+
+    def test_disabled(self, client, settings):
+        settings.ACMEPROXY_AUTHORISATION_CACHE_TIMEOUT = None
+        create_authorisation(name="example.com")
+        stats = authorisation_cache.stats()
+        assert self.publish(client).status_code == 200
+        assert authorisation_cache.stats() == stats
+
+
+@pytest.mark.django_db
+class TestFastPath:
+    cases = [
+        (
+            "publish_response",
+            {"name": "example.com", "response": "r", "secret": "test_secret"},
+        ),
+        (
+            "publish_response",
+            {"name": "EXAMPLE.com", "response": "r", "secret": "wrong"},
+        ),
+        ("publish_response", {"name": "example.com", "secret": "test_secret"}),
+        ("publish_response", {"name": " ", "response": "r", "secret": "test_secret"}),
+        ("expire_response", {"name": "example.com", "secret": "test_secret"}),
+        ("expire_response", {"name": "example.org", "secret": "test_secret"}),
+        ("expire_response", {}),
+        ("create_authorisation", {"name": "example.net"}),
+        ("create_authorisation", {"name": "example.net", "secret": ""}),
+        ("expire_authorisation", {"name": "example.com", "secret": "test_secret"}),
+        ("expire_authorisation", {"name": "example.com", "secret": "wrong"}),
+    ]
+
+    @staticmethod
+    def serve(application, path, body, content_type, method="POST"):
+        environ = (
+            RequestFactory().generic(method, "/" + path, body, content_type).environ
+        )
+        # rolled back, so that both handlers see the same rows
+        with benchmark.kept_connections(), transaction.atomic():
+            status, body = benchmark.wsgi_request(application, environ)
+            transaction.set_rollback(True)
+        result = json.loads(body.decode("utf-8"))
+        if isinstance(result.get("result"), dict) and "secret" in result["result"]:
+            result["result"]["secret"] = "(generated)"
+        return status, result
+
+    def compare(self, path, body, content_type, method="POST"):
+        create_authorisation(name="example.com")
+        create_response(name="example.com")
+        full = self.serve(WSGIHandler(), path, body, content_type, method)
+        fast = self.serve(FastAPIHandler(), path, body, content_type, method)
+        assert fast == full
+        return fast
+
+    @pytest.mark.parametrize("path,data", cases)
+    def test_form(self, path, data):
+        self.compare(path, urlencode(data), "application/x-www-form-urlencoded")
+
+    @pytest.mark.parametrize("path,data", cases)
+    def test_json(self, path, data):
+        self.compare(path, json.dumps(data), "application/json")
+
+    @pytest.mark.parametrize(
+        "body,content_type",
+        [
+            (
+                '{"name": 1, "response": true, "secret": ["test_secret"]}',
+                "application/json",
+            ),
+            ("[]", "application/json"),
+            ("{", "application/json"),
+            ("name=example.com", "text/plain"),
+        ],
+    )
+    def test_invalid(self, body, content_type):
+        status, result = self.compare("publish_response", body, content_type)
+        assert status in (400, 415)
+
+    def test_method_not_allowed(self):
+        status, result = self.compare("publish_response", "", "", method="GET")
+        assert status == 405
+
+    def test_bulk_endpoints(self):
+        body = json.dumps(
+            {
+                "responses": [
+                    {"name": "example.com", "response": "r", "secret": "test_secret"}
+                ]
+            }
+        )
+        status, result = self.compare("publish_responses", body, "application/json")
+        assert status == 200
+
+    def test_publish(self):
+        create_authorisation(name="example.com")
+        environ = (
+            RequestFactory()
+            .post(
+                "/publish_response",
+                {"name": "example.com", "response": "r", "secret": "test_secret"},
+                REMOTE_ADDR="192.0.2.1",
+            )
+            .environ
+        )
+        with benchmark.kept_connections():
+            status, body = benchmark.wsgi_request(FastAPIHandler(), environ)
+        assert status == 200
+        response = Response.objects.get()
+        assert response.response == "r"
+        assert response.created_by_ip == "192.0.2.1"
+
+
+def asgi_request(application, path, fields=None, method="POST"):
+    """
+    Returns a coroutine which makes a request to an ASGI application, and
+    returns the status code and decoded JSON (or for other content types, the
+    text) of the response.
+    """
+
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "query_string": b"",
+        "headers": [
+            (b"host", b"testserver"),
+            (b"content-type", b"application/x-www-form-urlencoded"),
+        ],
+        "client": ("192.0.2.1", 1234),
+        "server": ("testserver", 80),
+    }
+    received = [
+        {
+            "type": "http.request",
+            "body": urlencode(fields or {}).encode("utf-8"),
+            "more_body": False,
+        }
+    ]
+    sent = []
+
+    async def receive():
+        return received.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    async def request():
+        await application(scope, receive, send)
+        body = b"".join(message.get("body", b"") for message in sent[1:])
+        headers = {name.lower(): value for name, value in sent[0]["headers"]}
+        if headers.get(b"content-type", b"").startswith(b"application/json"):
+            return sent[0]["status"], json.loads(body.decode("utf-8"))
+        return sent[0]["status"], body.decode("utf-8")
+
+    return request()
+
+
+@pytest.mark.django_db(transaction=True)
+class TestASGI:
+    names = ["host%d.example.com" % i for i in range(40)]
+
+    # the in-memory SQLite test database fails concurrent writers at once
+    # rather than making them wait, so this relies on the views retrying them
+    def gather(self, requests, max_workers=4):
+        application = ASGIHandler(max_workers=max_workers)
+
+        async def run():
+            return await asyncio.gather(
+                *[asgi_request(application, *request) for request in requests]
+            )
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(run())
+        finally:
+            loop.close()
+            application.shutdown()
+
+    def test_concurrent_publish_and_expire(self):
+        for name in self.names:
+            create_authorisation(name=name)
+
+        published = self.gather(
+            [
+                (
+                    "/publish_response",
+                    {"name": name, "response": "r", "secret": "test_secret"},
+                )
+                for name in self.names
+            ]
+        )
+        assert published == [
+            (200, {"result": {"authorisation": name, "published": True}})
+            for name in self.names
+        ]
+        assert Response.objects.live().count() == len(self.names)
+        assert set(Response.objects.values_list("created_by_ip", flat=True)) == {
+            "192.0.2.1"
+        }
+
+        expired = self.gather(
+            [
+                ("/expire_response", {"name": name, "secret": "test_secret"})
+                for name in self.names
+            ]
+            + [("/expire_response", {"name": self.names[0], "secret": "wrong"})]
+        )
+        assert expired[:-1] == [
+            (200, {"result": {"authorisation": name, "expired": True}})
+            for name in self.names
+        ]
+        assert expired[-1] == (
+            403,
+            {"result": False, "error": "Invalid authorisation token"},
+        )
+        assert Response.objects.live().count() == 0
+
+    def test_concurrent_authorisations(self):
+        counted = metrics.api_requests.value("create_authorisation", 200)
+        created = self.gather(
+            [("/create_authorisation", {"name": name}) for name in self.names]
+        )
+        assert all(status == 200 for status, result in created)
+        assert metrics.api_requests.value("create_authorisation", 200) == counted + len(
+            self.names
+        )
+        secrets = {
+            result["result"]["authorisation"]: result["result"]["secret"]
+            for status, result in created
+        }
+        assert secrets == dict(Authorisation.objects.values_list("name", "secret"))
+
+        expired = self.gather(
+            [
+                ("/expire_authorisation", {"name": name, "secret": secret})
+                for name, secret in secrets.items()
+            ]
+        )
+        assert all(status == 200 for status, result in expired)
+        assert dict(Authorisation.objects.values_list("name", "secret")) == {
+            result["result"]["authorisation"]: result["result"]["secret"]
+            for status, result in expired
+        }
+
+    def test_lock_held(self, sqlite_file, settings):
+        settings.ACMEPROXY_ASGI_BUSY_TIMEOUT = 10
+        settings.ACMEPROXY_DATABASE_LOCK_RETRIES = 10
+        names = self.names[:8]
+        for name in names:
+            in_thread(create_authorisation, name)
+        application = ASGIHandler(max_workers=2)
+        holder = sqlite3.connect(sqlite_file, isolation_level=None)
+        holder.execute("BEGIN IMMEDIATE")
+
+        async def run():
+            publishing = [
+                asyncio.ensure_future(
+                    asgi_request(
+                        application,
+                        "/publish_response",
+                        {"name": name, "response": "r", "secret": "test_secret"},
+                    )
+                )
+                for name in names
+            ]
+            await asyncio.sleep(0.2)
+            # the publishing requests wait without holding the threads, so
+            # others which only read are still served
+            try:
+                refused = await asyncio.wait_for(
+                    asgi_request(
+                        application,
+                        "/expire_response",
+                        {"name": names[0], "secret": "x"},
+                    ),
+                    timeout=2,
+                )
+                waiting = not any(request.done() for request in publishing)
+            finally:
+                holder.execute("ROLLBACK")
+            return refused, waiting, await asyncio.gather(*publishing)
+
+        loop = asyncio.new_event_loop()
+        try:
+            refused, waiting, published = loop.run_until_complete(run())
+        finally:
+            loop.close()
+            application.shutdown()
+            holder.close()
+
+        assert refused[0] == 403
+        assert waiting
+        assert published == [
+            (200, {"result": {"authorisation": name, "published": True}})
+            for name in names
+        ]
+        assert in_thread(Response.objects.count) == len(names)
+
+    def test_errors(self, settings, monkeypatch):
+        fields = {"name": "example.com", "response": "r" * 20, "secret": "test_secret"}
+        settings.DATA_UPLOAD_MAX_MEMORY_SIZE = 10
+        counted = metrics.api_requests.value("publish_response", 400)
+        [(status, body)] = self.gather([("/publish_response", fields)])
+        assert status == 400
+        assert metrics.api_requests.value("publish_response", 400) == counted + 1
+
+        def fail(*args, **kwargs):
+            raise RuntimeError("unexpected")
+
+        settings.DATA_UPLOAD_MAX_MEMORY_SIZE = None
+        monkeypatch.setattr(fastpath.publish_response, "operation", fail)
+        monkeypatch.setattr(ASGIHandler, "serve_wsgi", fail)
+        counted = metrics.api_requests.value("publish_response", 500)
+        results = self.gather(
+            [("/publish_response", fields), ("/publish_responses", fields)]
+        )
+        assert [status for status, body in results] == [500, 500]
+        assert metrics.api_requests.value("publish_response", 500) == counted + 1
+
+    def test_same_as_drf(self, client):
+        create_authorisation(name="example.com")
+        requests = [
+            ("/publish_response", {"name": "example.com", "secret": "test_secret"}),
+            ("/expire_response", {"name": "example.com", "secret": "wrong"}),
+            ("/create_authorisation", {"name": ""}),
+            ("/expire_response", {}, "GET"),
+        ]
+        results = self.gather(requests)
+        for (path, fields, *method), result in zip(requests, results):
+            if method:
+                resp = client.get(path)
+            else:
+                resp = client.post(path, data=fields)
+            assert result == (resp.status_code, resp.json())
+
+    def test_other_paths(self):
+        create_authorisation(name="example.com")
+        [(status, result)] = self.gather(
+            [
+                (
+                    "/publish_responses",
+                    {"name": "example.com", "response": "r", "secret": "test_secret"},
+                )
+            ]
+        )
+        # served by DRF, which expects a list of responses
+        assert status == 400
+        assert "responses" in result
@@ -1,3 +1,7 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+
 from acmeproxy.proxy.models import Authorisation, Response
 
 
@@ -11,3 +15,18 @@ def create_response(name):
     Response.objects.create(
         name=name, response="test_response", created_by_ip="127.0.0.1"
     )
+
+
+def in_thread(function, *args):
+    """
+    Calls function in a new thread, with its own database connection.
+    """
+
+    def call():
+        try:
+            return function(*args)
+        finally:
+            connection.close()
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(call).result()
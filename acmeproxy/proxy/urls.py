@@ -1,18 +1,30 @@
 from django.urls import path
 
-from . import views
+from . import metrics, views
 
 urlpatterns = [
     path("publish_response", views.PublishResponse.as_view(), name="publish_response"),
+    path(
+        "publish_responses",
+        views.PublishResponses.as_view(),
+        name="publish_responses",
+    ),
     path("expire_response", views.ExpireResponse.as_view(), name="expire_response"),
+    path("expire_responses", views.ExpireResponses.as_view(), name="expire_responses"),
     path(
         "create_authorisation",
         views.CreateAuthorisation.as_view(),
         name="create_authorisation",
     ),
+    path(
+        "create_authorisations",
+        views.CreateAuthorisations.as_view(),
+        name="create_authorisations",
+    ),
     path(
         "expire_authorisation",
         views.ExpireAuthorisation.as_view(),
         name="expire_authorisation",
     ),
+    path("metrics", metrics.metrics, name="metrics"),
 ]
@@ -1,13 +1,16 @@
 import hmac
 
 from django.conf import settings
-from django.core.exceptions import ObjectDoesNotExist
+from django.db import DatabaseError, transaction
 from django.utils import timezone
 from rest_framework import serializers
 from rest_framework.response import Response as APIResponse
 from rest_framework.views import APIView
 
-from .models import Authorisation, Response
+from .authcache import authorisation_cache, secret_digest
+from .database import database_operation, retry_locked
+from .models import Authorisation, DataVersion, Response
+from .permits import account_permits
 
 
 # stolen from https://stackoverflow.com/a/4581997
@@ -25,14 +28,163 @@ def get_authorisation(name, secret):
     Attempts to find a valid authorisation for the given name and secret combination.
     """
 
-    try:  # try and find an explicit authorisation
-        authorisation = Authorisation.objects.get(name__iexact=name)
-        if not hmac.compare_digest(authorisation.secret, secret):
-            raise ObjectDoesNotExist
-    except ObjectDoesNotExist:
-        return False
+    return get_authorisations([(name, secret)])[0]
 
-    return authorisation
+
+def get_authorisations(names_and_secrets):
+    """
+    Like get_authorisation for many (name, secret) pairs at once, using at most
+    one query. Returns the authorisation (or False) for each pair, in order.
+
+    The authorisations returned only have their primary key, name and account
+    loaded, so save them with update_fields.
+    """
+
+    names = {name.lower() for name, secret in names_and_secrets}
+    entries, tokens = authorisation_cache.get_many(names)
+
+    missing = names.difference(entries)
+    if missing:
+        found = {}
+        for authorisation in Authorisation.objects.filter(
+            normalised_name__in=missing
+        ).order_by("pk"):
+            found.setdefault(
+                authorisation.normalised_name,
+                authorisation_cache.entry(authorisation),
+            )
+        authorisation_cache.set_many(found, tokens)
+        entries.update(found)
+
+    results = []
+    for name, secret in names_and_secrets:
+        entry = entries.get(name.lower())
+        if entry is None or not hmac.compare_digest(
+            entry["digest"], secret_digest(secret)
+        ):
+            results.append(False)
+        else:
+            results.append(
+                Authorisation(
+                    pk=entry["pk"],
+                    name=entry["name"],
+                    normalised_name=name.lower(),
+                    account=entry["account"],
+                )
+            )
+    return results
+
+
+# The endpoints which act on a single name are implemented by these
+# functions, which take the validated request data and return the result and
+# HTTP status code, so that the DRF views and the fast path views (see
+# fastpath.py) always behave the same.
+
+
+@database_operation("Could not save response in database")
+def publish_response(name, response, secret, ip):
+    name = name.lower()
+    authorisation = get_authorisation(name, secret)
+
+    if authorisation:
+        db_response = Response(name=name, response=response, created_by_ip=ip)
+        with transaction.atomic():
+            db_response.save()
+            DataVersion.bump()
+        return (
+            {"result": {"authorisation": authorisation.name, "published": True}},
+            200,
+        )
+
+    return {"result": False, "error": "Invalid authorisation token"}, 403
+
+
+@database_operation("Could not expire responses in database")
+def expire_response(name, secret):
+    name = name.lower()
+    authorisation = get_authorisation(name, secret)
+
+    if authorisation:
+        with transaction.atomic():
+            expired = (
+                Response.objects.live()
+                .filter(normalised_name=name)
+                .update(expired_at=timezone.now())
+                > 0
+            )
+            if expired:
+                DataVersion.bump()
+        return (
+            {"result": {"authorisation": authorisation.name, "expired": expired}},
+            200,
+        )
+
+    return {"result": False, "error": "Invalid authorisation token"}, 403
+
+
+def creation_account(secret):
+    """
+    Returns the name of the account with the given account token, "" if
+    accounts aren't configured, or None if the token is invalid.
+    """
+
+    if settings.ACMEPROXY_AUTHORISATION_CREATION_SECRETS is None:
+        return ""
+    user = settings.ACMEPROXY_AUTHORISATION_CREATION_SECRETS.get(secret, None)
+    return None if user is None else user["name"]
+
+
+NOT_PERMITTED = "Changes to this domain are not permitted with this account token"
+
+
+@database_operation("Could not save authorisation in database")
+def create_authorisation(name, secret, ip):
+    name = name.lower()
+
+    account = creation_account(secret)
+    if account is None:
+        return {"result": False, "error": "Invalid account token"}, 403
+    if not account_permits.permits(secret, name):
+        return {"result": False, "error": NOT_PERMITTED}, 403
+
+    db_authorisation = Authorisation(name=name, created_by_ip=ip, account=account)
+    db_authorisation.reset_secret()
+    db_authorisation.save()
+
+    return (
+        {
+            "result": {
+                "authorisation": db_authorisation.name,
+                "secret": db_authorisation.secret,
+            }
+        },
+        200,
+    )
+
+
+@database_operation("Could not save authorisation in database")
+def expire_authorisation(name, secret):
+    name = name.lower()
+    authorisation = get_authorisation(name, secret)
+
+    if authorisation:
+        authorisation.reset_secret()
+        authorisation.save(update_fields=["secret"])
+        return (
+            {
+                "result": {
+                    "authorisation": authorisation.name,
+                    "secret": authorisation.secret,
+                }
+            },
+            200,
+        )
+
+    return {"result": False, "error": "Invalid authorisation token"}, 403
+
+
+# the most entries accepted by the bulk endpoints in a single request
+BULK_LIMIT = 1000
 
 
 class PublishResponseSerializer(serializers.Serializer):
@@ -47,31 +199,68 @@ class PublishResponse(APIView):
         if not serializer.is_valid():
             return APIResponse(serializer.errors, status=400)
 
-        name = serializer.data["name"].lower()
-        response = serializer.data["response"]
-        secret = serializer.data["secret"]
+        result, status = publish_response(ip=client_ip(request), **serializer.data)
+        return APIResponse(result, status=status)
 
-        authorisation = get_authorisation(name, secret)
 
-        if authorisation:
-            try:
-                db_response = Response(
-                    name=name, response=response, created_by_ip=client_ip(request)
+class PublishResponsesSerializer(serializers.Serializer):
+    responses = PublishResponseSerializer(many=True, allow_empty=False)
+
+    def validate_responses(self, value):
+        if len(value) > BULK_LIMIT:
+            raise serializers.ValidationError(
+                "No more than %d responses may be published at once" % BULK_LIMIT
+            )
+        return value
+
+
+class PublishResponses(APIView):
+    def post(self, request, format=None):
+        serializer = PublishResponsesSerializer(data=request.data)
+        if not serializer.is_valid():
+            return APIResponse(serializer.errors, status=400)
+
+        entries = [
+            (entry["name"].lower(), entry["response"], entry["secret"])
+            for entry in serializer.data["responses"]
+        ]
+        authorisations = get_authorisations(
+            [(name, secret) for name, response, secret in entries]
+        )
+
+        ip = client_ip(request)
+        db_responses = []
+        results = []
+        for (name, response, secret), authorisation in zip(entries, authorisations):
+            if authorisation:
+                db_response = Response(name=name, response=response, created_by_ip=ip)
+                db_response.normalise_name()
+                db_responses.append(db_response)
+                results.append({"authorisation": authorisation.name, "published": True})
+            else:
+                results.append(
+                    {
+                        "name": name,
+                        "published": False,
+                        "error": "Invalid authorisation token",
+                    }
                 )
-                db_response.save()
-            except:
+
+        def save():
+            with transaction.atomic():
+                Response.objects.bulk_create(db_responses)
+                DataVersion.bump()
+
+        if db_responses:
+            try:
+                retry_locked(save)
+            except DatabaseError:
                 return APIResponse(
-                    {"result": False, "error": "Could not save response in database"},
+                    {"result": False, "error": "Could not save responses in database"},
                     status=500,
                 )
-            else:
-                return APIResponse(
-                    {"result": {"authorisation": authorisation.name, "published": True}}
-                )
 
-        return APIResponse(
-            {"result": False, "error": "Invalid authorisation token"}, status=403
-        )
+        return APIResponse({"result": results})
 
 
 class NameSecretSerializer(serializers.Serializer):
@@ -85,25 +274,76 @@ class ExpireResponse(APIView):
         if not serializer.is_valid():
             return APIResponse(serializer.errors, status=400)
 
-        name = serializer.data["name"].lower()
-        secret = serializer.data["secret"]
+        result, status = expire_response(**serializer.data)
+        return APIResponse(result, status=status)
 
-        authorisation = get_authorisation(name, secret)
 
-        if authorisation:
-            expired = (
-                Response.objects.filter(name__iexact=name).update(
-                    expired_at=timezone.now()
-                )
-                > 0
-            )
-            return APIResponse(
-                {"result": {"authorisation": authorisation.name, "expired": expired}}
+class ExpireResponsesSerializer(serializers.Serializer):
+    responses = NameSecretSerializer(many=True, allow_empty=False)
+
+    def validate_responses(self, value):
+        if len(value) > BULK_LIMIT:
+            raise serializers.ValidationError(
+                "No more than %d names may be expired at once" % BULK_LIMIT
             )
+        return value
 
-        return APIResponse(
-            {"result": False, "error": "Invalid authorisation token"}, status=403
-        )
+
+class ExpireResponses(APIView):
+    def post(self, request, format=None):
+        serializer = ExpireResponsesSerializer(data=request.data)
+        if not serializer.is_valid():
+            return APIResponse(serializer.errors, status=400)
+
+        entries = [
+            (entry["name"].lower(), entry["secret"])
+            for entry in serializer.data["responses"]
+        ]
+        authorisations = get_authorisations(entries)
+        names = {
+            name
+            for (name, secret), authorisation in zip(entries, authorisations)
+            if authorisation
+        }
+
+        def expire():
+            live = Response.objects.live().filter(normalised_name__in=names)
+            with transaction.atomic():
+                expired = set(live.values_list("normalised_name", flat=True).distinct())
+                if expired:
+                    live.update(expired_at=timezone.now())
+                    DataVersion.bump()
+            return expired
+
+        expired = set()
+        if names:
+            try:
+                expired = retry_locked(expire)
+            except DatabaseError:
+                return APIResponse(
+                    {
+                        "result": False,
+                        "error": "Could not expire responses in database",
+                    },
+                    status=500,
+                )
+
+        results = []
+        for (name, secret), authorisation in zip(entries, authorisations):
+            if authorisation:
+                results.append(
+                    {"authorisation": authorisation.name, "expired": name in expired}
+                )
+            else:
+                results.append(
+                    {
+                        "name": name,
+                        "expired": False,
+                        "error": "Invalid authorisation token",
+                    }
+                )
+
+        return APIResponse({"result": results})
 
 
 class NameSecretOptionalSerializer(serializers.Serializer):
@@ -117,94 +357,86 @@ class CreateAuthorisation(APIView):
         if not serializer.is_valid():
             return APIResponse(serializer.errors, status=400)
 
-        name = serializer.data["name"].lower()
-        secret = serializer.data.get("secret", "")
+        result, status = create_authorisation(
+            serializer.data["name"],
+            serializer.data.get("secret", ""),
+            client_ip(request),
+        )
+        return APIResponse(result, status=status)
 
-        if settings.ACMEPROXY_AUTHORISATION_CREATION_SECRETS is not None:
-            user = settings.ACMEPROXY_AUTHORISATION_CREATION_SECRETS.get(secret, None)
-            if user is None:
-                return APIResponse(
-                    {"result": False, "error": "Invalid account token"}, status=403
-                )
-            else:
-                allowed = True
-                if "permit" in user:
-                    allowed = False
-                    for permit_name in user["permit"]:
-                        if (
-                            permit_name.startswith(".") and name.endswith(permit_name)
-                        ) or (not permit_name.startswith(".") and permit_name == name):
-                            allowed = True
-                            break
-                if not allowed:
-                    return APIResponse(
-                        {
-                            "result": False,
-                            "error": "Changes to this domain are not permitted with this account token",
-                        },
-                        status=403,
-                    )
-
-                account = user["name"]
-        else:
-            account = ""
 
-        db_authorisation = Authorisation(
-            name=name, created_by_ip=client_ip(request), account=account
-        )
-        db_authorisation.reset_secret()
+class CreateAuthorisationsSerializer(serializers.Serializer):
+    names = serializers.ListField(
+        child=serializers.CharField(max_length=255), allow_empty=False
+    )
+    secret = serializers.CharField(required=False)
 
-        try:
-            db_authorisation.save()
-        except:
-            return APIResponse(
-                {"result": False, "error": "Could not save authorisation in database"},
-                status=500,
+    def validate_names(self, value):
+        if len(value) > BULK_LIMIT:
+            raise serializers.ValidationError(
+                "No more than %d authorisations may be created at once" % BULK_LIMIT
             )
-
-        return APIResponse(
-            {
-                "result": {
-                    "authorisation": db_authorisation.name,
-                    "secret": db_authorisation.secret,
-                }
-            }
-        )
+        if len({name.lower() for name in value}) < len(value):
+            raise serializers.ValidationError("Each name may only be given once")
+        return value
 
 
-class ExpireAuthorisation(APIView):
+class CreateAuthorisations(APIView):
     def post(self, request, format=None):
-        serializer = NameSecretSerializer(data=request.data)
+        serializer = CreateAuthorisationsSerializer(data=request.data)
         if not serializer.is_valid():
             return APIResponse(serializer.errors, status=400)
 
-        name = serializer.data["name"].lower()
-        secret = serializer.data["secret"]
+        names = [name.lower() for name in serializer.data["names"]]
+        secret = serializer.data.get("secret", "")
+        account = creation_account(secret)
+        if account is None:
+            return APIResponse(
+                {"result": False, "error": "Invalid account token"}, status=403
+            )
+        permitted = account_permits.permits_many(secret, names)
+
+        ip = client_ip(request)
+        db_authorisations = []
+        results = []
+        for name, permit in zip(names, permitted):
+            if permit:
+                db_authorisation = Authorisation(
+                    name=name, created_by_ip=ip, account=account
+                )
+                db_authorisation.reset_secret()
+                db_authorisation.normalise_name()
+                db_authorisations.append(db_authorisation)
+                results.append(
+                    {"authorisation": name, "secret": db_authorisation.secret}
+                )
+            else:
+                results.append({"name": name, "error": NOT_PERMITTED})
 
-        authorisation = get_authorisation(name, secret)
+        def save():
+            with transaction.atomic():
+                Authorisation.objects.bulk_create(db_authorisations)
 
-        if authorisation:
+        if db_authorisations:
             try:
-                authorisation.reset_secret()
-                authorisation.save()
-            except:
+                retry_locked(save)
+            except DatabaseError:
                 return APIResponse(
                     {
                         "result": False,
-                        "error": "Could not save authorisation in database",
+                        "error": "Could not save authorisations in database",
                     },
                     status=500,
                 )
-            else:
-                return APIResponse(
-                    {
-                        "result": {
-                            "authorisation": authorisation.name,
-                            "secret": authorisation.secret,
-                        }
-                    }
-                )
 
-        return APIResponse(
-            {"result": False, "error": "Invalid authorisation token"}, status=403
-        )
+        return APIResponse({"result": results})
+
+
+class ExpireAuthorisation(APIView):
+    def post(self, request, format=None):
+        serializer = NameSecretSerializer(data=request.data)
+        if not serializer.is_valid():
+            return APIResponse(serializer.errors, status=400)
+
+        result, status = expire_authorisation(**serializer.data)
+        return APIResponse(result, status=status)
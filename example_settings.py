@@ -1,3 +1,5 @@
+from datetime import timedelta  # noqa: F401
+
 from acmeproxy.acmeproxy import settings  # noqa: F401
 from acmeproxy.acmeproxy.settings import *  # noqa: F401, F403
 
@@ -27,3 +29,86 @@ ACMEPROXY_AUTHORISATION_CREATION_SECRETS = None
 #         'name': 'developers',
 #     }
 # }
+#
+# 'permit' entries without a leading dot match that name exactly, those with one
+# match any name below it. The lists are compiled when the app starts.
+#
+# To change permit lists without restarting, put them in a JSON file mapping
+# account names to lists instead, e.g. {"operations-team": ["example.com"]}. Each
+# process reloads it on its next request after the file's modification time changes
+# (replace it atomically, e.g. with mv), keeping the previous lists if it is invalid.
+# An account's list in the file replaces the one given here.
+#
+# ACMEPROXY_PERMITS_FILE = "/etc/acmeproxy/permits.json"
+
+# responses stop being served this long after they are published, even if they
+# are never explicitly expired
+#
+# ACMEPROXY_RESPONSE_LIFETIME = timedelta(minutes=5)
+
+# if set, each pipeapi backend keeps an in-memory index of the records it serves,
+# polling the database for changes at most this often (in seconds)
+#
+# ACMEPROXY_RECORD_CACHE_INTERVAL = 1
+
+# otherwise, if set, each pipeapi backend answers questions for names which can't
+# have records from memory, checking for changes at most this often (in seconds)
+#
+# ACMEPROXY_MISS_CACHE_INTERVAL = 0
+
+# if set, published responses older than this are removed by the purgeresponses
+# command, and by the remotebackend command every ACMEPROXY_RESPONSE_PURGE_INTERVAL
+# seconds if that is also set
+#
+# ACMEPROXY_RESPONSE_RETENTION = timedelta(days=90)
+# ACMEPROXY_RESPONSE_PURGE_INTERVAL = 3600
+
+# if set, the API caches authorisation lookups for this many seconds in the named
+# Django cache. Changes are invalidated as they are made, so the cache must be
+# shared (e.g. memcached) between the web server's processes and the management
+# commands, per-process caches such as the default LocMemCache are refused
+#
+# CACHES = {
+#     "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+#     "authorisations": {
+#         "BACKEND": "django.core.cache.backends.memcached.MemcachedCache",
+#         "LOCATION": "127.0.0.1:11211",
+#     },
+# }
+# ACMEPROXY_AUTHORISATION_CACHE = "authorisations"
+# ACMEPROXY_AUTHORISATION_CACHE_TIMEOUT = 60
+
+# the middleware run for requests served by acmeproxy.acmeproxy.fastwsgi
+#
+# ACMEPROXY_FAST_MIDDLEWARE = (
+#     "acmeproxy.proxy.metrics.MetricsMiddleware",
+#     "django.middleware.security.SecurityMiddleware",
+# )
+
+# the number of threads acmeproxy.acmeproxy.asgi runs database work in, and how
+# many milliseconds that work waits on a SQLite lock before giving its thread
+# back and retrying after a backoff on the event loop
+#
+# ACMEPROXY_ASGI_THREADS = 8
+# ACMEPROXY_ASGI_BUSY_TIMEOUT = 100
+
+# the pragmas set on each new SQLite connection (the default shown), and how many
+# times API requests which find the database locked are retried
+#
+# ACMEPROXY_SQLITE_PRAGMAS = {"journal_mode": "wal", "busy_timeout": 5000, "synchronous": "normal"}
+# ACMEPROXY_DATABASE_LOCK_RETRIES = 5
+
+# serve the API's request counts and latency histograms at /metrics, and have
+# each pipeapi backend write its own to this file ({pid} is replaced with its
+# process ID) every ACMEPROXY_PIPEAPI_METRICS_INTERVAL seconds
+#
+# ACMEPROXY_METRICS = True
+# ACMEPROXY_PIPEAPI_METRICS_FILE = "/var/lib/node_exporter/acmeproxy-pipeapi-{pid}.prom"
+# ACMEPROXY_PIPEAPI_METRICS_INTERVAL = 10
+
+# log pipeapi questions taking at least this many seconds, with the time spent in
+# each stage, and profile a sample of questions, writing the stats to this file
+# ({pid} is replaced with the process ID) every minute
+#
+# ACMEPROXY_PIPEAPI_SLOW_THRESHOLD = 0.1
+# ACMEPROXY_PIPEAPI_PROFILE_FILE = "/var/tmp/acmeproxy-pipeapi-{pid}.prof"
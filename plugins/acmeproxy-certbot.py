@@ -30,46 +30,122 @@ Make sure the acmeproxy.ini file isn't world readable, then run certbot
 with the options necessary in your environment, e.g.
 
   certbot  --manual --installer=apache
+
+The acmeproxy.client package must be importable: install acmeproxy, or copy
+its acmeproxy directory (__init__.py and client are all that's needed) next
+to this script.
+
+certbot runs the hook once for each domain. While it reports that
+challenges remain (certbot 0.33 and later), the hook only notes the domain
+in the spool directory, and the last run publishes (or expires) the
+responses for all of them with one request to each endpoint.
 """
 
 import argparse
-import configparser
+import hashlib
+import json
 import os
-import stat
 import sys
+import tempfile
+import time
+from collections import OrderedDict
+
+try:
+    import acmeproxy.client
+except ImportError:
+    # look next to this script, then in the checkout of the repository it is in
+    directory = os.path.dirname(os.path.abspath(os.path.realpath(__file__)))
+    sys.path[:0] = [directory, os.path.dirname(directory)]
+    import acmeproxy.client
+
+# spooled challenges older than this are left over from a failed run
+SPOOL_LIFETIME = 3600
 
-import requests
-
-
-class AcmeproxyClient(object):
-    def __init__(self, endpoint, secret, domain, challenge):
-        self.endpoint = endpoint
-        self.secret = secret
-        self.domain = domain
-        self.challenge = challenge
-
-    def publish_record(self, challenge):
-        print(
-            requests.post(
-                "%s/publish_response" % (self.endpoint,),
-                data={
-                    "name": self.domain,
-                    "secret": self.secret,
-                    "response": self.challenge,
-                },
-            ).text
-        )
 
-    def delete_record(self):
-        print(
-            requests.post(
-                "%s/expire_response" % (self.endpoint,),
-                data={"name": self.domain, "secret": self.secret},
-            ).text
+def default_spool_directory():
+    return os.path.join(tempfile.gettempdir(), "acmeproxy-certbot-%d" % os.getuid())
+
+
+def spool_path(directory, hook, environ):
+    """
+    Returns the file the challenges of this certbot run are noted in, creating
+    the directory (which only its owner may use) if need be.
+    """
+
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    status = os.lstat(directory)
+    if status.st_uid != os.getuid() or status.st_mode & 0o077:
+        raise acmeproxy.client.ConfigurationError(
+            "spool directory '%s' must be owned by and only accessible to this "
+            "user" % directory
         )
+    run = hashlib.sha1(environ.get("CERTBOT_ALL_DOMAINS", "").encode("utf-8"))
+    return os.path.join(directory, "%s-%s.jsonl" % (hook, run.hexdigest()))
 
 
-if __name__ == "__main__":
+def spool(path, domain, challenge):
+    with open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps({"domain": domain, "challenge": challenge}) + "\n")
+
+
+def unspool(path):
+    """
+    Returns the challenges noted in path, and removes it.
+    """
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            stale = time.time() - os.fstat(f.fileno()).st_mtime > SPOOL_LIFETIME
+            entries = [json.loads(line) for line in f if line.strip()]
+    except FileNotFoundError:
+        return []
+    os.unlink(path)
+    if stale:
+        return []
+    return [(entry["domain"], entry["challenge"]) for entry in entries]
+
+
+def run(hook, challenges, domains, timeout, retries):
+    """
+    Publishes or expires the responses for challenges, a list of (domain,
+    challenge), with one request to each endpoint. Returns True if all of them
+    succeeded.
+    """
+
+    endpoints = OrderedDict()
+    for domain, challenge in challenges:
+        endpoint, secret = acmeproxy.client.domain_configuration(domains, domain)
+        endpoints.setdefault(endpoint, []).append((domain, challenge, secret))
+
+    succeeded = True
+    for endpoint, entries in endpoints.items():
+        with acmeproxy.client.AcmeproxyClient(
+            endpoint, timeout=timeout, retries=retries
+        ) as client:
+            try:
+                if hook == "auth":
+                    results = client.publish_responses(entries)
+                else:
+                    names = OrderedDict(
+                        ((domain, secret), None)
+                        for domain, challenge, secret in entries
+                    )
+                    results = client.expire_responses(list(names))
+            except acmeproxy.client.AcmeproxyError as e:
+                sys.stderr.write("error: %s\n" % e)
+                succeeded = False
+                continue
+        for result in results:
+            print(json.dumps(result))
+            if "error" in result:
+                succeeded = False
+    return succeeded
+
+
+def main(argv=None, environ=os.environ):
     parser = argparse.ArgumentParser(
         description=__doc__, formatter_class=argparse.RawTextHelpFormatter
     )
@@ -80,82 +156,62 @@ if __name__ == "__main__":
         default="/etc/acmeproxy.ini",
         help="path to the configuration file, defaults to /etc/acmeproxy.ini",
     )
+    parser.add_argument(
+        "--spool-directory",
+        metavar="PATH",
+        type=str,
+        default=default_spool_directory(),
+        help="where challenges are noted until the last hook of a certbot run",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        default=10,
+        help="seconds to wait for the API, defaults to 10",
+    )
+    parser.add_argument(
+        "--retries",
+        type=int,
+        default=3,
+        help="how many times to retry failed requests, defaults to 3",
+    )
     parser.add_argument(
         "hook", metavar="HOOK", type=str, help="hook to execute, either auth or cleanup"
     )
-    args = parser.parse_args()
-    config = configparser.ConfigParser()
+    args = parser.parse_args(argv)
 
-    try:
-        try:
-            if os.stat(args.configuration_path).st_mode & stat.S_IROTH:
-                sys.stderr.write(
-                    "error: configuration is world readable, fix the file permissions and re-create exposed keys"
-                )
-                sys.exit(1)
-        except FileNotFoundError:
-            sys.stderr.write(
-                "error: configuration file '%s' does not exist\n"
-                % args.configuration_path
-            )
-            sys.exit(1)
-        else:
-            if not os.access(args.configuration_path, os.R_OK):
-                raise
-            config.read(args.configuration_path)
-    except:
-        sys.stderr.write(
-            "error: unable to read the configuration file from '%s'\n"
-            % args.configuration_path
-        )
-        sys.exit(1)
+    if args.hook not in ("auth", "cleanup"):
+        sys.stderr.write("error: unhandled hook '%s'\n" % args.hook)
+        return 2
 
     try:
-        domain = os.environ["CERTBOT_DOMAIN"].lower()
-        challenge = os.environ["CERTBOT_VALIDATION"]
-    except:
+        domain = environ["CERTBOT_DOMAIN"].lower()
+        challenge = environ["CERTBOT_VALIDATION"]
+    except KeyError:
         sys.stderr.write(
             "error: CERTBOT_DOMAIN and CERTBOT_VALIDATION must be set in the environment\n"
         )
-        sys.exit(1)
-
-    section_pattern = "domain:"
-    all_domain_metadata = {}
-    for section in config.sections():
-        if not section.lower().startswith(section_pattern):
-            continue
-        section_domain = section[len(section_pattern) :].lower()
-        all_domain_metadata[section_domain] = {
-            "endpoint": config[section].get(
-                "endpoint", config.get("defaults", "endpoint", fallback=None)
-            ),
-            "secret": config[section].get(
-                "secret", config.get("defaults", "secret", fallback=None)
-            ),
-        }
-
-    if domain not in all_domain_metadata:
-        sys.stderr.write(
-            "error: domain '%s' not found in configuration file\n" % domain
-        )
-        sys.exit(1)
+        return 1
 
-    domain_metadata = all_domain_metadata[domain]
-    if domain_metadata["secret"] is None or domain_metadata["endpoint"] is None:
-        sys.stderr.write(
-            "error: domain '%s' is missing required configuration, 'endpoint' and 'secret' must be configured\n"
-            % domain
+    try:
+        domains = acmeproxy.client.load_configuration(args.configuration_path)
+        acmeproxy.client.domain_configuration(domains, domain)
+
+        challenges = [(domain, challenge)]
+        remaining = environ.get("CERTBOT_REMAINING_CHALLENGES")
+        if remaining is not None:
+            path = spool_path(args.spool_directory, args.hook, environ)
+            if int(remaining) > 0:
+                spool(path, domain, challenge)
+                return 0
+            challenges = unspool(path) + challenges
+        return (
+            0 if run(args.hook, challenges, domains, args.timeout, args.retries) else 1
         )
-        sys.exit(1)
+    except (acmeproxy.client.ConfigurationError, OSError, ValueError) as e:
+        sys.stderr.write("error: %s\n" % e)
+        return 1
 
-    client = AcmeproxyClient(
-        domain_metadata["endpoint"], domain_metadata["secret"], domain, challenge
-    )
 
-    if args.hook == "auth":
-        client.publish_record(challenge)
-    elif args.hook == "cleanup":
-        client.delete_record()
-    else:
-        sys.stderr.write("error: unhandled hook '%s'\n" % args.hook)
-        sys.exit(2)
+if __name__ == "__main__":
+    sys.exit(main())